@@ -41,14 +41,11 @@ from core.model import (
     Edition,
     ExternalIntegration,
     Genre,
-    Hold,
     Hyperlink,
     Identifier,
     Library,
     LicensePool,
-    Loan,
     Measurement,
-    Patron,
     PresentationCalculationPolicy,
     Representation,
     RightsStatus,
@@ -98,7 +95,7 @@ from core.classifier import (
 )
 from datetime import datetime, timedelta
 from sqlalchemy.sql import func
-from sqlalchemy.sql.expression import desc, nullslast, or_, and_, distinct, select, join
+from sqlalchemy.sql.expression import desc, nullslast, or_
 from sqlalchemy.orm import lazyload
 
 from api.admin.templates import admin as admin_template
@@ -118,6 +115,7 @@ from core.local_analytics_provider import LocalAnalyticsProvider
 
 from api.adobe_vendor_id import AuthdataUtility
 from api.admin.template_styles import *
+from api.admin.dashboard_stats import DashboardStatistics
 
 from core.selftest import HasSelfTests
 
@@ -1746,17 +1744,39 @@ class LanesController(AdminCirculationManagerController):
         self.require_librarian(library)
 
         if flask.request.method == "GET":
-            def lanes_for_parent(parent):
-                lanes = self._db.query(Lane).filter(Lane.library==library).filter(Lane.parent==parent).order_by(Lane.priority)
+            # Load every lane in the library, along with its custom
+            # list IDs, in one query, and build the tree from that.
+            qu = self._db.query(Lane, CustomList.id).outerjoin(
+                Lane.customlists
+            ).filter(
+                Lane.library==library
+            ).order_by(
+                Lane.priority, Lane.id, CustomList.id
+            )
+            sublanes = {}
+            custom_list_ids = {}
+            for lane, custom_list_id in qu:
+                if lane.id not in custom_list_ids:
+                    custom_list_ids[lane.id] = []
+                    sublanes.setdefault(lane.parent_id, []).append(lane)
+                if custom_list_id is not None:
+                    custom_list_ids[lane.id].append(custom_list_id)
+
+            def lanes_for_parent(parent_id):
                 return [{ "id": lane.id,
                           "display_name": lane.display_name,
                           "visible": lane.visible,
                           "count": lane.size,
-                          "sublanes": lanes_for_parent(lane),
-                          "custom_list_ids": [list.id for list in lane.customlists],
+                          "sublanes": lanes_for_parent(lane.id),
+                          "custom_list_ids": custom_list_ids[lane.id],
                           "inherit_parent_restrictions": lane.inherit_parent_restrictions,
-                          } for lane in lanes]
-            return dict(lanes=lanes_for_parent(None))
+                          } for lane in sublanes.get(parent_id, [])]
+
+            # The ETag lets the admin interface skip the response if
+            # the lanes haven't changed since it last asked.
+            response = flask.jsonify(lanes=lanes_for_parent(None))
+            response.add_etag()
+            return response.make_conditional(flask.request)
 
         if flask.request.method == "POST":
             self.require_library_manager(flask.request.library)
@@ -1897,7 +1917,26 @@ class LanesController(AdminCirculationManagerController):
 
 class DashboardController(AdminCirculationManagerController):
 
+    # Circulation events are exported this many at a time.
+    CIRCULATION_EVENTS_CHUNK_SIZE = 1000
+
     def stats(self):
+        # The statistics are calculated ahead of time by
+        # DashboardStatisticsScript, but a librarian can pass
+        # recompute=true to recalculate them now.
+        dashboard_statistics = DashboardStatistics(self._db)
+        if flask.request.args.get("recompute", "").lower() == "true":
+            admin = getattr(flask.request, "admin", None)
+            if not admin or not any(
+                admin.is_librarian(library)
+                for library in self._db.query(Library)
+            ):
+                raise AdminNotAuthorized()
+            statistics = dashboard_statistics.recalculate()
+        else:
+            statistics = dashboard_statistics.get()
+        computed_at = statistics["computed_at"]
+
         library_stats = {}
 
         total_title_count = 0
@@ -1909,43 +1948,11 @@ class DashboardController(AdminCirculationManagerController):
             if not flask.request.admin or not flask.request.admin.can_see_collection(collection):
                 continue
 
-            licensed_title_count = self._db.query(
-                LicensePool
-            ).filter(
-                LicensePool.collection_id == collection.id
-            ).filter(
-                and_(
-                    LicensePool.licenses_owned > 0,
-                    LicensePool.open_access == False,
-                )
-            ).count()
-
-            open_title_count = self._db.query(
-                LicensePool
-            ).filter(
-                LicensePool.collection_id == collection.id
-            ).filter(
-                LicensePool.open_access == True
-            ).count()
-
-            # The sum queries return None instead of 0 if there are
-            # no license pools in the db.
-
-            license_count = self._db.query(
-                func.sum(LicensePool.licenses_owned)
-            ).filter(
-                LicensePool.collection_id == collection.id
-            ).filter(
-                LicensePool.open_access == False,
-            ).all()[0][0] or 0
-
-            available_license_count = self._db.query(
-                func.sum(LicensePool.licenses_available)
-            ).filter(
-                LicensePool.collection_id == collection.id
-            ).filter(
-                LicensePool.open_access == False,
-            ).all()[0][0] or 0
+            counts = statistics["collections"].get(str(collection.id), {})
+            licensed_title_count = counts.get("licensed_titles", 0)
+            open_title_count = counts.get("open_access_titles", 0)
+            license_count = counts.get("licenses", 0)
+            available_license_count = counts.get("available_licenses", 0)
 
             total_title_count += licensed_title_count + open_title_count
             total_license_count += license_count
@@ -1958,77 +1965,12 @@ class DashboardController(AdminCirculationManagerController):
                 available_licenses=available_license_count,
             )
 
-
         for library in self._db.query(Library):
             # Only include libraries this admin has librarian access to.
             if not flask.request.admin or not flask.request.admin.is_librarian(library):
                 continue
 
-            patron_count = self._db.query(Patron).filter(Patron.library_id==library.id).count()
-
-            active_loans_patron_count = self._db.query(
-                distinct(Patron.id)
-            ).join(
-                Patron.loans
-            ).filter(
-                Loan.end >= datetime.now(),
-            ).filter(
-                Patron.library_id == library.id
-            ).count()
-
-            active_patrons = select(
-                [Patron.id]
-            ).select_from(
-                join(
-                    Loan,
-                    Patron,
-                    and_(
-                        Patron.id == Loan.patron_id,
-                        Patron.library_id == library.id,
-                        Loan.id != None,
-                        Loan.end >= datetime.now()
-                    )
-                )
-            ).union(
-                select(
-                    [Patron.id]
-                ).select_from(
-                    join(
-                        Hold,
-                        Patron,
-                        Patron.id == Hold.patron_id,
-                        Patron.library_id == library.id,
-                    )
-                )
-            ).alias()
-
-
-            active_loans_or_holds_patron_count_query = select(
-                [func.count(distinct(active_patrons.c.id))]
-            ).select_from(
-                active_patrons
-            )
-
-            result = self._db.execute(active_loans_or_holds_patron_count_query)
-            active_loans_or_holds_patron_count = [r[0] for r in result][0]
-
-            loan_count = self._db.query(
-                Loan
-            ).join(
-                Loan.patron
-            ).filter(
-                Patron.library_id == library.id
-            ).filter(
-                Loan.end >= datetime.now()
-            ).count()
-
-            hold_count = self._db.query(
-                Hold
-            ).join(
-                Hold.patron
-            ).filter(
-                Patron.library_id == library.id
-            ).count()
+            patron_counts = statistics["libraries"].get(str(library.id), {})
 
             title_count = 0
             license_count = 0
@@ -2044,11 +1986,11 @@ class DashboardController(AdminCirculationManagerController):
 
             library_stats[library.short_name] = dict(
                 patrons=dict(
-                    total=patron_count,
-                    with_active_loans=active_loans_patron_count,
-                    with_active_loans_or_holds=active_loans_or_holds_patron_count,
-                    loans=loan_count,
-                    holds=hold_count,
+                    total=patron_counts.get("total", 0),
+                    with_active_loans=patron_counts.get("with_active_loans", 0),
+                    with_active_loans_or_holds=patron_counts.get("with_active_loans_or_holds", 0),
+                    loans=patron_counts.get("loans", 0),
+                    holds=patron_counts.get("holds", 0),
                 ),
                 inventory=dict(
                     titles=title_count,
@@ -2056,6 +1998,7 @@ class DashboardController(AdminCirculationManagerController):
                     available_licenses=available_license_count,
                 ),
                 collections=library_collection_counts,
+                computed_at=computed_at,
             )
 
         total_patrons = sum([
@@ -2091,6 +2034,7 @@ class DashboardController(AdminCirculationManagerController):
                 available_licenses=total_available_license_count,
             ),
             collections=collection_counts,
+            computed_at=computed_at,
         )
 
         return library_stats
@@ -2122,9 +2066,30 @@ class DashboardController(AdminCirculationManagerController):
         return dict({ "circulation_events": events })
 
     def bulk_circulation_events(self):
+        """Find the circulation events for a range of days.
+
+        The range starts on the day given in the `date` argument and
+        ends at the end of the day given in `dateEnd`. Both default
+        to today.
+
+        :return: A 2-tuple (rows, label). `rows` is a generator that
+            yields a header row followed by one row for each event.
+            Events are read from the database a chunk at a time, so
+            the whole range is never in memory at once. `label`
+            describes the date range.
+        """
         default = str(datetime.today()).split(" ")[0]
         date = flask.request.args.get("date", default)
-        next_date = datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)
+        date_end = flask.request.args.get("dateEnd", date)
+        try:
+            start = datetime.strptime(date, "%Y-%m-%d")
+            end = datetime.strptime(date_end, "%Y-%m-%d") + timedelta(days=1)
+        except ValueError:
+            return INVALID_DATE_FORMAT, None
+        if date_end == date:
+            label = date
+        else:
+            label = "%s_%s" % (date, date_end)
 
         query = self._db.query(
                 CirculationEvent, Identifier, Work, Edition
@@ -2133,15 +2098,42 @@ class DashboardController(AdminCirculationManagerController):
             .join(Identifier, Identifier.id == LicensePool.identifier_id) \
             .join(Work, Work.id == LicensePool.work_id) \
             .join(Edition, Edition.id == Work.presentation_edition_id) \
-            .filter(CirculationEvent.start >= date) \
-            .filter(CirculationEvent.start < next_date) \
+            .filter(CirculationEvent.start >= start) \
+            .filter(CirculationEvent.start < end) \
             .order_by(CirculationEvent.start.asc())
         query = query \
             .options(lazyload(Identifier.licensed_through)) \
-            .options(lazyload(Work.license_pools))
-        results = query.all()
+            .options(lazyload(Work.license_pools)) \
+            .enable_eagerloads(False) \
+            .yield_per(self.CIRCULATION_EVENTS_CHUNK_SIZE)
 
-        work_ids = map(lambda result: result[2].id, results)
+        header = [
+            "time", "event", "identifier", "identifier_type", "title", "author",
+            "fiction", "audience", "publisher", "language", "target_age", "genres"
+        ]
+
+        def rows():
+            yield header
+            chunk = []
+            for result in query:
+                chunk.append(result)
+                if len(chunk) >= self.CIRCULATION_EVENTS_CHUNK_SIZE:
+                    for row in self._circulation_event_rows(chunk):
+                        yield row
+                    chunk = []
+            for row in self._circulation_event_rows(chunk):
+                yield row
+
+        return rows(), label
+
+    def _circulation_event_rows(self, results):
+        """Turn a chunk of (CirculationEvent, Identifier, Work, Edition)
+        results into CSV rows, looking up the genres for all of their
+        works at once.
+        """
+        if not results:
+            return []
+        work_ids = set(result[2].id for result in results)
 
         subquery = self._db \
             .query(WorkGenre.work_id, Genre.name) \
@@ -2155,11 +2147,6 @@ class DashboardController(AdminCirculationManagerController):
             .group_by(subquery.c.work_id)
         genres = dict(genre_query.all())
 
-        header = [
-            "time", "event", "identifier", "identifier_type", "title", "author",
-            "fiction", "audience", "publisher", "language", "target_age", "genres"
-        ]
-
         def result_to_row(result):
             (event, identifier, work, edition) = result
             return [
@@ -2177,7 +2164,7 @@ class DashboardController(AdminCirculationManagerController):
                 genres.get(work.id)
             ]
 
-        return [header] + map(result_to_row, results), date
+        return map(result_to_row, results)
 
 class SettingsController(AdminCirculationManagerController):
 
@@ -0,0 +1,211 @@
+from nose.tools import set_trace
+import json
+from datetime import datetime
+
+from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import (
+    and_,
+    case,
+    distinct,
+    select,
+    union,
+)
+
+from core.model import (
+    Hold,
+    LicensePool,
+    Loan,
+    Patron,
+    Timestamp,
+    get_one,
+    get_one_or_create,
+)
+
+
+class DashboardStatistics(object):
+    """Inventory and patron statistics for the admin dashboard.
+
+    Counting every patron, loan and hold is expensive on a large site,
+    so the statistics for every collection and library are calculated
+    at once by DashboardStatisticsScript, and stored as JSON in a
+    Timestamp. Loading the dashboard reads the stored copy, unless a
+    librarian asks for it to be recalculated.
+
+    The stored statistics aren't filtered by what any particular admin
+    is allowed to see. That's done when they're displayed.
+    """
+
+    SERVICE_NAME = u"Admin dashboard statistics"
+
+    DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+    COLLECTION_KEYS = [
+        "licensed_titles", "open_access_titles", "licenses",
+        "available_licenses",
+    ]
+
+    LIBRARY_KEYS = [
+        "total", "with_active_loans", "with_active_loans_or_holds", "loans",
+        "holds",
+    ]
+
+    def __init__(self, _db):
+        self._db = _db
+
+    def timestamp(self, create=False):
+        """Find the Timestamp where the statistics are stored."""
+        kwargs = dict(
+            service=self.SERVICE_NAME, service_type=Timestamp.SCRIPT_TYPE,
+            collection=None
+        )
+        if create:
+            timestamp, is_new = get_one_or_create(
+                self._db, Timestamp, **kwargs
+            )
+            return timestamp
+        return get_one(self._db, Timestamp, **kwargs)
+
+    def get(self):
+        """Find the stored statistics.
+
+        :return: A dictionary. If the statistics have never been
+            calculated, or can't be understood, it has no statistics
+            in it and its computed_at is None.
+        """
+        statistics = self.load()
+        if not statistics:
+            statistics = dict(computed_at=None, collections={}, libraries={})
+        return statistics
+
+    def load(self):
+        """Find the stored statistics.
+
+        :return: A dictionary, or None if there are no usable statistics.
+        """
+        timestamp = self.timestamp()
+        if not timestamp or not timestamp.achievements:
+            return None
+        try:
+            statistics = json.loads(timestamp.achievements)
+            self.computed_at(statistics)
+        except (ValueError, TypeError, KeyError), e:
+            return None
+        return statistics
+
+    def recalculate(self, now=None):
+        """Calculate the statistics and store them."""
+        now = now or datetime.utcnow()
+        statistics = self.calculate(now)
+        timestamp = self.timestamp(create=True)
+        timestamp.start = timestamp.finish = now
+        timestamp.achievements = unicode(json.dumps(statistics))
+        return statistics
+
+    @classmethod
+    def computed_at(cls, statistics):
+        return datetime.strptime(statistics["computed_at"], cls.DATE_FORMAT)
+
+    def calculate(self, now=None):
+        """Calculate statistics for every collection and library.
+
+        Each statistic is calculated for the whole site with a single
+        query, grouped by collection or library.
+
+        :return: A dictionary with the statistics for each collection
+            and each library, keyed by database ID.
+        """
+        now = now or datetime.utcnow()
+        return dict(
+            computed_at=now.strftime(self.DATE_FORMAT),
+            collections=self.collection_statistics(),
+            libraries=self.library_statistics(),
+        )
+
+    def collection_statistics(self):
+        is_licensed = LicensePool.open_access == False
+        qu = self._db.query(
+            LicensePool.collection_id,
+            func.sum(case(
+                [(and_(LicensePool.licenses_owned > 0, is_licensed), 1)],
+                else_=0
+            )),
+            func.sum(case(
+                [(LicensePool.open_access == True, 1)], else_=0
+            )),
+            func.sum(case(
+                [(is_licensed, LicensePool.licenses_owned)], else_=0
+            )),
+            func.sum(case(
+                [(is_licensed, LicensePool.licenses_available)], else_=0
+            )),
+        ).group_by(LicensePool.collection_id)
+
+        collections = {}
+        for row in qu:
+            collection_id = row[0]
+            # The sums are None if there's nothing to add up.
+            collections[str(collection_id)] = dict(
+                (key, int(value or 0))
+                for key, value in zip(self.COLLECTION_KEYS, row[1:])
+            )
+        return collections
+
+    def library_statistics(self):
+        now = datetime.now()
+        libraries = {}
+
+        def add(key, rows):
+            for library_id, count in rows:
+                if library_id is None:
+                    continue
+                counts = libraries.setdefault(
+                    str(library_id), dict((k, 0) for k in self.LIBRARY_KEYS)
+                )
+                counts[key] = count
+
+        add("total", self._db.query(
+            Patron.library_id, func.count(Patron.id)
+        ).group_by(Patron.library_id))
+
+        add("with_active_loans", self._db.query(
+            Patron.library_id, func.count(distinct(Patron.id))
+        ).join(
+            Patron.loans
+        ).filter(
+            Loan.end >= now
+        ).group_by(Patron.library_id))
+
+        active_patrons = union(
+            select(
+                [Patron.library_id, Patron.id]
+            ).where(
+                and_(Patron.id == Loan.patron_id, Loan.end >= now)
+            ),
+            select(
+                [Patron.library_id, Patron.id]
+            ).where(
+                Patron.id == Hold.patron_id
+            ),
+        ).alias()
+        add("with_active_loans_or_holds", self._db.execute(
+            select(
+                [active_patrons.c.library_id,
+                 func.count(distinct(active_patrons.c.id))]
+            ).group_by(active_patrons.c.library_id)
+        ))
+
+        add("loans", self._db.query(
+            Patron.library_id, func.count(Loan.id)
+        ).select_from(Loan).join(
+            Loan.patron
+        ).filter(
+            Loan.end >= now
+        ).group_by(Patron.library_id))
+
+        add("holds", self._db.query(
+            Patron.library_id, func.count(Hold.id)
+        ).select_from(Hold).join(
+            Hold.patron
+        ).group_by(Patron.library_id))
+
+        return libraries
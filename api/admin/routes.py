@@ -4,7 +4,7 @@ import flask
 from flask import (
     Response,
     redirect,
-    make_response
+    stream_with_context,
 )
 import os
 
@@ -264,12 +264,15 @@ def genres():
     """Returns a JSON representation of complete genre tree."""
     return app.manager.admin_feed_controller.genres()
 
+# The CSV of circulation events is sent in pieces of about this many bytes.
+BULK_CIRCULATION_EVENTS_BUFFER_SIZE = 64 * 1024
+
 @app.route('/admin/bulk_circulation_events')
 @returns_problem_detail
 @requires_admin
 def bulk_circulation_events():
     """Returns a CSV representation of all circulation events with optional
-    start and end times."""
+    start and end dates."""
     data, date = app.manager.admin_dashboard_controller.bulk_circulation_events()
     if isinstance(data, ProblemDetail):
         return data
@@ -304,10 +307,18 @@ def bulk_circulation_events():
             for row in rows:
                 self.writerow(row)
 
-    output = StringIO()
-    writer = UnicodeWriter(output)
-    writer.writerows(data)
-    response = make_response(output.getvalue())
+    def csv_chunks():
+        # Send the CSV a piece at a time, as the rows come in.
+        output = StringIO()
+        writer = UnicodeWriter(output)
+        for row in data:
+            writer.writerow(row)
+            if output.tell() >= BULK_CIRCULATION_EVENTS_BUFFER_SIZE:
+                yield output.getvalue()
+                output.truncate(0)
+        yield output.getvalue()
+
+    response = Response(stream_with_context(csv_chunks()))
     response.headers['Content-Disposition'] = "attachment; filename=circulation_events_" + date + ".csv"
     response.headers["Content-type"] = "text/csv"
     return response
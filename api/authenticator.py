@@ -35,12 +35,14 @@ from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql.expression import or_
 from problem_details import *
+from util.cache import LRUCache
 from util.patron import PatronUtility
 from api.opds import LibraryAnnotator
 from api.custom_patron_catalog import CustomPatronCatalog
 from api.adobe_vendor_id import AuthdataUtility
 
 import datetime
+import hashlib
 import logging
 from money import Money
 import os
@@ -1535,6 +1537,21 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
     TEST_IDENTIFIER = 'test_identifier'
     TEST_PASSWORD = 'test_password'
 
+    # If these are set, the source of truth's verdict on a set of
+    # credentials will be remembered for this many seconds.
+    CREDENTIAL_CACHE_TIME = u'credential_cache_time'
+    NEGATIVE_CREDENTIAL_CACHE_TIME = u'negative_credential_cache_time'
+    DEFAULT_NEGATIVE_CREDENTIAL_CACHE_TIME = 30
+
+    # Credentials are never used directly as cache keys. They're run
+    # through this many rounds of PBKDF2 with a salt that's never
+    # stored anywhere.
+    CREDENTIAL_HASH_ITERATIONS = 10000
+
+    # A marker for a credential cache miss, since None is a
+    # legitimate (negative) verdict.
+    NOT_CACHED = object()
+
     SETTINGS = [
         { "key": TEST_IDENTIFIER,
           "label": _("Test Identifier"),
@@ -1600,6 +1617,16 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
         { "key": PASSWORD_LABEL,
           "label": _("Label for password entry"),
         },
+        { "key": CREDENTIAL_CACHE_TIME,
+          "label": _("Remember valid credentials for (in seconds)"),
+          "description": _("If this is set, a patron whose credentials were recently approved by the source of truth won't have them checked again until this much time has passed. Patrons who lose their borrowing privileges are always checked again."),
+          "type": "number",
+        },
+        { "key": NEGATIVE_CREDENTIAL_CACHE_TIME,
+          "label": _("Remember invalid credentials for (in seconds)"),
+          "description": _("If valid credentials are being remembered, credentials rejected by the source of truth will be remembered for this long. Defaults to %(default)d seconds.", default=DEFAULT_NEGATIVE_CREDENTIAL_CACHE_TIME),
+          "type": "number",
+        },
     ] + AuthenticationProvider.SETTINGS
 
     # Used in the constructor to signify that the default argument
@@ -1665,6 +1692,18 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
             or self.DEFAULT_PASSWORD_LABEL
         )
 
+        self.credential_cache_time = integration.setting(
+            self.CREDENTIAL_CACHE_TIME).int_value
+        negative_credential_cache_time = integration.setting(
+            self.NEGATIVE_CREDENTIAL_CACHE_TIME).int_value
+        if negative_credential_cache_time is None:
+            negative_credential_cache_time = (
+                self.DEFAULT_NEGATIVE_CREDENTIAL_CACHE_TIME
+            )
+        self.negative_credential_cache_time = negative_credential_cache_time
+        self.credential_cache = LRUCache()
+        self.credential_salt = os.urandom(16)
+
     def remote_patron_lookup(self, patron_or_patrondata):
         """Ask the remote for information about this patron, and then make sure
         the patron belongs to the library associated with thie BasicAuthenticationProvider."""
@@ -1752,8 +1791,14 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
             # need to be checked with the source of truth.
             return server_side_validation_result
 
-        # Check these credentials with the source of truth.
-        patrondata = self.remote_authenticate(username, password)
+        # Check these credentials with the source of truth, unless
+        # we've done so recently.
+        cache_key = self.credential_cache_key(username, password)
+        patrondata = self.cached_remote_authenticate(cache_key)
+        from_cache = patrondata is not self.NOT_CACHED
+        if not from_cache:
+            patrondata = self.remote_authenticate(username, password)
+            self.cache_remote_authenticate(cache_key, patrondata)
         if not patrondata or isinstance(patrondata, ProblemDetail):
             # Either an error occured or the credentials did not correspond
             # to any patron.
@@ -1782,8 +1827,12 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
             # check.
             #
             # Just make sure our local data is up to date with
-            # whatever we just got from remote.
-            self.apply_patrondata(patrondata, patron)
+            # whatever we just got from remote. A remembered verdict
+            # holds no account information, so there's nothing to
+            # apply.
+            if not from_cache:
+                self.apply_patrondata(patrondata, patron)
+            self.forget_credentials_if_blocked(cache_key, patron)
             return patron
 
         # At this point there are two possibilities:
@@ -1812,6 +1861,7 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
             # For whatever reason, the remote lookup implementation
             # returned a Patron object instead of a PatronData. Just
             # use that Patron object.
+            self.forget_credentials_if_blocked(cache_key, patrondata)
             return patrondata
 
         # At this point we have a _complete_ PatronData object which we
@@ -1833,8 +1883,91 @@ class BasicAuthenticationProvider(AuthenticationProvider, HasSelfTests):
         # we now need to update the Patron record with the account
         # information we just got from the source of truth.
         self.apply_patrondata(patrondata, patron)
+        self.forget_credentials_if_blocked(cache_key, patron)
         return patron
 
+    def credential_cache_key(self, username, password):
+        """Turn a set of credentials into a key for the credential cache.
+
+        The key is a salted, deliberately slow hash, so that the
+        contents of the cache can't be used to recover anyone's
+        password.
+
+        :return: A string, or None if credentials aren't being cached.
+        """
+        if not self.credential_cache_time:
+            return None
+        credentials = u"%s\0%s" % (username or u"", password or u"")
+        return hashlib.pbkdf2_hmac(
+            'sha256', credentials.encode("utf8"), self.credential_salt,
+            self.CREDENTIAL_HASH_ITERATIONS
+        )
+
+    def cached_remote_authenticate(self, cache_key):
+        """What did remote_authenticate() say about these credentials
+        last time?
+
+        :return: NOT_CACHED; None if the credentials were invalid; or
+        an incomplete PatronData holding only the patron's identifiers.
+        Since it's incomplete, it won't be used to update the Patron
+        or to reset the timer on external sync.
+        """
+        if cache_key is None:
+            return self.NOT_CACHED
+        identity = self.credential_cache.get(cache_key, self.NOT_CACHED)
+        if identity is self.NOT_CACHED or identity is None:
+            return identity
+        return PatronData(complete=False, **identity)
+
+    def cache_remote_authenticate(self, cache_key, patrondata):
+        """Remember what remote_authenticate() said about a set of
+        credentials.
+
+        Only the verdict and the patron's identifiers are remembered,
+        never account information that could go out of date or a
+        database object.
+        """
+        if cache_key is None or isinstance(patrondata, ProblemDetail):
+            # Errors communicating with the source of truth are never
+            # cached.
+            return
+        if not patrondata:
+            # The credentials are invalid. Remember this for a short
+            # time.
+            if self.negative_credential_cache_time:
+                self.credential_cache.set(
+                    cache_key, None, self.negative_credential_cache_time
+                )
+            return
+        if not isinstance(patrondata, PatronData):
+            return
+        if patrondata.block_reason not in (None, PatronData.NO_VALUE):
+            # Blocked patrons are always checked with the source of
+            # truth, in case they've been unblocked.
+            return
+        identity = dict(
+            permanent_id=patrondata.permanent_id,
+            authorization_identifier=(
+                list(patrondata.authorization_identifiers) or None
+            ),
+            username=patrondata.username,
+            library_identifier=patrondata.library_identifier,
+        )
+        self.credential_cache.set(
+            cache_key, identity, self.credential_cache_time
+        )
+
+    def forget_credentials_if_blocked(self, cache_key, patron):
+        """If the authenticated patron can't borrow books, stop
+        remembering their credentials, so that we notice as soon as
+        their privileges are restored.
+        """
+        if cache_key is None or not isinstance(patron, Patron):
+            return
+        if (patron.block_reason is not None
+            or not PatronUtility.has_borrowing_privileges(patron)):
+            self.credential_cache.delete(cache_key)
+
     def apply_patrondata(self, patrondata, patron):
         """Apply a PatronData object to the given patron and make sure
         any fields that need to be updated as a result of new data
@@ -40,6 +40,7 @@ from core.model import (
     CirculationEvent,
     Collection,
     Contributor,
+    CoverageRecord,
     DataSource,
     DeliveryMechanism,
     Edition,
@@ -81,7 +82,8 @@ from circulation import (
     LoanInfo,
     FulfillmentInfo,
     HoldInfo,
-    BaseCirculationAPI
+    BaseCirculationAPI,
+    PatronActivityDeadline,
 )
 from circulation_exceptions import *
 
@@ -505,7 +507,7 @@ class Axis360API(Authenticator, BaseCirculationAPI, HasSelfTests):
         """Actually make an HTTP request."""
         return HTTP.request_with_timeout(
             method, url, headers=headers, data=data,
-            params=params, **kwargs
+            params=params, **PatronActivityDeadline.apply(kwargs)
         )
 
 class Axis360CirculationMonitor(CollectionMonitor):
@@ -539,43 +541,133 @@ class Axis360CirculationMonitor(CollectionMonitor):
         # Give us five minutes of overlap because it's very important
         # we don't miss anything.
         since = start-self.FIVE_MINUTES
-        count = 0
-        for bibliographic, circulation in self.api.recent_activity(since):
-            self.process_book(bibliographic, circulation)
-            count += 1
-            if count % self.batch_size == 0:
-                self._db.commit()
-
-    def process_book(self, bibliographic, availability):
 
+        # Every book in this run is processed with the same Analytics
+        # and ReplacementPolicy.
         analytics = Analytics(self._db)
-        license_pool, new_license_pool = availability.license_pool(
-            self._db, self.collection, analytics
-        )
-        edition, new_edition = bibliographic.edition(self._db)
-        license_pool.edition = edition
-        policy = ReplacementPolicy(
+        policy = self.replacement_policy(analytics)
+
+        batch = []
+        for book in self.api.recent_activity(since):
+            batch.append(book)
+            if len(batch) >= self.batch_size:
+                self.process_batch(batch, analytics, policy)
+                self._db.commit()
+                batch = []
+        if batch:
+            self.process_batch(batch, analytics, policy)
+
+    def replacement_policy(self, analytics):
+        return ReplacementPolicy(
             identifiers=False,
             subjects=True,
             contributions=True,
             formats=True,
             analytics=analytics,
         )
-        availability.apply(self._db, self.collection, replace=policy)
-        if new_edition:
-            bibliographic.apply(edition, self.collection, replace=policy)
-
-        if new_license_pool or new_edition:
-            # At this point we have done work equivalent to that done by
-            # the Axis360BibliographicCoverageProvider. Register that the
-            # work has been done so we don't have to do it again.
-            identifier = edition.primary_identifier
-            self.bibliographic_coverage_provider.handle_success(identifier)
-            self.bibliographic_coverage_provider.add_coverage_record_for(
-                identifier
+
+    def process_book(self, bibliographic, availability):
+        [result] = self.process_batch([(bibliographic, availability)])
+        return result
+
+    def process_batch(self, books, analytics=None, policy=None):
+        """Bring a number of books up to date.
+
+        :param books: A list of (Metadata, CirculationData) 2-tuples.
+        :return: A list of (Edition, LicensePool) 2-tuples.
+        """
+        analytics = analytics or Analytics(self._db)
+        policy = policy or self.replacement_policy(analytics)
+        existing = self.find_existing(books)
+
+        results = []
+        covered = []
+        for bibliographic, availability in books:
+            primary_identifier = bibliographic.primary_identifier
+            license_pool, edition = existing.get(
+                (primary_identifier.type, primary_identifier.identifier),
+                (None, None)
+            )
+            new_license_pool = new_edition = False
+            if not license_pool:
+                license_pool, new_license_pool = availability.license_pool(
+                    self._db, self.collection, analytics
+                )
+            if not edition:
+                edition, new_edition = bibliographic.edition(self._db)
+            license_pool.edition = edition
+            availability.apply(self._db, self.collection, replace=policy)
+            if new_edition:
+                bibliographic.apply(edition, self.collection, replace=policy)
+
+            if new_license_pool or new_edition:
+                # At this point we have done work equivalent to that done by
+                # the Axis360BibliographicCoverageProvider. Register that the
+                # work has been done so we don't have to do it again.
+                if edition.primary_identifier not in covered:
+                    covered.append(edition.primary_identifier)
+            results.append((edition, license_pool))
+
+        self.register_coverage(covered)
+        return results
+
+    def find_existing(self, books):
+        """Find the Axis 360 LicensePools and Editions that already
+        exist for a number of books, with a single query.
+
+        :param books: A list of (Metadata, CirculationData) 2-tuples.
+        :return: A dictionary mapping (identifier type, identifier)
+            to (LicensePool, Edition) 2-tuples.
+        """
+        keys = set()
+        for bibliographic, availability in books:
+            primary_identifier = bibliographic.primary_identifier
+            keys.add((primary_identifier.type, primary_identifier.identifier))
+        if not keys:
+            return {}
+
+        data_source = self.api.source
+        qu = self._db.query(LicensePool, Edition).join(
+            LicensePool.identifier
+        ).join(
+            Edition, Edition.primary_identifier_id==LicensePool.identifier_id
+        ).filter(
+            LicensePool.collection_id==self.collection.id
+        ).filter(
+            LicensePool.data_source_id==data_source.id
+        ).filter(
+            Edition.data_source_id==data_source.id
+        ).filter(
+            Identifier.type.in_(set(type for type, identifier in keys))
+        ).filter(
+            Identifier.identifier.in_(
+                set(identifier for type, identifier in keys)
             )
+        ).options(
+            contains_eager(LicensePool.identifier)
+        )
 
-        return edition, license_pool
+        existing = {}
+        for license_pool, edition in qu:
+            identifier = license_pool.identifier
+            key = (identifier.type, identifier.identifier)
+            if key in keys:
+                existing[key] = (license_pool, edition)
+        return existing
+
+    def register_coverage(self, identifiers):
+        """Record that the Axis360BibliographicCoverageProvider doesn't
+        need to process these Identifiers.
+        """
+        if not identifiers:
+            return
+        provider = self.bibliographic_coverage_provider
+        for identifier in identifiers:
+            provider.handle_success(identifier)
+        CoverageRecord.bulk_add(
+            identifiers, provider.data_source, operation=provider.operation,
+            collection=provider.collection_or_not, force=True
+        )
 
 
 class MockAxis360API(Axis360API):
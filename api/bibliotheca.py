@@ -1,9 +1,12 @@
+import argparse
 import json
 from lxml import etree
 
 from cStringIO import StringIO
 import itertools
+from collections import deque
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 import os
 import re
 import logging
@@ -29,6 +32,7 @@ from circulation import (
     HoldInfo,
     LoanInfo,
     BaseCirculationAPI,
+    PatronActivityDeadline,
 )
 from selftest import (
     HasSelfTests,
@@ -289,7 +293,9 @@ class BibliothecaAPI(BaseCirculationAPI, HasSelfTests):
 
     def _request_with_timeout(self, method, url, *args, **kwargs):
         """This will be overridden in MockBibliothecaAPI."""
-        return HTTP.request_with_timeout(method, url, *args, **kwargs)
+        return HTTP.request_with_timeout(
+            method, url, *args, **PatronActivityDeadline.apply(kwargs)
+        )
 
     def _simple_http_get(self, url, headers, *args, **kwargs):
         """This will be overridden in MockBibliothecaAPI."""
@@ -1250,9 +1256,27 @@ class BibliothecaEventMonitor(CollectionMonitor):
     DEFAULT_START_TIME = timedelta(365*3)
     PROTOCOL = ExternalIntegration.BIBLIOTHECA
 
+    # By default, ask for one day's worth of events at a time.
+    DEFAULT_SLICE_SIZE = timedelta(days=1)
+
+    # By default, ask for one slice at a time. When catching up on a
+    # long period of time, more slices can be retrieved at once.
+    DEFAULT_CONCURRENCY = 1
+
     def __init__(self, _db, collection, api_class=BibliothecaAPI,
-                 cli_date=None, analytics=None):
+                 cli_date=None, analytics=None, concurrency=None,
+                 slice_size=None):
+        """Constructor.
+
+        :param concurrency: Retrieve this many slices of events at once.
+        :param slice_size: Ask for this many hours of events at a time.
+        """
         self.analytics = analytics or Analytics(_db)
+        self.concurrency = max(concurrency or self.DEFAULT_CONCURRENCY, 1)
+        if slice_size:
+            self.slice_size = timedelta(hours=slice_size)
+        else:
+            self.slice_size = self.DEFAULT_SLICE_SIZE
         super(BibliothecaEventMonitor, self).__init__(_db, collection)
         if isinstance(api_class, BibliothecaAPI):
             # We were given an actual API object. Just use it.
@@ -1323,18 +1347,42 @@ class BibliothecaEventMonitor(CollectionMonitor):
             yield slice_start, slice_cutoff, full_slice
             slice_start = slice_start + increment
 
+    @classmethod
+    def arg_parser(cls):
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            'cli_date', nargs='?',
+            help="Start from this date (YYYY-MM-DD) rather than the last time the monitor ran.",
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=cls.DEFAULT_CONCURRENCY,
+            help="Retrieve this many slices of events at once.",
+        )
+        parser.add_argument(
+            '--slice-size', type=int,
+            default=int(cls.DEFAULT_SLICE_SIZE.total_seconds() / 3600),
+            help="Ask for this many hours of events at a time.",
+        )
+        return parser
+
+    @classmethod
+    def parse_command_line(cls, cmd_args=None):
+        """Turn command-line arguments into constructor arguments."""
+        return vars(cls.arg_parser().parse_args(cmd_args))
+
     def run_once(self, start, cutoff):
-        added_books = 0
         i = 0
-        one_day = timedelta(days=1)
         most_recent_timestamp = start
-        for start, cutoff, full_slice in self.slice_timespan(
-                start, cutoff, one_day):
+        slices = list(self.slice_timespan(start, cutoff, self.slice_size))
+        if self.concurrency > 1 and len(slices) > 1:
+            events_by_slice = self.events_by_slice_concurrently(slices)
+        else:
+            events_by_slice = self.events_by_slice(slices)
+
+        for (start, cutoff, full_slice), events in events_by_slice:
             most_recent_timestamp = start
-            self.log.info("Asking for events between %r and %r", start, cutoff)
             try:
                 event = None
-                events = self.api.get_events_between(start, cutoff, full_slice)
                 for event in events:
                     event_timestamp = self.handle_event(*event)
                     if (not most_recent_timestamp or
@@ -1343,6 +1391,11 @@ class BibliothecaEventMonitor(CollectionMonitor):
                     i += 1
                     if not i % 1000:
                         self._db.commit()
+                if full_slice:
+                    # Every event in this slice has been handled. If
+                    # the monitor stops before it's done, it can pick
+                    # up from here next time.
+                    self.timestamp().finish = cutoff
                 self._db.commit()
             except Exception, e:
                 if event:
@@ -1359,6 +1412,66 @@ class BibliothecaEventMonitor(CollectionMonitor):
         self.log.info("Handled %d events total", i)
         return most_recent_timestamp
 
+    def events_by_slice(self, slices):
+        """Retrieve the events for each span of time, one span at a time.
+
+        :yield: A 2-tuple (span, events) for each span.
+        """
+        for span in slices:
+            start, cutoff, full_slice = span
+            self.log.info("Asking for events between %r and %r", start, cutoff)
+            try:
+                events = self.api.get_events_between(start, cutoff, full_slice)
+            except Exception, e:
+                self.log.error(
+                    "Fatal error getting list of Bibliotheca events.",
+                    exc_info=e
+                )
+                raise e
+            yield span, events
+
+    def events_by_slice_concurrently(self, slices):
+        """Retrieve the events for several slices of time at once.
+
+        Slices are retrieved by a pool of worker threads, but yielded
+        in order, so events are still handled in the order they
+        happened. Only a few slices are retrieved ahead of the one
+        being handled, so the events for the whole span of time are
+        never in memory at once.
+
+        :yield: A 2-tuple (span, events) for each span.
+        """
+        def get_events(span):
+            start, cutoff, full_slice = span
+            self.log.info("Asking for events between %r and %r", start, cutoff)
+            # The events aren't cached as Representations, since the
+            # database session can't be used from a worker thread.
+            return list(self.api.get_events_between(start, cutoff, False))
+
+        pool = ThreadPool(self.concurrency)
+        pending = deque()
+        slices = iter(slices)
+        try:
+            for span in itertools.islice(slices, self.concurrency * 2):
+                pending.append((span, pool.apply_async(get_events, (span,))))
+            while pending:
+                span, result = pending.popleft()
+                try:
+                    events = result.get()
+                except Exception, e:
+                    self.log.error(
+                        "Fatal error getting list of Bibliotheca events.",
+                        exc_info=e
+                    )
+                    raise e
+                for next_span in itertools.islice(slices, 1):
+                    pending.append(
+                        (next_span, pool.apply_async(get_events, (next_span,)))
+                    )
+                yield span, events
+        finally:
+            pool.terminate()
+
     def handle_event(self, bibliotheca_id, isbn, foreign_patron_id,
                      start_time, end_time, internal_event_type):
         # Find or lookup the LicensePool for this event.
@@ -2,12 +2,21 @@ from nose.tools import set_trace
 from circulation_exceptions import *
 import datetime
 from collections import defaultdict
-from threading import Thread
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from threading import (
+    Event,
+    Lock,
+    local,
+)
 import flask
 import logging
 import re
 import time
 from flask_babel import lazy_gettext as _
+from sqlalchemy import tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import contains_eager
 
 from core.config import CannotLoadConfiguration
 from core.cdn import cdnify
@@ -29,6 +38,7 @@ from core.model import (
     RightsStatus,
     Session,
 )
+from util.cache import LRUCache
 from util.patron import PatronUtility
 from config import Configuration
 
@@ -354,13 +364,257 @@ class HoldInfo(CirculationInfo):
         )
 
 
+class PatronActivityPool(object):
+    """Bounded pools of worker threads used to ask remote APIs about
+    a patron's loans and holds.
+
+    Every remote API gets its own small pool, so a distributor that
+    stops answering can only tie up its own threads, not the threads
+    needed to talk to everyone else. A single PatronActivityPool is
+    meant to be shared by every CirculationAPI in a process.
+    """
+
+    # The number of worker threads for each remote API.
+    DEFAULT_SIZE = 4
+
+    def __init__(self, size=None):
+        self.size = size or self.DEFAULT_SIZE
+        self._pools = {}
+        self._lock = Lock()
+
+    def pool(self, key):
+        """Find the pool of worker threads for one remote API.
+
+        :param key: Identifies the remote API -- usually the ID of
+           the Collection it serves.
+        """
+        # The worker threads aren't started until they're actually
+        # needed.
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = ThreadPool(self.size)
+                    self._pools[key] = pool
+        return pool
+
+    def apply_async(self, key, func, args=()):
+        """Run `func(*args)` in one of `key`'s worker threads.
+
+        :return: An AsyncResult.
+        """
+        return self.pool(key).apply_async(func, args)
+
+    def close(self, wait=True):
+        """Stop the worker threads, if any were started.
+
+        :param wait: If this is False, don't wait for the worker
+           threads; each one will exit once the work already given to
+           it is done.
+        """
+        with self._lock:
+            pools = self._pools.values()
+            self._pools = {}
+        for pool in pools:
+            if wait:
+                pool.terminate()
+            else:
+                pool.close()
+
+
+class PatronActivityDeadline(object):
+    """The time by which the current thread has to stop talking to a
+    remote API about a patron's activity.
+
+    PatronActivityTask sets this while it runs. The HTTP wrappers of
+    the circulation APIs pass their keyword arguments through
+    `apply`, so no request can outlive the deadline, even though the
+    thread waiting on the answer has stopped waiting.
+    """
+
+    _local = local()
+
+    # A request made after the deadline has passed still needs a
+    # timeout greater than zero.
+    MINIMUM_TIMEOUT = 0.1
+
+    @classmethod
+    def get(cls):
+        return getattr(cls._local, 'deadline', None)
+
+    @classmethod
+    def set(cls, deadline):
+        cls._local.deadline = deadline
+
+    @classmethod
+    def apply(cls, kwargs):
+        """Make sure an HTTP request made with the given keyword
+        arguments will time out by the current thread's deadline.
+
+        :param kwargs: Keyword arguments destined for one of the
+           HTTP.*_with_timeout methods. This is modified in place.
+        :return: `kwargs`
+        """
+        deadline = cls.get()
+        if deadline is None:
+            return kwargs
+        remaining = max(deadline - time.time(), cls.MINIMUM_TIMEOUT)
+        timeout = kwargs.get('timeout')
+        if timeout is None or timeout > remaining:
+            kwargs['timeout'] = remaining
+        return kwargs
+
+
+class PatronActivityTask(object):
+    """Ask one remote API about a patron's activity.
+
+    This runs in a PatronActivityPool worker thread. The deadline is
+    measured from when the task starts running, not from when it was
+    submitted.
+    """
+
+    def __init__(self, api, patron, pin, timeout, log):
+        self.api = api
+        self.patron = patron
+        self.pin = pin
+        self.timeout = timeout
+        self.log = log
+        self.started = Event()
+        self.deadline = None
+        self.cancelled = False
+
+    def __call__(self):
+        if self.cancelled:
+            # Nobody is waiting for the answer anymore.
+            return None
+        before = time.time()
+        self.deadline = before + self.timeout
+        self.started.set()
+        PatronActivityDeadline.set(self.deadline)
+        try:
+            # Some APIs return a generator; make sure all the work
+            # happens here rather than in the thread that's waiting on
+            # us.
+            return list(self.api.patron_activity(self.patron, self.pin) or [])
+        finally:
+            PatronActivityDeadline.set(None)
+            after = time.time()
+            self.log.debug(
+                "Synced %s in %.2f sec", self.api.__class__.__name__,
+                after-before
+            )
+
+    def wait(self, result):
+        """Wait for the answer.
+
+        :param result: The AsyncResult obtained when this task was
+           submitted to a PatronActivityPool.
+
+        :raise TimeoutError: If the task didn't start running within
+           `timeout` seconds (all the remote API's worker threads
+           were busy), or didn't finish by its deadline.
+        """
+        if not self.started.wait(self.timeout):
+            self.cancelled = True
+            raise TimeoutError()
+        return result.get(max(self.deadline - time.time(), 0))
+
+
+class PatronActivityCache(object):
+    """Remember what remote APIs said about a patron's activity, so that
+    a patron who syncs their bookshelf over and over doesn't cause a
+    remote API call every time.
+
+    Results are kept per patron, per collection, for `ttl` seconds.
+    CirculationAPI forgets a patron's results for a collection whenever
+    it changes that patron's state in that collection.
+
+    Cached results may be out of date, so they're never used as
+    evidence that a loan or hold has gone away.
+    """
+
+    DEFAULT_TTL = 60
+
+    # When a patron's results are forgotten, we remember when that
+    # happened for at least this many seconds, so that an answer to a
+    # question asked before the change isn't stored afterwards.
+    MIN_INVALIDATION_TTL = 300
+
+    def __init__(self, ttl=None, store=None):
+        """Constructor.
+
+        :param ttl: Keep results around for this many seconds. If this
+           is zero, nothing is cached.
+
+        :param store: An LRUCache, or any object with compatible `get`,
+           `set` and `delete` methods, such as a client for a store
+           shared between processes.
+        """
+        if ttl is None:
+            ttl = self.DEFAULT_TTL
+        self.ttl = ttl
+        if store is None:
+            store = LRUCache()
+        self.store = store
+
+    @classmethod
+    def key(cls, patron, collection_id):
+        return "patron-activity-%s-%s" % (patron.id, collection_id)
+
+    @classmethod
+    def invalidation_key(cls, patron, collection_id):
+        return "patron-activity-invalidated-%s-%s" % (
+            patron.id, collection_id
+        )
+
+    def get(self, patron, collection_id):
+        """Find the cached activity for a patron in a collection.
+
+        :return: A list of LoanInfo and HoldInfo objects, or None if
+            nothing is cached.
+        """
+        if not self.ttl:
+            return None
+        return self.store.get(self.key(patron, collection_id))
+
+    def set(self, patron, collection_id, activity, asked_at=None):
+        """Remember a remote API's answer.
+
+        :param asked_at: When the remote API was asked, as a
+           time.time() value. If the patron's activity in this
+           collection was invalidated since then, the answer may not
+           reflect the change, so it isn't stored.
+        """
+        if not self.ttl:
+            return
+        if asked_at is not None:
+            invalidated_at = self.store.get(
+                self.invalidation_key(patron, collection_id)
+            )
+            if invalidated_at is not None and invalidated_at >= asked_at:
+                return
+        self.store.set(
+            self.key(patron, collection_id), list(activity), self.ttl
+        )
+
+    def invalidate(self, patron, collection_id):
+        self.store.delete(self.key(patron, collection_id))
+        if self.ttl:
+            self.store.set(
+                self.invalidation_key(patron, collection_id), time.time(),
+                max(self.ttl, self.MIN_INVALIDATION_TTL)
+            )
+
+
 class CirculationAPI(object):
     """Implement basic circulation logic and abstract away the details
     between different circulation APIs behind generic operations like
     'borrow'.
     """
 
-    def __init__(self, _db, library, analytics=None, api_map=None):
+    def __init__(self, _db, library, analytics=None, api_map=None,
+                 patron_activity_pool=None, patron_activity_cache=None):
         """Constructor.
 
         :param _db: A database session (probably a scoped session, which is
@@ -380,11 +634,23 @@ class CirculationAPI(object):
            Since instantiating these API classes may result in API
            calls, we only instantiate one CirculationAPI per library,
            and keep them around as long as possible.
+
+        :param patron_activity_pool: A PatronActivityPool to use when
+           checking a patron's activity with the remote APIs. This is
+           normally shared among all the CirculationAPIs for a site. If
+           none is provided, each check gets worker threads of its own,
+           which go away once the check is done.
+
+        :param patron_activity_cache: A PatronActivityCache in which to
+           keep the results of checking a patron's activity. If none is
+           provided, every check will go to the remote APIs.
         """
         self._db = _db
         self.library_id = library.id
         self.analytics = analytics
         self.initialization_exceptions = dict()
+        self.patron_activity_pool = patron_activity_pool
+        self.patron_activity_cache = patron_activity_cache
         api_map = api_map or self.default_api_map
 
         # Each of the Library's relevant Collections is going to be
@@ -397,6 +663,10 @@ class CirculationAPI(object):
         # from any other Collections.
         self.collection_ids_for_sync = []
 
+        # How long we're willing to wait for each Collection's API
+        # to tell us about a patron's activity.
+        self.patron_activity_timeouts = {}
+
         self.log = logging.getLogger("Circulation API")
         for collection in library.collections:
             if collection.protocol in api_map:
@@ -412,11 +682,29 @@ class CirculationAPI(object):
                 if api:
                     self.api_for_collection[collection.id] = api
                     self.collection_ids_for_sync.append(collection.id)
+                    self.patron_activity_timeouts[collection.id] = (
+                        self.patron_activity_timeout(collection, api)
+                    )
 
     @property
     def library(self):
         return Library.by_id(self._db, self.library_id)
 
+    def patron_activity_timeout(self, collection, api):
+        """How many seconds should we wait for `api` to tell us about
+        a patron's activity in `collection`?
+        """
+        timeout = None
+        integration = collection.external_integration
+        if integration:
+            timeout = integration.setting(
+                BaseCirculationAPI.PATRON_ACTIVITY_TIMEOUT_KEY
+            ).int_value
+        return timeout or getattr(
+            api, 'PATRON_ACTIVITY_TIMEOUT',
+            BaseCirculationAPI.PATRON_ACTIVITY_TIMEOUT
+        )
+
     @property
     def default_api_map(self):
         """When you see a Collection that implements protocol X, instantiate
@@ -486,6 +774,7 @@ class CirculationAPI(object):
         #
         # This also means that our internal model of whether this book
         # is currently on loan or on hold might be wrong.
+        self.forget_patron_activity(patron, licensepool)
         api = self.api_for_license_pool(licensepool)
         if not api:
             # If there's no API for the pool, the pool is probably associated
@@ -604,6 +893,9 @@ class CirculationAPI(object):
                 api.update_availability(licensepool)
                 raise e
 
+        # The remote API may have changed the patron's state.
+        self.forget_patron_activity(patron, licensepool)
+
         if loan_info:
             # We successfuly secured a loan.  Now create it in our
             # database.
@@ -658,6 +950,7 @@ class CirculationAPI(object):
                     raise PatronLoanLimitReached()
                 else:
                     raise e
+            self.forget_patron_activity(patron, licensepool)
 
         # It's pretty rare that we'd go from having a loan for a book
         # to needing to put it on hold, but we do check for that case.
@@ -738,6 +1031,7 @@ class CirculationAPI(object):
         :return: A FulfillmentInfo object.
 
         """
+        self.forget_patron_activity(patron, licensepool)
         fulfillment = None
         loan = get_one(
             self._db, Loan, patron=patron, license_pool=licensepool,
@@ -785,6 +1079,7 @@ class CirculationAPI(object):
                 patron, pin, licensepool, internal_format=internal_format,
                 part=part, fulfill_part_url=fulfill_part_url
             )
+            self.forget_patron_activity(patron, licensepool)
             if not fulfillment or not (
                 fulfillment.content_link or fulfillment.content
             ):
@@ -857,6 +1152,7 @@ class CirculationAPI(object):
 
     def revoke_loan(self, patron, pin, licensepool):
         """Revoke a patron's loan for a book."""
+        self.forget_patron_activity(patron, licensepool)
         loan = get_one(
             self._db, Loan, patron=patron, license_pool=licensepool,
             on_multiple='interchangeable'
@@ -870,6 +1166,7 @@ class CirculationAPI(object):
                     # The book wasn't checked out in the first
                     # place. Everything's fine.
                     pass
+                self.forget_patron_activity(patron, licensepool)
 
             __transaction = self._db.begin_nested()
             logging.info("In revoke_loan(), deleting loan #%d" % loan.id)
@@ -891,6 +1188,7 @@ class CirculationAPI(object):
 
     def release_hold(self, patron, pin, licensepool):
         """Remove a patron's hold on a book."""
+        self.forget_patron_activity(patron, licensepool)
         hold = get_one(
             self._db, Hold, patron=patron, license_pool=licensepool,
             on_multiple='interchangeable'
@@ -903,6 +1201,7 @@ class CirculationAPI(object):
                 # The book wasn't on hold in the first place. Everything's
                 # fine.
                 pass
+            self.forget_patron_activity(patron, licensepool)
         # Any other CannotReleaseHold exception will be propagated
         # upwards at this point
         if hold:
@@ -925,90 +1224,238 @@ class CirculationAPI(object):
         """Return a record of the patron's current activity
         vis-a-vis all relevant external loan sources.
 
-        We check each source in a separate thread for speed.
+        We check each source in a separate worker thread for speed.
+        Each source gets a deadline; if it hasn't answered by then we
+        stop waiting for it and report that the picture is incomplete.
+
+        If there's a PatronActivityCache, sources whose answers are
+        cached aren't checked at all.
 
-        :return: A 2-tuple (loans, holds) containing `HoldInfo` and
-        `LoanInfo` objects.
+        :return: A 3-tuple (loans, holds, complete) containing `LoanInfo`
+        and `HoldInfo` objects. `complete` is False if any source
+        errored out, failed to answer before its deadline, or had its
+        answer taken from the cache, since then the answer may be out
+        of date.
         """
-        log = self.log
-        class PatronActivityThread(Thread):
-            def __init__(self, api, patron, pin):
-                self.api = api
-                self.patron = patron
-                self.pin = pin
-                self.activity = None
-                self.exception = None
-                super(PatronActivityThread, self).__init__()
-
-            def run(self):
-                before = time.time()
-                try:
-                    self.activity = self.api.patron_activity(
-                        self.patron, self.pin)
-                except Exception, e:
-                    self.exception = e
-                after = time.time()
-                log.debug(
-                    "Synced %s in %.2f sec", self.api.__class__.__name__,
-                    after-before
+        before = time.time()
+        results = []
+        cached = []
+        pool = self.patron_activity_pool
+        if pool is None:
+            # Nobody gave us a pool to share, so this check gets one
+            # of its own.
+            pool = PatronActivityPool()
+        try:
+            for collection_id, api in self.api_for_collection.items():
+                activity = None
+                if self.patron_activity_cache:
+                    activity = self.patron_activity_cache.get(
+                        patron, collection_id
+                    )
+                if activity is not None:
+                    cached.append(activity)
+                    continue
+                timeout = self.patron_activity_timeouts.get(
+                    collection_id, BaseCirculationAPI.PATRON_ACTIVITY_TIMEOUT
                 )
+                task = PatronActivityTask(api, patron, pin, timeout, self.log)
+                result = pool.apply_async(collection_id, task)
+                results.append((collection_id, api, task, result))
+        finally:
+            if pool is not self.patron_activity_pool:
+                # The worker threads will exit once they've run the
+                # tasks we just gave them. We don't wait for that,
+                # since one of them may be talking to a remote API
+                # that's past its deadline.
+                pool.close(wait=False)
 
-        threads = []
-        before = time.time()
-        for api in self.api_for_collection.values():
-            thread = PatronActivityThread(api, patron, pin)
-            threads.append(thread)
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
         loans = []
         holds = []
-        complete = True
-        for thread in threads:
-            if thread.exception:
+        # A cached answer may not mention a loan or hold that was
+        # created since it was cached, so it's not good enough to
+        # delete anything.
+        complete = not cached
+        activities = list(cached)
+        for collection_id, api, task, result in results:
+            try:
+                activity = task.wait(result)
+                if self.patron_activity_cache:
+                    self.patron_activity_cache.set(
+                        patron, collection_id, activity, asked_at=before
+                    )
+                activities.append(activity)
+            except TimeoutError, e:
+                # We can't wait any longer for this source, so we
+                # don't have a complete picture of the patron's loans.
+                complete = False
+                self.log.error(
+                    "%s did not answer within its deadline; giving up.",
+                    api.__class__.__name__
+                )
+            except Exception, e:
                 # Something went wrong, so we don't have a complete
                 # picture of the patron's loans.
                 complete = False
                 self.log.error(
-                    "%s errored out: %s", thread.api.__class__.__name__,
-                    thread.exception,
-                    exc_info=thread.exception
+                    "%s errored out: %s", api.__class__.__name__, e,
+                    exc_info=e
                 )
-            if thread.activity:
-                for i in thread.activity:
-                    l = None
-                    if isinstance(i, LoanInfo):
-                        l = loans
-                    elif isinstance(i, HoldInfo):
-                        l = holds
-                    else:
-                        self.log.warn(
-                            "value %r from patron_activity is neither a loan nor a hold.",
-                            i
-                        )
-                    if l is not None:
-                        l.append(i)
+        for activity in activities:
+            for i in activity:
+                l = None
+                if isinstance(i, LoanInfo):
+                    l = loans
+                elif isinstance(i, HoldInfo):
+                    l = holds
+                else:
+                    self.log.warn(
+                        "value %r from patron_activity is neither a loan nor a hold.",
+                        i
+                    )
+                if l is not None:
+                    l.append(i)
         after = time.time()
         self.log.debug("Full sync took %.2f sec", after-before)
         return loans, holds, complete
 
+    def forget_patron_activity(self, patron, licensepool):
+        """The patron's state in `licensepool`'s collection is about to
+        change, or has just changed, so any cached activity for that
+        collection can't be trusted anymore.
+
+        This is done before a remote API is asked to change anything,
+        so the change isn't based on cached information, and again once
+        the change has been made, so that an answer from a bookshelf
+        sync that was already under way isn't cached.
+        """
+        if self.patron_activity_cache and licensepool:
+            self.patron_activity_cache.invalidate(
+                patron, licensepool.collection_id
+            )
+
     def local_loans(self, patron):
-        return self._db.query(Loan).join(Loan.license_pool).filter(
+        return self._db.query(Loan).join(Loan.license_pool).outerjoin(
+            LicensePool.identifier
+        ).options(
+            contains_eager(Loan.license_pool).contains_eager(
+                LicensePool.identifier
+            )
+        ).filter(
             LicensePool.collection_id.in_(self.collection_ids_for_sync)
         ).filter(
             Loan.patron==patron
         )
 
     def local_holds(self, patron):
-        return self._db.query(Hold).join(Hold.license_pool).filter(
+        return self._db.query(Hold).join(Hold.license_pool).outerjoin(
+            LicensePool.identifier
+        ).options(
+            contains_eager(Hold.license_pool).contains_eager(
+                LicensePool.identifier
+            )
+        ).filter(
             LicensePool.collection_id.in_(self.collection_ids_for_sync)
         ).filter(
             Hold.patron==patron
         )
 
+    def license_pools_for(self, infos):
+        """Find the LicensePools for a number of CirculationInfo objects.
+
+        All the LicensePools that already exist are found with a single
+        query. LicensePools that don't exist yet are created one at a
+        time, but that should be rare.
+
+        :return: A dictionary mapping each CirculationInfo's
+            (collection ID, identifier type, identifier) to a LicensePool.
+        """
+        keys = set(
+            (x.collection_id, x.identifier_type, x.identifier) for x in infos
+        )
+        pools = {}
+        if not keys:
+            return pools
+        identifiers = set((type, identifier) for (c, type, identifier) in keys)
+        collection_ids = set(c for (c, type, identifier) in keys)
+        qu = self._db.query(LicensePool).join(LicensePool.identifier).options(
+            contains_eager(LicensePool.identifier)
+        ).filter(
+            LicensePool.collection_id.in_(collection_ids)
+        ).filter(
+            tuple_(Identifier.type, Identifier.identifier).in_(identifiers)
+        )
+        for pool in qu:
+            key = (
+                pool.collection_id, pool.identifier.type,
+                pool.identifier.identifier
+            )
+            if key in keys:
+                pools[key] = pool
+
+        for info in infos:
+            key = (info.collection_id, info.identifier_type, info.identifier)
+            if key not in pools:
+                pools[key] = info.license_pool(self._db)
+        return pools
+
+    def _bulk_create(self, model, patron, values_by_pool_id):
+        """Create a number of Loans or Holds for one patron with a single
+        INSERT statement.
+
+        Rows that turn out to exist already (probably because of
+        some other request for the same patron) are left alone.
+
+        :param model: Loan or Hold.
+        :param values_by_pool_id: A dictionary mapping LicensePool IDs
+            to dictionaries of column values for the new rows. Every
+            dictionary must have the same keys.
+        :return: A dictionary mapping LicensePool IDs to Loan or Hold
+            objects.
+        """
+        if not values_by_pool_id:
+            return {}
+        rows = []
+        for pool_id, values in values_by_pool_id.items():
+            row = dict(patron_id=patron.id, license_pool_id=pool_id)
+            row.update(values)
+            rows.append(row)
+
+        # Session.execute() doesn't autoflush, so make sure anything
+        # the new rows depend on is in the database.
+        self._db.flush()
+        self._db.execute(
+            postgresql.insert(model.__table__).values(rows).on_conflict_do_nothing()
+        )
+        qu = self._db.query(model).filter(
+            model.patron_id==patron.id
+        ).filter(
+            model.license_pool_id.in_(values_by_pool_id.keys())
+        )
+        return dict((x.license_pool_id, x) for x in qu)
+
+    def _bulk_delete(self, model, objs):
+        """Delete a number of Loans or Holds with a single DELETE
+        statement.
+        """
+        if not objs:
+            return
+        ids = [x.id for x in objs]
+        self._db.query(model).filter(model.id.in_(ids)).delete(
+            synchronize_session=False
+        )
+        for obj in objs:
+            self._db.expunge(obj)
+
     def sync_bookshelf(self, patron, pin):
+        """Bring our view of the patron's loans and holds in line with
+        what the remote APIs say.
 
+        This takes a constant number of database queries no matter how
+        many loans and holds the patron has.
+
+        :return: A 2-tuple (loans, holds) containing the patron's
+            active `Loan` and `Hold` objects.
+        """
         # Get the external view of the patron's current state.
         remote_loans, remote_holds, complete = self.patron_activity(patron, pin)
 
@@ -1047,12 +1494,27 @@ class CirculationAPI(object):
             key = (i.type, i.identifier)
             local_holds_by_identifier[key] = h
 
-        active_loans = []
-        active_holds = []
+        # Find the LicensePools for every remote loan and hold we
+        # don't already know about.
+        unknown = [
+            x for x in remote_loans
+            if (x.identifier_type, x.identifier) not in local_loans_by_identifier
+        ] + [
+            x for x in remote_holds
+            if (x.identifier_type, x.identifier) not in local_holds_by_identifier
+        ]
+        pools = self.license_pools_for(unknown)
+        def pool_for(info):
+            return pools[
+                (info.collection_id, info.identifier_type, info.identifier)
+            ]
+
+        # Every remote loan that we have locally might need its start or
+        # end date updated. Every remote loan we don't have locally
+        # needs to be created.
+        existing_loans = {}
+        new_loans = {}
         for loan in remote_loans:
-            # This is a remote loan. Find or create the corresponding
-            # local loan.
-            pool = loan.license_pool(self._db)
             start = loan.start_date
             end = loan.end_date
             key = (loan.identifier_type, loan.identifier)
@@ -1060,6 +1522,7 @@ class CirculationAPI(object):
                 # We already have the Loan object, we don't need to look
                 # it up again.
                 local_loan = local_loans_by_identifier[key]
+                existing_loans[key] = local_loan
 
                 # But maybe the remote's opinions as to the loan's
                 # start or end date have changed.
@@ -1067,9 +1530,23 @@ class CirculationAPI(object):
                     local_loan.start = start
                 if end:
                     local_loan.end = end
-            else:
-                local_loan, new = pool.loan_to(patron, start, end)
 
+                # Check the local loan off the list we're keeping so we
+                # don't delete it later.
+                del local_loans_by_identifier[key]
+            elif key not in existing_loans:
+                new_loans[pool_for(loan).id] = dict(
+                    start=start or now, end=end
+                )
+        created_loans = self._bulk_create(Loan, patron, new_loans)
+
+        active_loans = []
+        for loan in remote_loans:
+            key = (loan.identifier_type, loan.identifier)
+            if key in existing_loans:
+                local_loan = existing_loans[key]
+            else:
+                local_loan = created_loans[pool_for(loan).id]
             if loan.locked_to:
                 # The loan source is letting us know that the loan is
                 # locked to a specific delivery mechanism. Even if
@@ -1079,36 +1556,40 @@ class CirculationAPI(object):
                 loan.locked_to.apply(local_loan, autocommit=False)
             active_loans.append(local_loan)
 
-            # Check the local loan off the list we're keeping so we
-            # don't delete it later.
-            key = (loan.identifier_type, loan.identifier)
-            if key in local_loans_by_identifier:
-                del local_loans_by_identifier[key]
-
+        # Same deal for the holds.
+        existing_holds = {}
+        new_holds = {}
         for hold in remote_holds:
-            # This is a remote hold. Find or create the corresponding
-            # local hold.
-            pool = hold.license_pool(self._db)
-            start = hold.start_date
-            end = hold.end_date
-            position = hold.hold_position
             key = (hold.identifier_type, hold.identifier)
             if key in local_holds_by_identifier:
                 # We already have the Hold object, we don't need to look
                 # it up again.
                 local_hold = local_holds_by_identifier[key]
+                existing_holds[key] = local_hold
 
                 # But maybe the remote's opinions as to the hold's
                 # start or end date have changed.
-                local_hold.update(start, end, position)
-            else:
-                local_hold, new = pool.on_hold_to(patron, start, end, position)
-            active_holds.append(local_hold)
+                local_hold.update(
+                    hold.start_date, hold.end_date, hold.hold_position
+                )
 
-            # Check the local hold off the list we're keeping so that
-            # we don't delete it later.
-            if key in local_holds_by_identifier:
+                # Check the local hold off the list we're keeping so that
+                # we don't delete it later.
                 del local_holds_by_identifier[key]
+            elif key not in existing_holds:
+                new_holds[pool_for(hold).id] = dict(
+                    start=hold.start_date or now, end=hold.end_date,
+                    position=hold.hold_position
+                )
+        created_holds = self._bulk_create(Hold, patron, new_holds)
+
+        active_holds = []
+        for hold in remote_holds:
+            key = (hold.identifier_type, hold.identifier)
+            if key in existing_holds:
+                active_holds.append(existing_holds[key])
+            else:
+                active_holds.append(created_holds[pool_for(hold).id])
 
         # We only want to delete local loans and holds if we were able to
         # successfully sync with all the providers. If there was an error,
@@ -1121,21 +1602,29 @@ class CirculationAPI(object):
             # borrowing a book and syncing their bookshelf at the same time,
             # and the local loan was created after we got the remote loans.
             # If the loan's start date is less than a minute ago, we'll keep it.
+            stale_loans = []
             for loan in local_loans_by_identifier.values():
                 if loan.license_pool.collection_id in self.collection_ids_for_sync:
                     one_minute_ago = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
                     if loan.start < one_minute_ago:
                         logging.info("In sync_bookshelf for patron %s, deleting loan %d (patron %s)" % (patron.authorization_identifier, loan.id, loan.patron.authorization_identifier))
-                        self._db.delete(loan)
+                        stale_loans.append(loan)
                     else:
                         logging.info("In sync_bookshelf for patron %s, found local loan %d created in the past minute that wasn't in remote loans" % (patron.authorization_identifier, loan.id))
+            self._bulk_delete(Loan, stale_loans)
 
             # Every hold remaining in holds_by_identifier is a hold that
             # the provider doesn't know about, which means it's expired
             # and we should get rid of it.
-            for hold in local_holds_by_identifier.values():
-                if hold.license_pool.collection_id in self.collection_ids_for_sync:
-                    self._db.delete(hold)
+            stale_holds = [
+                hold for hold in local_holds_by_identifier.values()
+                if hold.license_pool.collection_id in self.collection_ids_for_sync
+            ]
+            self._bulk_delete(Hold, stale_holds)
+
+        # The patron's loans and holds have changed behind the ORM's
+        # back, so they need to be reloaded the next time they're used.
+        self._db.expire(patron, ['loans', 'holds'])
 
         __transaction.commit()
         return active_loans, active_holds
@@ -1178,9 +1667,22 @@ class BaseCirculationAPI(object):
         "description": _("Until it hears otherwise from the distributor, this server will assume that any given loan for this library from this collection will last this number of days. This number is usually a negotiated value between the library and the distributor. This only affects estimates&mdash;it cannot affect the actual length of loans.")
     }
 
+    # Unless a collection is configured otherwise, this is how many
+    # seconds we'll wait for a distributor to tell us about a patron's
+    # loans and holds before giving up and working with what we have.
+    PATRON_ACTIVITY_TIMEOUT = 30
+    PATRON_ACTIVITY_TIMEOUT_KEY = "patron_activity_timeout"
+
+    PATRON_ACTIVITY_TIMEOUT_SETTING = {
+        "key": PATRON_ACTIVITY_TIMEOUT_KEY,
+        "label": _("Bookshelf sync deadline (in seconds)"),
+        "type": "number",
+        "description": _("When a patron's bookshelf is synced, the circulation manager will stop waiting for this distributor after this many seconds. Loans and holds will not be removed from the bookshelf during a sync that hits the deadline."),
+    }
+
     # These collection-specific settings should be inherited by all
     # distributors.
-    SETTINGS = []
+    SETTINGS = [PATRON_ACTIVITY_TIMEOUT_SETTING]
 
     # These library- and collection-specific settings should be
     # inherited by all distributors.
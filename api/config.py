@@ -35,6 +35,10 @@ class Configuration(CoreConfiguration):
     # The name of the setting that controls how long static files are cached.
     STATIC_FILE_CACHE_TIME = u"static_file_cache_time"
 
+    # The name of the setting that controls how long the results of
+    # asking a distributor about a patron's loans and holds are cached.
+    PATRON_ACTIVITY_CACHE_TIME = u"patron_activity_cache_time"
+
     # A short description of the library, used in its Authentication
     # for OPDS document.
     LIBRARY_DESCRIPTION = 'library_description'
@@ -167,6 +171,12 @@ class Configuration(CoreConfiguration):
             "required": True,
             "type": "number",
         },
+        {
+            "key": PATRON_ACTIVITY_CACHE_TIME,
+            "label": _("Cache time for patron loans and holds reported by distributors (in seconds)"),
+            "type": "number",
+            "description": _("A patron who syncs their bookshelf again within this time won't cause another request to the distributors. Set to 0 to disable the cache. Defaults to 60."),
+        },
     ]
 
     LIBRARY_SETTINGS = CoreConfiguration.LIBRARY_SETTINGS + [
@@ -75,7 +75,6 @@ from core.model import (
     Loan,
     LicensePoolDeliveryMechanism,
     Patron,
-    Representation,
     Session,
     Work,
 )
@@ -141,7 +140,11 @@ from adobe_vendor_id import (
     DeviceManagementProtocolController,
     AuthdataUtility,
 )
-from circulation import CirculationAPI
+from circulation import (
+    CirculationAPI,
+    PatronActivityCache,
+    PatronActivityPool,
+)
 from shared_collection import SharedCollectionAPI
 from odl import ODLWithConsolidatedCopiesAPI
 from novelist import (
@@ -168,6 +171,14 @@ class CirculationManager(object):
                 sys.exit()
 
         self.testing = testing
+
+        # All of the CirculationAPIs share the worker threads used
+        # for checking patron activity, and a single cache of
+        # the results. Unlike the CirculationAPIs themselves, these
+        # survive configuration reloads.
+        self.patron_activity_pool = PatronActivityPool()
+        self.patron_activity_cache = PatronActivityCache()
+
         self.site_configuration_last_update = (
             Configuration.site_configuration_last_update(self._db, timeout=0)
         )
@@ -194,6 +205,13 @@ class CirculationManager(object):
         """
         LogConfiguration.initialize(self._db)
         self.analytics = Analytics(self._db)
+        cache_time = ConfigurationSetting.sitewide(
+            self._db, Configuration.PATRON_ACTIVITY_CACHE_TIME
+        ).int_value
+        if cache_time is None:
+            cache_time = PatronActivityCache.DEFAULT_TTL
+        self.patron_activity_cache.ttl = cache_time
+
         self.auth = Authenticator(self._db, self.analytics)
 
         self.setup_external_search()
@@ -321,7 +339,11 @@ class CirculationManager(object):
             cls = MockCirculationAPI
         else:
             cls = CirculationAPI
-        return cls(self._db, library, analytics)
+        return cls(
+            self._db, library, analytics,
+            patron_activity_pool=self.patron_activity_pool,
+            patron_activity_cache=self.patron_activity_cache,
+        )
 
     def setup_shared_collection(self):
         if self.testing:
@@ -947,6 +969,26 @@ class MARCRecordController(CirculationManagerController):
 
 class LoanController(CirculationManagerController):
 
+    # When fulfillment means proxying a file from a remote server,
+    # these headers from the patron's request are passed along...
+    PROXIED_REQUEST_HEADERS = [
+        'Range', 'If-Range', 'If-None-Match', 'If-Modified-Since'
+    ]
+
+    # ...and these headers from the remote server's response are
+    # passed back to the patron.
+    PROXIED_RESPONSE_HEADERS = [
+        'Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges',
+        'ETag', 'Last-Modified', 'Content-Disposition',
+    ]
+
+    # Proxied files are sent to the patron in chunks of this size, so
+    # the whole file never has to be held in memory.
+    PROXY_CHUNK_SIZE = 64 * 1024
+
+    # Refuse to proxy a file larger than this.
+    MAX_PROXIED_CONTENT_SIZE = 1024 * 1024 * 1024
+
     def get_patron_circ_objects(self, object_class, patron, license_pools):
         if not patron:
             return []
@@ -1165,8 +1207,12 @@ class LoanController(CirculationManagerController):
         :param part: Vendor-specific identifier used when fulfilling a
            specific part of a book rather than the whole thing (e.g. a
            single chapter of an audiobook).
+
+        :param do_get: A function that retrieves remote content and
+           returns a (status code, headers, content) 3-tuple. By
+           default, the content is streamed through to the patron.
         """
-        do_get = do_get or Representation.simple_http_get
+        do_get = do_get or self.proxy_remote_content
 
         # Unlike most controller methods, this one has different
         # behavior whether or not the patron is authenticated. This is
@@ -1301,11 +1347,19 @@ class LoanController(CirculationManagerController):
                 # Otherwise, we need to fetch the content and return it instead
                 # of redirecting to it, since it may be downloaded through an
                 # indirect acquisition link.
+                request_headers = dict(encoding_header)
+                for header in self.PROXIED_REQUEST_HEADERS:
+                    value = flask.request.headers.get(header)
+                    if value:
+                        request_headers[header] = value
                 try:
-                    status_code, headers, content = do_get(fulfillment.content_link, headers=encoding_header)
-                    headers = dict(headers)
+                    result = do_get(fulfillment.content_link, headers=request_headers)
                 except RemoteIntegrationException, e:
                     return e.as_problem_detail_document(debug=False)
+                if isinstance(result, ProblemDetail):
+                    return result
+                status_code, headers, content = result
+                headers = dict(headers)
             else:
                 status_code = 200
             if fulfillment.content_type:
@@ -1313,6 +1367,67 @@ class LoanController(CirculationManagerController):
 
         return Response(content, status_code, headers)
 
+    def proxy_remote_content(self, url, headers=None,
+                             do_get=HTTP.get_with_timeout):
+        """Start retrieving a remote file so it can be streamed to the patron.
+
+        :return: A (status code, headers, content) 3-tuple. `content`
+            is a generator that yields the file in chunks as they come
+            in from the remote server. If the remote server says up
+            front that the file is too large to proxy, a ProblemDetail
+            is returned instead.
+        :raise RemoteIntegrationException: If the file can't be
+            retrieved. The generator raises this if the file turns out
+            to be too large partway through, so the patron's
+            connection is broken off rather than ending as though the
+            whole file had been sent.
+        """
+        headers = dict(headers or {})
+        # Unless we've been told otherwise, ask for an unencoded file,
+        # so the Content-Length we pass on is the number of bytes
+        # we'll send.
+        headers.setdefault('Accept-Encoding', 'identity')
+        response = do_get(
+            url, headers=headers, stream=True, allow_redirects=True
+        )
+
+        max_size = self.MAX_PROXIED_CONTENT_SIZE
+        response_headers = dict()
+        for header in self.PROXIED_RESPONSE_HEADERS:
+            value = response.headers.get(header)
+            if value:
+                response_headers[header] = value
+        if response.headers.get('Content-Encoding'):
+            # The content will be decoded as it's streamed, so the
+            # remote server's Content-Length is wrong.
+            response_headers.pop('Content-Length', None)
+
+        length = response_headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > max_size:
+            response.close()
+            return PROXIED_CONTENT_TOO_LARGE.detailed(
+                _("The file is %(length)s bytes, but the largest file this server will send is %(max_size)s bytes.",
+                  length=length, max_size=max_size)
+            )
+
+        def content():
+            sent = 0
+            try:
+                for chunk in response.iter_content(self.PROXY_CHUNK_SIZE):
+                    sent += len(chunk)
+                    if sent > max_size:
+                        self.manager.log.error(
+                            "Stopped proxying %s after %d bytes.", url, sent
+                        )
+                        raise RemoteIntegrationException(
+                            url, "Remote file is too large to proxy."
+                        )
+                    yield chunk
+            finally:
+                response.close()
+
+        return response.status_code, response_headers, content()
+
     def can_fulfill_without_loan(self, library, patron, pool, lpdm):
         """Is it acceptable to fulfill the given LicensePoolDeliveryMechanism
         for the given Patron without creating a Loan first?
@@ -1612,8 +1727,12 @@ class WorkController(CirculationManagerController):
 
         lane_name = "Recommendations for %s by %s" % (work.title, work.author)
         try:
+            # Don't make the patron wait for NoveList. Until
+            # NoveListRecommendationsScript has looked up this book's
+            # recommendations, the feed is empty.
             lane = RecommendationLane(
-                library, work, lane_name, novelist_api=novelist_api
+                library, work, lane_name, novelist_api=novelist_api,
+                cached_only=True
             )
         except ValueError, e:
             # NoveList isn't configured.
@@ -13,7 +13,8 @@ from config import (
 from circulation import (
     LoanInfo,
     FulfillmentInfo,
-    BaseCirculationAPI
+    BaseCirculationAPI,
+    PatronActivityDeadline,
 )
 
 from circulation_exceptions import *
@@ -192,10 +193,11 @@ class EnkiAPI(BaseCirculationAPI, HasSelfTests):
 
         MockEnkiAPI overrides this method.
         """
+        kwargs.setdefault('timeout', 90)
         return HTTP.request_with_timeout(
             method, url, headers=headers, data=data,
-            params=params, timeout=90, disallowed_response_codes=None,
-            **kwargs
+            params=params, disallowed_response_codes=None,
+            **PatronActivityDeadline.apply(kwargs)
         )
 
     @classmethod
@@ -41,7 +41,10 @@ from core.model import (
 )
 
 from core.util import LanguageCodes
-from novelist import NoveListAPI
+from novelist import (
+    NoveListAPI,
+    NoveListRecommendationCache,
+)
 
 def load_lanes(_db, library):
     """Return a WorkList that reflects the current lane structure of the
@@ -880,9 +883,12 @@ class RelatedBooksLane(WorkBasedLane):
             lane_name = "Recommendations for %s by %s" % (
                 self.work.title, self.work.author
             )
+            # Don't make the patron wait for NoveList. If the
+            # recommendations haven't been looked up yet, the lane
+            # is left out until they have been.
             recommendation_lane = RecommendationLane(
                 self.get_library(_db), self.work, lane_name, novelist_api=novelist_api,
-                parent=self,
+                parent=self, cached_only=True,
             )
             if recommendation_lane.recommendations:
                 yield recommendation_lane
@@ -899,24 +905,30 @@ class RecommendationLane(WorkBasedLane):
     MAX_CACHE_AGE = 7*24*60*60      # one week
 
     def __init__(self, library, work, display_name=None,
-                 novelist_api=None, parent=None):
+                 novelist_api=None, parent=None, cached_only=False):
         super(RecommendationLane, self).__init__(
             library, work, display_name=display_name,
         )
         _db = Session.object_session(library)
         self.api = novelist_api or NoveListAPI.from_config(library)
+        self.cached_only = cached_only
         self.recommendations = self.fetch_recommendations(_db)
         if parent:
             parent.children.append(self)
 
     def fetch_recommendations(self, _db):
-        """Get identifiers of recommendations for this LicensePool"""
+        """Get identifiers of recommendations for this LicensePool
 
-        metadata = self.api.lookup(self.edition.primary_identifier)
-        if metadata:
-            metadata.filter_recommendations(_db)
-            return metadata.recommendations
-        return []
+        Recommendations that were looked up recently are reused. If
+        there aren't any and this lane is `cached_only`, the lane is
+        empty until NoveListRecommendationsScript looks them up.
+        """
+        cache = NoveListRecommendationCache(self.get_library(_db))
+        identifier = self.edition.primary_identifier
+        recommendations = cache.get(identifier)
+        if recommendations is None and not self.cached_only:
+            recommendations = cache.resolve(self.api, identifier)
+        return recommendations or []
 
     def apply_filters(self, _db, qu, facets, pagination, featured=False):
         if not self.recommendations:
@@ -11,16 +11,65 @@ from core.model import (
     Session,
 )
 
+class MARCExportSettings(object):
+    """The library's settings for a MARC export integration, looked up
+    once so they don't have to be looked up again for every record.
+    """
+
+    def __init__(self, library, integration=None):
+        _db = Session.object_session(library)
+
+        def value(key):
+            return ConfigurationSetting.for_library_and_externalintegration(
+                _db, key, library, integration).value
+
+        self.marc_org = None
+        self.include_summary = False
+        self.include_genres = False
+        web_client_urls = []
+        if integration:
+            self.marc_org = value(MARCExporter.MARC_ORGANIZATION_CODE)
+            self.include_summary = (value(MARCExporter.INCLUDE_SUMMARY) == "true")
+            self.include_genres = (value(MARCExporter.INCLUDE_SIMPLIFIED_GENRES) == "true")
+            marc_setting = value(MARCExporter.WEB_CLIENT_URL)
+            if marc_setting:
+                web_client_urls.append(marc_setting)
+
+        from api.registry import Registration
+        web_client_urls += [s.value for s in _db.query(
+            ConfigurationSetting
+        ).filter(
+            ConfigurationSetting.key==Registration.LIBRARY_REGISTRATION_WEB_CLIENT,
+            ConfigurationSetting.library_id==library.id
+        ) if s.value]
+
+        # Each book's 856 field is one of these prefixes followed by
+        # the book's quoted identifier.
+        self.book_url_prefixes = tuple(
+            url + "/book/" for url in web_client_urls
+        )
+
+
 class LibraryAnnotator(Annotator):
     def __init__(self, library):
         super(LibraryAnnotator, self).__init__()
         self.library = library
-
-    def value(self, key, integration):
-        _db = Session.object_session(integration)
-        return ConfigurationSetting.for_library_and_externalintegration(
-            _db, key, self.library, integration).value
-
+        self._settings = {}
+
+    def settings(self, integration=None, library=None):
+        """Find the MARCExportSettings for an integration.
+
+        The settings for this annotator's library are only looked up
+        the first time, so an annotator should be created for each
+        export.
+        """
+        library = library or self.library
+        if library != self.library:
+            return MARCExportSettings(library, integration)
+        key = integration.id if integration else None
+        if key not in self._settings:
+            self._settings[key] = MARCExportSettings(library, integration)
+        return self._settings[key]
 
     def annotate_work_record(self, work, active_license_pool, edition,
                              identifier, record, integration=None, updated=None):
@@ -28,45 +77,32 @@ class LibraryAnnotator(Annotator):
             work, active_license_pool, edition, identifier, record, integration, updated)
 
         if integration:
-            marc_org = self.value(MARCExporter.MARC_ORGANIZATION_CODE, integration)
-            include_summary = (self.value(MARCExporter.INCLUDE_SUMMARY, integration) == "true")
-            include_genres = (self.value(MARCExporter.INCLUDE_SIMPLIFIED_GENRES, integration) == "true")
+            settings = self.settings(integration)
 
-            if marc_org:
-                self.add_marc_organization_code(record, marc_org)
+            if settings.marc_org:
+                self.add_marc_organization_code(record, settings.marc_org)
 
-            if include_summary:
+            if settings.include_summary:
                 self.add_summary(record, work)
 
-            if include_genres:
+            if settings.include_genres:
                 self.add_simplified_genres(record, work)
 
         self.add_web_client_urls(record, self.library, identifier, integration)
 
     def add_web_client_urls(self, record, library, identifier, integration=None):
-        _db = Session.object_session(library)
-        settings = []
-
-        if integration:
-            marc_setting = self.value(MARCExporter.WEB_CLIENT_URL, integration)
-            if marc_setting:
-                settings.append(marc_setting)
-
-        from api.registry import Registration
-        settings += [s.value for s in _db.query(
-            ConfigurationSetting
-        ).filter(
-            ConfigurationSetting.key==Registration.LIBRARY_REGISTRATION_WEB_CLIENT,
-            ConfigurationSetting.library_id==library.id
-        ) if s.value]
-
-        for setting in settings:
+        prefixes = self.settings(integration, library).book_url_prefixes
+        if not prefixes:
+            return
+
+        quoted_identifier = urllib.quote(
+            identifier.type + "/" + identifier.identifier, safe=''
+        )
+        for prefix in prefixes:
             record.add_field(
                 Field(
                     tag="856",
                     indicators=["4", "0"],
                     subfields=[
-                        "u", setting + "/book/" + urllib.quote(identifier.type + "/" + identifier.identifier, safe='')
+                        "u", prefix + quoted_identifier
                     ]))
-
-
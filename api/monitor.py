@@ -1,9 +1,11 @@
 import datetime
-import feedparser
 import logging
 import os
 import sys
+from dateutil import parser as date_parser
+from dateutil.tz import tzutc
 from lxml import etree
+from multiprocessing.pool import ThreadPool
 from nose.tools import set_trace
 from StringIO import StringIO
 
@@ -41,6 +43,77 @@ from odl import (
 )
 
 
+class ParsedFeedOPDSImporter(OPDSImporter):
+    """An OPDSImporter that can import a feed its caller has already
+    parsed with lxml, rather than parsing it with lxml again.
+
+    OPDSImporter.import_from_feed also runs feedparser over the feed,
+    and that still happens.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ParsedFeedOPDSImporter, self).__init__(*args, **kwargs)
+        self._parsed = None
+
+    def import_from_parsed_feed(self, feed, tree):
+        """Import a feed.
+
+        :param feed: The feed, as a string.
+        :param tree: The result of parsing `feed` with lxml.
+        :return: The same as import_from_feed.
+        """
+        self._parsed = (feed, tree)
+        try:
+            return self.import_from_feed(feed)
+        finally:
+            self._parsed = None
+
+    def extract_metadata_from_elementtree(self, feed, data_source,
+                                          feed_url=None, do_get=None):
+        if not self._parsed or self._parsed[0] is not feed:
+            return super(
+                ParsedFeedOPDSImporter, self
+            ).extract_metadata_from_elementtree(
+                feed, data_source, feed_url=feed_url, do_get=do_get
+            )
+
+        # This does what OPDSImporter.extract_metadata_from_elementtree
+        # does once it has parsed the feed. Keep the two in step.
+        root = self._parsed[1]
+        parser = self.PARSER_CLASS()
+        values = {}
+        failures = {}
+        if not feed_url:
+            self_links = [
+                link.get('href') for link in parser._xpath(
+                    root, '/atom:feed/atom:link[@rel="self"]'
+                )
+            ]
+            if self_links:
+                feed_url = self_links[0]
+
+        for failure in self.coveragefailures_from_messages(
+            data_source, parser, root
+        ):
+            if isinstance(failure, Identifier):
+                # The message doesn't actually represent a failure.
+                identifier = failure
+            else:
+                identifier = failure.obj
+            failures[identifier.urn] = failure
+
+        for entry in parser._xpath(root, '/atom:feed/atom:entry'):
+            identifier, detail, failure = self.detail_for_elementtree_entry(
+                parser, entry, data_source, feed_url, do_get=do_get
+            )
+            if identifier:
+                if failure:
+                    failures[identifier] = failure
+                if detail:
+                    values[identifier] = detail
+        return values, failures
+
+
 class MetadataWranglerCollectionMonitor(CollectionMonitor):
 
     """Abstract base CollectionMonitor with helper methods for interactions
@@ -54,19 +127,26 @@ class MetadataWranglerCollectionMonitor(CollectionMonitor):
         self.lookup = lookup or MetadataWranglerOPDSLookup.from_config(
             self._db, collection=collection
         )
-        self.importer = OPDSImporter(
+        self.importer = ParsedFeedOPDSImporter(
             self._db, self.collection,
             data_source_name=DataSource.METADATA_WRANGLER,
             metadata_client=self.lookup, map_from_collection=True,
         )
+        self.parser = OPDSXMLParser()
+
+        # While run_once is running, the next page of a feed is
+        # fetched in the background while the current page is being
+        # processed.
+        self.prefetch_pool = None
+        self.prefetched = {}
+        self.requested = set()
 
     def get_response(self, url=None, **kwargs):
         try:
-            if url:
-                response = self.lookup._get(url)
+            if url in self.prefetched:
+                response = self.prefetched.pop(url).get()
             else:
-                response = self.endpoint(**kwargs)
-            self.lookup.check_content_type(response)
+                response = self.fetch(url, **kwargs)
             return response
         except RemoteIntegrationException as e:
             self.log.error(
@@ -75,6 +155,79 @@ class MetadataWranglerCollectionMonitor(CollectionMonitor):
             )
             raise e
 
+    def fetch(self, url=None, **kwargs):
+        """Retrieve a page of a feed from the metadata wrangler.
+
+        This may be called in a background thread, so it must not use
+        the database.
+        """
+        if url:
+            self.requested.add(url)
+            response = self.lookup._get(url)
+        else:
+            response = self.endpoint(**kwargs)
+        self.lookup.check_content_type(response)
+        return response
+
+    def start_prefetching(self):
+        self.prefetch_pool = ThreadPool(1)
+        self.prefetched = {}
+        self.requested = set()
+
+    def stop_prefetching(self):
+        if self.prefetch_pool:
+            self.prefetch_pool.terminate()
+            self.prefetch_pool.join()
+        self.prefetch_pool = None
+        self.prefetched = {}
+
+    def prefetch(self, urls):
+        """Start fetching these pages in the background, unless they've
+        already been requested.
+        """
+        if not self.prefetch_pool:
+            return
+        for url in urls:
+            if url in self.requested or url in self.prefetched:
+                continue
+            self.prefetched[url] = self.prefetch_pool.apply_async(
+                self.fetch, (url,)
+            )
+
+    def parse_feed(self, feed):
+        """Parse a page of an OPDS feed.
+
+        :return: A 2-tuple (parsed document, list of <entry> tags).
+        """
+        tree = etree.parse(StringIO(feed))
+        return tree, self.parser._xpath(tree, '/atom:feed/atom:entry')
+
+    def extract_next_links(self, tree):
+        return [
+            link.get('href') for link in self.parser._xpath(
+                tree, '/atom:feed/atom:link[@rel="next"]'
+            )
+        ]
+
+    def extract_last_update_dates(self, entries):
+        """Find the identifier and last update time of each entry.
+
+        :return: A list of 2-tuples (identifier, datetime), leaving out
+            any entry with no update time. Times are converted to
+            naive UTC datetimes.
+        """
+        dates = []
+        for entry in entries:
+            identifier = self.parser.text_of_optional_subtag(entry, 'atom:id')
+            updated = self.parser.text_of_optional_subtag(entry, 'atom:updated')
+            if not updated:
+                continue
+            updated = date_parser.parse(updated)
+            if updated.tzinfo:
+                updated = updated.astimezone(tzutc()).replace(tzinfo=None)
+            dates.append((identifier, updated))
+        return dates
+
     def endpoint(self, *args, **kwargs):
         raise NotImplementedError()
 
@@ -102,6 +255,13 @@ class MWCollectionUpdateMonitor(MetadataWranglerCollectionMonitor):
 
     def run_once(self, start, cutoff):
         self.assert_authenticated()
+        self.start_prefetching()
+        try:
+            return self._run_once(start, cutoff)
+        finally:
+            self.stop_prefetching()
+
+    def _run_once(self, start, cutoff):
         queue = [None]
         seen_links = set()
 
@@ -143,18 +303,25 @@ class MWCollectionUpdateMonitor(MetadataWranglerCollectionMonitor):
         if not response:
             return [], [], timestamp
 
-        # Import the metadata
+        # Find the 'next' links and last update times. The importer
+        # uses the same parsed copy of the feed.
         raw_feed = response.text
-        (editions, licensepools,
-         works, errors) = self.importer.import_from_feed(raw_feed)
+        tree, entries = self.parse_feed(raw_feed)
+        next_links = self.extract_next_links(tree)
+        update_dates = self.extract_last_update_dates(entries)
 
-        # TODO: this oughtn't be necessary, because import_from_feed
-        # already parsed the feed, but there's no way to access the
-        # parsed copy.
-        parsed = feedparser.parse(raw_feed)
+        # If this page isn't empty, the next page will probably be
+        # needed, so start fetching it now.
+        if entries:
+            self.prefetch(next_links)
+
+        # Import the metadata
+        (editions, licensepools,
+         works, errors) = self.importer.import_from_parsed_feed(
+             raw_feed, tree
+         )
 
         # Get last update times to set the timestamp.
-        update_dates = self.importer.extract_last_update_dates(parsed)
         update_dates = [d[1] for d in update_dates]
         if update_dates:
             # We know that every entry updated before the earliest
@@ -163,8 +330,6 @@ class MWCollectionUpdateMonitor(MetadataWranglerCollectionMonitor):
             # earlier date.
             timestamp = min(update_dates)
 
-        # Add all links with rel='next' to the queue.
-        next_links = self.importer.extract_next_links(parsed)
         return next_links, editions, timestamp
 
 
@@ -186,7 +351,6 @@ class MWAuxiliaryMetadataMonitor(MetadataWranglerCollectionMonitor):
         super(MWAuxiliaryMetadataMonitor, self).__init__(
             _db, collection, lookup=lookup
         )
-        self.parser = OPDSXMLParser()
         self.provider = provider or MetadataUploadCoverageProvider(
             collection, lookup_client=lookup
         )
@@ -196,7 +360,13 @@ class MWAuxiliaryMetadataMonitor(MetadataWranglerCollectionMonitor):
 
     def run_once(self, start, cutoff):
         self.assert_authenticated()
+        self.start_prefetching()
+        try:
+            self._run_once(start, cutoff)
+        finally:
+            self.stop_prefetching()
 
+    def _run_once(self, start, cutoff):
         queue = [None]
         seen_links = set()
 
@@ -225,10 +395,14 @@ class MWAuxiliaryMetadataMonitor(MetadataWranglerCollectionMonitor):
     def get_identifiers(self, url=None):
         """Pulls mapped identifiers from a feed of SimplifiedOPDSMessages."""
         response = self.get_response(url=url)
-        feed = response.text
+        etree_feed, entries = self.parse_feed(response.text)
+        messages = list(self.importer.extract_messages(self.parser, etree_feed))
+        next_links = self.extract_next_links(etree_feed)
 
-        etree_feed = etree.parse(StringIO(response.text))
-        messages = self.importer.extract_messages(self.parser, etree_feed)
+        # If this page asked for anything, the next page will probably
+        # be needed, so start fetching it now.
+        if messages:
+            self.prefetch(next_links)
 
         urns = [m.urn for m in messages]
         identifiers_by_urn, _failures = Identifier.parse_urns(
@@ -245,12 +419,42 @@ class MWAuxiliaryMetadataMonitor(MetadataWranglerCollectionMonitor):
             )
             mapped_identifiers.append(mapped_identifier)
 
-        parsed_feed = feedparser.parse(feed)
-        next_links = self.importer.extract_next_links(parsed_feed)
         return mapped_identifiers, next_links
 
+def delete_in_batches(_db, model_class, qu, batch_size=1000):
+    """Delete every row found by a query, a batch at a time, without
+    loading any of them as objects.
+
+    The IDs of up to `batch_size` matching rows are looked up, those
+    rows are deleted with a single DELETE statement, and the
+    transaction is committed. This repeats until the query finds
+    nothing.
+
+    Since the rows are never loaded, no ORM-level cascades happen,
+    so this is only suitable for rows that nothing else depends on.
+
+    :param model_class: The class whose rows are being deleted.
+    :param qu: A query that finds the IDs of the rows to delete.
+    :yield: The total number of rows deleted so far, after each batch.
+    """
+    deleted = 0
+    while True:
+        ids = [id for [id] in qu.limit(batch_size)]
+        if not ids:
+            break
+        _db.query(model_class).filter(
+            model_class.id.in_(ids)
+        ).delete(synchronize_session=False)
+        _db.commit()
+        deleted += len(ids)
+        yield deleted
+
+
 class LoanlikeReaperMonitor(ReaperMonitor):
 
+    # Loans and holds are deleted this many at a time.
+    BATCH_SIZE = 1000
+
     SOURCE_OF_TRUTH_PROTOCOLS = [
         ODLWithConsolidatedCopiesAPI.NAME,
         SharedODLAPI.NAME,
@@ -287,6 +491,19 @@ class LoanlikeReaperMonitor(ReaperMonitor):
                 )
         return ~self.MODEL_CLASS.id.in_(source_of_truth_subquery)
 
+    def run_once(self, *args, **kwargs):
+        """Delete the loans or holds in bulk, rather than loading and
+        deleting them one at a time.
+        """
+        qu = self._db.query(self.MODEL_CLASS.id).filter(self.where_clause)
+        what = self.MODEL_CLASS.__tablename__
+        deleted = 0
+        for deleted in delete_in_batches(
+            self._db, self.MODEL_CLASS, qu, self.BATCH_SIZE
+        ):
+            self.log.info("Deleted %d %s so far.", deleted, what)
+        self.log.info("Deleted %d %s.", deleted, what)
+
 
 class LoanReaper(LoanlikeReaperMonitor):
     """Remove expired and abandoned loans from the database."""
@@ -1,7 +1,14 @@
+import copy
+import datetime
 import json
 import logging
+import time
 import urllib
-from collections import Counter
+from collections import (
+    Counter,
+    OrderedDict,
+)
+from multiprocessing.pool import ThreadPool
 from nose.tools import set_trace
 from flask_babel import lazy_gettext as _
 
@@ -27,23 +34,30 @@ from core.model import (
     Representation,
     Session,
     Subject,
+    Timestamp,
     get_one,
+    get_one_or_create,
     Equivalency,
     LicensePool,
     Collection,
     Edition,
     Contributor,
     Contribution,
+    Work,
 )
 from core.util import TitleProcessor
 from sqlalchemy.sql import (
     select,
     join,
     and_,
+    func,
     or_,
 )
 from sqlalchemy.orm import aliased
-from core.util.http import HTTP
+from core.util.http import (
+    HTTP,
+    RequestNetworkException,
+)
 
 class NoveListAPI(object):
 
@@ -72,6 +86,31 @@ class NoveListAPI(object):
 
     NO_ISBN_EQUIVALENCY = "No clear ISBN equivalency: %r"
 
+    # The collection is sent to NoveList in batches of items for this
+    # many LicensePool identifiers. NoveList adds the records in each
+    # PUT to what it already has for the customer, matching them up by
+    # ISBN. If that ever stops being true, set this to None and the
+    # whole collection will be sent in one PUT.
+    UPLOAD_BATCH_SIZE = 1000
+
+    # A batch that fails because of a network or server error is tried
+    # this many times, waiting a little longer before each retry.
+    MAX_UPLOAD_ATTEMPTS = 3
+    UPLOAD_RETRY_DELAY = 5
+
+    # The name of the Timestamp whose counter records the database ID
+    # of the last LicensePool identifier whose items have been sent to
+    # NoveList.
+    UPLOAD_CHECKPOINT = u"NoveList upload: library %s"
+
+    # At most this many ISBNs are looked up at once.
+    DEFAULT_CONCURRENCY = 4
+
+    # Parsed lookup results are remembered for this many ISBNs, so a
+    # cached Representation isn't parsed again every time. They're
+    # only used for as long as the Representation would have been.
+    METADATA_MEMO_SIZE = 1000
+
     # While the NoveList API doesn't require parameters to be passed via URL,
     # the Representation object needs a unique URL to return the proper data
     # from the database.
@@ -125,10 +164,13 @@ class NoveListAPI(object):
             cls._configuration_library_id = library.id
         return cls.IS_CONFIGURED
 
-    def __init__(self, _db, profile, password):
+    def __init__(self, _db, profile, password, concurrency=None):
         self._db = _db
         self.profile = profile
         self.password = password
+        self.concurrency = max(concurrency or self.DEFAULT_CONCURRENCY, 1)
+        self._metadata_memo = OrderedDict()
+        self._license_sources = dict()
 
     @property
     def source(self):
@@ -139,17 +181,14 @@ class NoveListAPI(object):
 
         :return: Metadata object or None
         """
-        lookup_metadata = []
-        license_sources = DataSource.license_sources_for(self._db, identifier)
+        license_sources = self.license_sources_for(identifier)
 
         # Find strong ISBN equivalents.
-        isbns = list()
-        for license_source in license_sources:
-            isbns += [eq.output for eq in identifier.equivalencies if (
-                eq.data_source==license_source and
-                eq.strength==1 and
-                eq.output.type==Identifier.ISBN
-            )]
+        isbns = [eq.output for eq in identifier.equivalencies if (
+            eq.data_source in license_sources and
+            eq.strength==1 and
+            eq.output.type==Identifier.ISBN
+        )]
 
         if not isbns:
             self.log.warn(
@@ -159,11 +198,9 @@ class NoveListAPI(object):
             return None
 
         # Look up metadata for all equivalent ISBNs.
-        lookup_metadata = list()
-        for isbn in isbns:
-            metadata = self.lookup(isbn)
-            if metadata:
-                lookup_metadata.append(metadata)
+        lookup_metadata = [
+            metadata for metadata in self.lookup_batch(isbns) if metadata
+        ]
 
         if not lookup_metadata:
             self.log.warn(
@@ -179,7 +216,17 @@ class NoveListAPI(object):
             if round(confidence, 2) < 0.5:
                 self.log.warn(self.NO_ISBN_EQUIVALENCY, identifier)
                 return None
-            return metadata
+            return best_metadata
+
+    def license_sources_for(self, identifier):
+        """The DataSources that license books with this type of
+        identifier. They're only looked up once for each type.
+        """
+        if identifier.type not in self._license_sources:
+            self._license_sources[identifier.type] = list(
+                DataSource.license_sources_for(self._db, identifier)
+            )
+        return self._license_sources[identifier.type]
 
     @classmethod
     def _confirm_same_identifier(self, metadata_objects):
@@ -226,24 +273,71 @@ class NoveListAPI(object):
 
         :return: Metadata object or None
         """
-        client_identifier = identifier.urn
         if identifier.type != Identifier.ISBN:
             return self.lookup_equivalent_isbns(identifier)
+        [metadata] = self.lookup_batch([identifier])
+        return metadata
 
-        params = dict(
-            ClientIdentifier=client_identifier, ISBN=identifier.identifier,
-            version=self.version, profile=self.profile, password=self.password
-        )
-        scrubbed_url = unicode(self.scrubbed_url(params))
+    def lookup_batch(self, identifiers):
+        """Requests NoveList metadata for a number of identifiers.
 
-        representation = self.cached_representation(scrubbed_url)
-        if not representation:
-            self.log.info("No cached NoveList request available.")
+        ISBNs that weren't looked up recently are requested from
+        NoveList at the same time, by up to `concurrency` worker
+        threads. Other identifiers are looked up through their
+        equivalent ISBNs.
+
+        :return: A list containing a Metadata object or None for each
+            identifier.
+        """
+        results = [None] * len(identifiers)
+        requests = []
+        for index, identifier in enumerate(identifiers):
+            if identifier.type != Identifier.ISBN:
+                results[index] = self.lookup_equivalent_isbns(identifier)
+                continue
+
+            params = dict(
+                ClientIdentifier=identifier.urn, ISBN=identifier.identifier,
+                version=self.version, profile=self.profile,
+                password=self.password
+            )
+            scrubbed_url = unicode(self.scrubbed_url(params))
+            memo = self._metadata_memo.pop(scrubbed_url, None)
+            if memo:
+                metadata, fetched_at = memo
+                if self.is_fresh(fetched_at):
+                    results[index] = self.remember(
+                        scrubbed_url, metadata, fetched_at
+                    )
+                    continue
+
+            representation = self.cached_representation(scrubbed_url)
+            if representation:
+                results[index] = self.remember(
+                    scrubbed_url, self.lookup_info_to_metadata(representation),
+                    representation.fetched_at
+                )
+                continue
 
-            url = self.build_query_url(params)
-            self.log.debug("NoveList lookup: %s",  url)
-            representation, from_cache = Representation.post(
-                self._db, unicode(url), '', max_age=self.MAX_REPRESENTATION_AGE,
+            self.log.info("No cached NoveList request available.")
+            url = unicode(self.build_query_url(params))
+            self.log.debug("NoveList lookup: %s", scrubbed_url)
+            requests.append((index, url, scrubbed_url))
+
+        responses = self.post_concurrently([r[1] for r in requests])
+        for (index, url, scrubbed_url), response in zip(requests, responses):
+            def do_post(url, headers, **kwargs):
+                status_code, headers, content, exception = response
+                if exception:
+                    raise exception
+                return status_code, headers, content
+
+            # The request has already been sent, so this just
+            # stores the response, the same way Representation.post
+            # would have.
+            representation, from_cache = Representation.get(
+                self._db, url, do_get=do_post,
+                max_age=self.MAX_REPRESENTATION_AGE,
                 response_reviewer=self.review_response
             )
 
@@ -252,7 +346,64 @@ class NoveListAPI(object):
             # and lets multiple libraries to use the same cached representation.
             representation.url = scrubbed_url
 
-        return self.lookup_info_to_metadata(representation)
+            metadata = self.lookup_info_to_metadata(representation)
+            if not representation.fetch_exception:
+                metadata = self.remember(
+                    scrubbed_url, metadata, representation.fetched_at
+                )
+            results[index] = metadata
+        return results
+
+    def post_concurrently(self, urls):
+        """Send lookup requests to NoveList, several at a time.
+
+        The requests are sent from worker threads, so nothing here
+        can use the database.
+
+        :return: A list containing a 4-tuple (status_code, headers,
+            content, exception) for each URL.
+        """
+        def post(url):
+            try:
+                status_code, headers, content = self.post(url)
+                return status_code, headers, content, None
+            except Exception, e:
+                return None, None, None, e
+
+        if len(urls) < 2 or self.concurrency < 2:
+            return [post(url) for url in urls]
+
+        pool = ThreadPool(min(self.concurrency, len(urls)))
+        try:
+            return pool.map(post, urls)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def post(self, url):
+        response = HTTP.post_with_timeout(url, '')
+        return response.status_code, response.headers, response.content
+
+    def remember(self, scrubbed_url, metadata, fetched_at):
+        """Remember the result of a lookup, forgetting the least
+        recently used results if there are too many.
+
+        :param fetched_at: When NoveList sent the result.
+        :return: A copy of `metadata`. Callers change the Metadata
+            they're given (e.g. with filter_recommendations), so the
+            remembered object is never handed out.
+        """
+        self._metadata_memo[scrubbed_url] = (metadata, fetched_at)
+        while len(self._metadata_memo) > self.METADATA_MEMO_SIZE:
+            self._metadata_memo.popitem(last=False)
+        return copy.copy(metadata)
+
+    def is_fresh(self, fetched_at):
+        """Is a result NoveList sent at `fetched_at` still usable?"""
+        if not fetched_at:
+            return False
+        age = datetime.datetime.utcnow() - fetched_at
+        return age.total_seconds() <= self.MAX_REPRESENTATION_AGE
 
     @classmethod
     def review_response(cls, response):
@@ -464,14 +615,24 @@ class NoveListAPI(object):
     def get_items_from_query(self, library):
         """Gets identifiers and its related title, medium, and authors from the
         database.
+
+        :return: A list of items, one per ISBN.
+        """
+        return list(self.iterate_items_from_query(library))
+
+    def iterate_items_from_query(self, library, identifier_ids=None):
+        """Gets identifiers and its related title, medium, and authors from the
+        database, reading the rows through a server-side cursor.
         Keeps track of the current 'ISBN' identifier and current item object that
         is being processed. If the next ISBN being processed is new, the existing one
-        gets added to the list of items. If the ISBN is the same, then we append
+        gets yielded. If the ISBN is the same, then we update
         the Author property since there are multiple contributors.
+
+        :param identifier_ids: Only look at LicensePools with these
+            identifiers, as found by upload_batch.
+        :yield: One item per ISBN.
         """
-        collectionList = []
-        for c in library.collections:
-            collectionList.append(c.id)
+        collectionList = self.collection_ids(library)
 
         LEFT_OUTER_JOIN = True
         i1 = aliased(Identifier)
@@ -481,6 +642,14 @@ class NoveListAPI(object):
         # setting the 'narrator' field in the NoveList API document.
         # roles.append(Contributor.NARRATOR_ROLE)
 
+        clauses = [
+            LicensePool.collection_id.in_(collectionList),
+            or_(i1.type=="ISBN", i2.type=="ISBN"),
+            or_(Contribution.role.in_(roles))
+        ]
+        if identifier_ids is not None:
+            clauses.append(i1.id.in_(identifier_ids))
+
         isbnQuery = select(
             [i1.identifier, i1.type, i2.identifier,
             Edition.title, Edition.medium,
@@ -496,37 +665,58 @@ class NoveListAPI(object):
             .join(Contribution, Edition.id==Contribution.edition_id)
             .join(Contributor, Contribution.contributor_id==Contributor.id)
         ).where(
-            and_(
-                LicensePool.collection_id.in_(collectionList),
-                or_(i1.type=="ISBN", i2.type=="ISBN"),
-                or_(Contribution.role.in_(roles))
-            )
+            and_(*clauses)
         ).order_by(i1.identifier, i2.identifier)
 
-        result = self._db.execute(isbnQuery)
+        result = self._db.execute(
+            isbnQuery.execution_options(stream_results=True)
+        )
 
-        items = []
-        newItem = None
-        existingItem = None
+        item = None
         currentIdentifier = None
-        for item in result:
-            if newItem:
-                existingItem = newItem
-            (currentIdentifier, existingItem, newItem, addItem) = (
-                self.create_item_object(item, currentIdentifier, existingItem)
-            )
-
-            if addItem and existingItem:
-                # The Role property isn't needed in the actual request.
-                del existingItem['role']
-                items.append(existingItem)
-
-        # For the case when there's only one item in `result`
-        if newItem:
-            del newItem['role']
-            items.append(newItem)
-
-        return items
+        try:
+            for row in result:
+                (currentIdentifier, existingItem, newItem, addItem) = (
+                    self.create_item_object(row, currentIdentifier, item)
+                )
+                if addItem:
+                    if item:
+                        # The Role property isn't needed in the actual request.
+                        del item['role']
+                        yield item
+                    item = newItem
+        finally:
+            result.close()
+
+        if item:
+            del item['role']
+            yield item
+
+    def collection_ids(self, library):
+        return [c.id for c in library.collections]
+
+    def upload_batch(self, library, after=None):
+        """Find the LicensePool identifiers whose items go in the next
+        batch sent to NoveList.
+
+        This is a keyset query on the identifier's database ID, so
+        finding each batch takes about the same amount of work no
+        matter how far into the collection it is.
+
+        :param after: Only look at identifiers with database IDs
+            greater than this one.
+        :return: A list of up to UPLOAD_BATCH_SIZE Identifier IDs,
+            in order.
+        """
+        qu = self._db.query(LicensePool.identifier_id).filter(
+            LicensePool.collection_id.in_(self.collection_ids(library))
+        ).distinct()
+        if after is not None:
+            qu = qu.filter(LicensePool.identifier_id > after)
+        qu = qu.order_by(LicensePool.identifier_id).limit(
+            self.UPLOAD_BATCH_SIZE
+        )
+        return [identifier_id for (identifier_id,) in qu]
 
     def create_item_object(self, object, currentIdentifier, existingItem):
         """Returns a new item if the current identifier that was processed
@@ -573,32 +763,105 @@ class NoveListAPI(object):
             return (isbn, existingItem, newItem, True)
 
     def put_items_novelist(self, library):
-        items = self.get_items_from_query(library)
+        """Send everything in the library's collections to NoveList.
 
-        content = None
-        if items:
-            data=json.dumps(self.make_novelist_data_object(items))
-            response = self.put(
-                self.COLLECTION_DATA_API,
-                {
-                    "AuthorizedIdentifier": self.AUTHORIZED_IDENTIFIER,
-                    "Content-Type": "application/json; charset=utf-8"
-                },
-                data=data
+        The items are sent in batches. After each batch is accepted,
+        a checkpoint is stored and committed, so if this is interrupted,
+        the next call will pick up where this one left off.
+
+        :return: NoveList's response to the last batch sent, or None
+            if nothing was sent.
+        """
+        checkpoint = self.upload_checkpoint(library)
+        after = checkpoint.counter
+        if after is None:
+            checkpoint.start = datetime.datetime.utcnow()
+        else:
+            self.log.info(
+                "Resuming upload to NoveList after identifier %s", after
             )
-            if (response.status_code == 200):
-                content = json.loads(response.content)
-                logging.info(
-                    "Success from NoveList: %r", response.content
+
+        content = None
+        while True:
+            identifier_ids = self.upload_batch(library, after)
+            if not identifier_ids:
+                break
+
+            items = list(self.iterate_items_from_query(
+                library, identifier_ids
+            ))
+            if items:
+                response = self.put_batch(items)
+                if response is None:
+                    # Leave the checkpoint where it is. The next run
+                    # will try this batch again.
+                    return content
+                content = response
+            after = identifier_ids[-1]
+            checkpoint.counter = after
+            self._db.commit()
+
+            if (self.UPLOAD_BATCH_SIZE is None
+                or len(identifier_ids) < self.UPLOAD_BATCH_SIZE):
+                break
+
+        checkpoint.counter = None
+        checkpoint.finish = datetime.datetime.utcnow()
+        self._db.commit()
+        return content
+
+    def put_batch(self, items):
+        """Send one batch of items to NoveList, trying again if
+        something goes wrong on the network or on NoveList's end.
+
+        :return: The parsed response, or None if the batch couldn't
+            be sent.
+        """
+        data = json.dumps(self.make_novelist_data_object(items))
+        for attempt in range(1, self.MAX_UPLOAD_ATTEMPTS+1):
+            try:
+                response = self.put(
+                    self.COLLECTION_DATA_API,
+                    {
+                        "AuthorizedIdentifier": self.AUTHORIZED_IDENTIFIER,
+                        "Content-Type": "application/json; charset=utf-8"
+                    },
+                    data=data
+                )
+            except RequestNetworkException, e:
+                logging.error(
+                    "Network error sending %d items to NoveList: %s",
+                    len(items), e
                 )
             else:
-                logging.error("Data sent was: %r", data)
+                if (response.status_code == 200):
+                    logging.info(
+                        "Success from NoveList: %r", response.content
+                    )
+                    return json.loads(response.content)
                 logging.error(
                     "Error %s from NoveList: %r", response.status_code,
                     response.content
                 )
-
-        return content
+                if response.status_code < 500:
+                    # Sending the same data again won't help.
+                    logging.error("Data sent was: %r", data)
+                    return None
+
+            if attempt < self.MAX_UPLOAD_ATTEMPTS:
+                time.sleep(self.UPLOAD_RETRY_DELAY * attempt)
+        return None
+
+    def upload_checkpoint(self, library):
+        """Find the Timestamp that records how far a previous upload
+        for this library got.
+        """
+        checkpoint, is_new = get_one_or_create(
+            self._db, Timestamp,
+            service=self.UPLOAD_CHECKPOINT % library.id,
+            service_type=Timestamp.SCRIPT_TYPE, collection=None
+        )
+        return checkpoint
 
     def make_novelist_data_object(self, items):
         return {
@@ -615,10 +878,132 @@ class NoveListAPI(object):
         return response
 
 
+class NoveListRecommendationCache(object):
+    """NoveList recommendations for a library's books, resolved to
+    Identifiers in the database and stored for a while.
+
+    Finding recommendations for a book can take several requests to
+    NoveList, which is too slow to do while a patron waits for a
+    feed. NoveListRecommendationsScript looks them up ahead of time
+    for every book in the library, and feeds use whatever has been
+    stored.
+    """
+
+    # Entries are stored as Representations with URLs like this
+    # one. Nothing is ever requested from these URLs.
+    URL = u"novelist-recommendations:%(library_id)s/%(identifier_id)s"
+
+    MEDIA_TYPE = u"application/json"
+
+    # Recommendations are looked up again once they're this many
+    # seconds old.
+    MAX_AGE = NoveListAPI.MAX_REPRESENTATION_AGE
+
+    def __init__(self, library):
+        self._db = Session.object_session(library)
+        self.library = library
+
+    def url(self, identifier_id=""):
+        return self.URL % dict(
+            library_id=self.library.id, identifier_id=identifier_id
+        )
+
+    def entry(self, identifier):
+        """Find the cache entry for an Identifier.
+
+        :return: A Representation, or None if nothing has been stored
+            for the Identifier.
+        """
+        return get_one(
+            self._db, Representation, url=self.url(identifier.id),
+            media_type=self.MEDIA_TYPE
+        )
+
+    def get(self, identifier):
+        """Find the stored recommendations for an Identifier.
+
+        This never changes the database, so it's safe to call while
+        serving a feed.
+
+        :return: A list of Identifiers, or None if the recommendations
+            haven't been looked up recently enough.
+        """
+        entry = self.entry(identifier)
+        if not entry or not entry.fetched_at or entry.content is None:
+            return None
+        if not entry.is_fresher_than(self.MAX_AGE):
+            return None
+
+        identifier_ids = json.loads(entry.content)
+        if not identifier_ids:
+            return []
+        return self._db.query(Identifier).filter(
+            Identifier.id.in_(identifier_ids)
+        ).all()
+
+    def store(self, identifier, recommendations):
+        """Store the recommendations for an Identifier.
+
+        :param recommendations: A list of Identifiers.
+        """
+        entry, is_new = get_one_or_create(
+            self._db, Representation, url=self.url(identifier.id),
+            media_type=self.MEDIA_TYPE
+        )
+        entry.content = json.dumps([i.id for i in recommendations])
+        entry.fetched_at = datetime.datetime.utcnow()
+        return recommendations
+
+    def resolve(self, api, identifier):
+        """Ask NoveList for an Identifier's recommendations and store
+        the ones that are in the database.
+
+        :return: A list of Identifiers.
+        """
+        recommendations = []
+        metadata = api.lookup(identifier)
+        if metadata:
+            metadata.filter_recommendations(self._db)
+            recommendations = metadata.recommendations
+        return self.store(identifier, recommendations)
+
+    def pending(self):
+        """Find the Identifiers of the library's books whose
+        recommendations haven't been looked up recently enough.
+        """
+        collection_ids = [c.id for c in self.library.collections]
+        if not collection_ids:
+            return []
+
+        # Each Identifier is matched with its own entry, so the
+        # lookup can use the index on Representation.url.
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=self.MAX_AGE
+        )
+        fresh_entry = and_(
+            Representation.url == func.concat(self.url(), Identifier.id),
+            Representation.media_type == self.MEDIA_TYPE,
+            Representation.fetched_at > cutoff,
+        )
+        return self._db.query(Identifier).join(
+            Edition, Edition.primary_identifier_id == Identifier.id
+        ).join(
+            Work, Work.presentation_edition_id == Edition.id
+        ).join(
+            LicensePool, LicensePool.work_id == Work.id
+        ).filter(
+            LicensePool.collection_id.in_(collection_ids)
+        ).outerjoin(
+            Representation, fresh_entry
+        ).filter(
+            Representation.id == None
+        ).distinct().order_by(Identifier.id).all()
+
+
 class MockNoveListAPI(NoveListAPI):
 
-    def __init__(self, _db, *args, **kwargs):
-        self._db = _db
+    def __init__(self, _db, profile=None, password=None, **kwargs):
+        super(MockNoveListAPI, self).__init__(_db, profile, password, **kwargs)
         self.responses = []
 
     def setup(self, *args):
@@ -629,6 +1014,9 @@ class MockNoveListAPI(NoveListAPI):
         self.responses = self.responses[1:]
         return response
 
+    def lookup_batch(self, identifiers):
+        return [self.lookup(identifier) for identifier in identifiers]
+
 
 class NoveListCoverageProvider(IdentifierCoverageProvider):
 
@@ -637,8 +1025,46 @@ class NoveListCoverageProvider(IdentifierCoverageProvider):
     DEFAULT_BATCH_SIZE = 25
     INPUT_IDENTIFIER_TYPES = [Identifier.ISBN]
 
+    def process_batch(self, identifiers):
+        """Look up a whole batch of identifiers with NoveList at once,
+        then apply each result.
+
+        If the batch lookup fails, each identifier is looked up on its
+        own, so one problem doesn't cost the whole batch its coverage.
+        """
+        try:
+            batch = self.api.lookup_batch(identifiers)
+        except Exception, e:
+            self.log.error(
+                "Error looking up a batch of %d identifiers; trying them one at a time.",
+                len(identifiers), exc_info=e
+            )
+            batch = None
+
+        results = []
+        for index, identifier in enumerate(identifiers):
+            try:
+                if batch is None:
+                    metadata = self.api.lookup(identifier)
+                else:
+                    metadata = batch[index]
+                result = self.apply_metadata(identifier, metadata)
+            except Exception, e:
+                self.log.error(
+                    "Error looking up %r", identifier, exc_info=e
+                )
+                result = self.failure(identifier, repr(e), transient=True)
+            if not isinstance(result, CoverageFailure):
+                self.handle_success(identifier)
+            results.append(result)
+        return results
+
     def process_item(self, identifier):
         metadata = self.api.lookup(identifier)
+        return self.apply_metadata(identifier, metadata)
+
+    def apply_metadata(self, identifier, metadata):
+        """Apply NoveList's Metadata for an identifier."""
         if not metadata:
             # Either NoveList didn't recognize the identifier or
             # no interesting data came of this. Consider it covered.
@@ -656,6 +1082,9 @@ class NoveListCoverageProvider(IdentifierCoverageProvider):
         metadata.apply(edition, collection=None)
 
         if edition.series or edition.series_position:
+            # The API may hand out this Metadata object again, so
+            # change a copy of it.
+            metadata = copy.copy(metadata)
             metadata.primary_identifier = identifier
             # Series data from NoveList is appealing, but we need to avoid
             # creating any potentially-inaccurate ISBN equivalencies on the
@@ -14,6 +14,7 @@ from circulation import (
     HoldInfo,
     FulfillmentInfo,
     BaseCirculationAPI,
+    PatronActivityDeadline,
 )
 
 from core.model import (
@@ -510,7 +511,7 @@ class OdiloAPI(BaseCirculationAPI, HasSelfTests):
         url = self._make_absolute_url(url)
         response = HTTP.request_with_timeout(
             method, url, headers=headers, data=data,
-            timeout=60
+            **PatronActivityDeadline.apply(dict(timeout=60))
         )
         if response.status_code == 401:
             if exception_on_401:
@@ -865,6 +866,7 @@ class OdiloAPI(BaseCirculationAPI, HasSelfTests):
         if 'allow_redirects' not in kwargs:
             kwargs['allow_redirects'] = True
 
+        PatronActivityDeadline.apply(kwargs)
         response = HTTP.get_with_timeout(url, headers=headers, **kwargs)
         return response.status_code, response.headers, response.content
 
@@ -874,6 +876,7 @@ class OdiloAPI(BaseCirculationAPI, HasSelfTests):
         if 'timeout' not in kwargs:
             kwargs['timeout'] = 60
 
+        PatronActivityDeadline.apply(kwargs)
         return HTTP.post_with_timeout(url, payload, headers=headers, **kwargs)
 
 
@@ -13,6 +13,7 @@ import feedparser
 from lxml import etree
 from StringIO import StringIO
 
+from sqlalchemy.orm import joinedload
 from sqlalchemy.sql.expression import or_
 
 from core.opds_import import (
@@ -51,6 +52,7 @@ from circulation import (
     LoanInfo,
     FulfillmentInfo,
     HoldInfo,
+    PatronActivityDeadline,
 )
 from core.analytics import Analytics
 from core.util.http import (
@@ -176,6 +178,10 @@ class ODLWithConsolidatedCopiesAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
         EXPIRED_STATUS,
     ]
 
+    # The number of license pools whose holds queues are recalculated
+    # together by update_hold_queues.
+    HOLD_QUEUE_BATCH_SIZE = 500
+
     def __init__(self, _db, collection):
         if collection.protocol != self.NAME:
             raise ValueError(
@@ -487,68 +493,75 @@ class ODLWithConsolidatedCopiesAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
             return
 
         # If the patron is in the queue, we need to estimate when the book
-        # will be available for check out. We can do slightly better than the
-        # default calculation since we know when all current loans will expire,
-        # but we're still calculating the worst case.
+        # will be available for check out.
         elif hold.position > 0:
             # Find the current loans and reserved holds for the licenses.
-            current_loans = _db.query(Loan).filter(
-                Loan.license_pool_id==pool.id
-            ).filter(
-                or_(
-                    Loan.end==None,
-                    Loan.end>datetime.datetime.utcnow()
-                )
-            ).order_by(Loan.start).all()
-            current_holds = _db.query(Hold).filter(
-                Hold.license_pool_id==pool.id
-            ).filter(
-                or_(
-                    Hold.end==None,
-                    Hold.end>datetime.datetime.utcnow(),
-                    Hold.position>0,
-                )
-            ).order_by(Hold.start).all()
+            now = datetime.datetime.utcnow()
+            current_loans = self._current_loans(_db, [pool.id], now).all()
+            current_holds = self._current_holds(_db, [pool.id], now).all()
             licenses_reserved = min(pool.licenses_owned - len(current_loans), len(current_holds))
             current_reservations = current_holds[:licenses_reserved]
 
-            # The licenses will have to go through some number of cycles
-            # before one of them gets to this hold. This leavs out the first cycle -
-            # it's already started so we'll handle it separately.
-            cycles = (hold.position - licenses_reserved - 1) / pool.licenses_owned
-
-            # Each of the owned licenses is currently either on loan or reserved.
-            # Figure out which license this hold will eventually get if every
-            # patron keeps their loans and holds for the maximum time.
-            copy_index = (hold.position - licenses_reserved - 1)  % pool.licenses_owned
-
-            # In the worse case, the first cycle ends when a current loan expires, or
-            # after a current reservation is checked out and then expires.
-            if len(current_loans) > copy_index:
-                next_cycle_start = current_loans[copy_index].end
-            else:
-                reservation = current_reservations[copy_index - len(current_loans)]
-                next_cycle_start = reservation.end + datetime.timedelta(days=default_loan_period)
-
-            # Assume all cycles after the first cycle take the maximum time.
-            cycle_period = default_loan_period + default_reservation_period
-            hold.end = next_cycle_start + datetime.timedelta(days=(cycle_period * cycles))
+            end = self._estimate_hold_end(
+                hold.position, pool.licenses_owned, current_loans,
+                current_reservations, default_loan_period,
+                default_reservation_period
+            )
+            if end is not None:
+                hold.end = end
 
         # If the end date isn't set yet or the position just became 0, the
         # hold just became available. The patron's reservation period starts now.
         else:
             hold.end = datetime.datetime.utcnow() + datetime.timedelta(days=default_reservation_period)
 
+    def _estimate_hold_end(self, position, licenses_owned, current_loans,
+                           current_reservations, default_loan_period,
+                           default_reservation_period):
+        """Estimate when a hold in the queue will become available.
+
+        We can do slightly better than the default calculation since we
+        know when all current loans will expire, but we're still
+        calculating the worst case.
+
+        :param position: The hold's position in the queue. Must be
+            greater than 0.
+        :param current_loans: The pool's current loans, ordered by start date.
+        :param current_reservations: The pool's reserved holds, ordered
+            by start date.
+        :return: A datetime, or None if the pool has no licenses.
+        """
+        if licenses_owned < 1:
+            return None
+        licenses_reserved = len(current_reservations)
+
+        # The licenses will have to go through some number of cycles
+        # before one of them gets to this hold. This leavs out the first cycle -
+        # it's already started so we'll handle it separately.
+        cycles = (position - licenses_reserved - 1) / licenses_owned
+
+        # Each of the owned licenses is currently either on loan or reserved.
+        # Figure out which license this hold will eventually get if every
+        # patron keeps their loans and holds for the maximum time.
+        copy_index = (position - licenses_reserved - 1)  % licenses_owned
+
+        # In the worse case, the first cycle ends when a current loan expires, or
+        # after a current reservation is checked out and then expires.
+        if len(current_loans) > copy_index:
+            next_cycle_start = current_loans[copy_index].end
+        else:
+            reservation = current_reservations[copy_index - len(current_loans)]
+            next_cycle_start = reservation.end + datetime.timedelta(days=default_loan_period)
+
+        # Assume all cycles after the first cycle take the maximum time.
+        cycle_period = default_loan_period + default_reservation_period
+        return next_cycle_start + datetime.timedelta(days=(cycle_period * cycles))
+
     def _update_hold_position(self, hold):
         _db = Session.object_session(hold)
         pool = hold.license_pool
-        loans_count = _db.query(Loan).filter(
-            Loan.license_pool_id==pool.id,
-        ).filter(
-            or_(
-                Loan.end==None,
-                Loan.end > datetime.datetime.utcnow()
-            )
+        loans_count = self._current_loans(
+            _db, [pool.id], datetime.datetime.utcnow()
         ).count()
         holds_count = self._count_holds_before(hold)
 
@@ -562,31 +575,80 @@ class ODLWithConsolidatedCopiesAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
             # Add 1 since position 0 indicates the hold is ready.
             hold.position = holds_count + 1
 
-    def update_hold_queue(self, licensepool):
-        # Update the pool and the next holds in the queue when a license is reserved.
-        _db = Session.object_session(licensepool)
-
-        loans_count = _db.query(Loan).filter(
-            Loan.license_pool_id==licensepool.id
+    def _current_loans(self, _db, license_pool_ids, now):
+        """Find the loans on the given pools that haven't expired, in
+        the order they started."""
+        return _db.query(Loan).filter(
+            Loan.license_pool_id.in_(license_pool_ids)
         ).filter(
             or_(
                 Loan.end==None,
-                Loan.end>datetime.datetime.utcnow()
+                Loan.end>now
             )
-        ).count()
-        remaining_licenses = licensepool.licenses_owned - loans_count
+        ).order_by(Loan.start)
 
-        holds = _db.query(Hold).filter(
-            Hold.license_pool_id==licensepool.id
+    def _current_holds(self, _db, license_pool_ids, now):
+        """Find the holds on the given pools that are still in the queue
+        or reserved, in the order they were placed.
+
+        Each hold's patron and integration client are loaded along with
+        it, since they're needed to find the hold's loan period.
+        """
+        return _db.query(Hold).options(
+            joinedload(Hold.patron), joinedload(Hold.integration_client)
+        ).filter(
+            Hold.license_pool_id.in_(license_pool_ids)
         ).filter(
             or_(
                 Hold.end==None,
-                Hold.end>datetime.datetime.utcnow(),
+                Hold.end>now,
                 Hold.position>0,
             )
-        ).order_by(
-            Hold.start
-        ).all()
+        ).order_by(Hold.start)
+
+    def update_hold_queue(self, licensepool):
+        # Update the pool and the next holds in the queue when a license is reserved.
+        self.update_hold_queues([licensepool])
+
+    def update_hold_queues(self, licensepools):
+        """Recalculate the holds queues for a number of license pools.
+
+        The current loans and holds for a batch of pools are loaded with
+        one query each. Then each pool's availability, and the position
+        and end date of every hold in its queue, are worked out in a
+        single pass over its holds. The changes are flushed together
+        with the rest of the session.
+        """
+        licensepools = list(licensepools)
+        if not licensepools:
+            return
+        _db = Session.object_session(licensepools[0])
+        collection = self.collection(_db)
+        for i in range(0, len(licensepools), self.HOLD_QUEUE_BATCH_SIZE):
+            batch = licensepools[i:i+self.HOLD_QUEUE_BATCH_SIZE]
+            pool_ids = [pool.id for pool in batch]
+            now = datetime.datetime.utcnow()
+
+            loans_by_pool = defaultdict(list)
+            for loan in self._current_loans(_db, pool_ids, now):
+                loans_by_pool[loan.license_pool_id].append(loan)
+            holds_by_pool = defaultdict(list)
+            for hold in self._current_holds(_db, pool_ids, now):
+                holds_by_pool[hold.license_pool_id].append(hold)
+
+            for pool in batch:
+                self._update_hold_queue(
+                    collection, pool, loans_by_pool[pool.id],
+                    holds_by_pool[pool.id], now
+                )
+
+    def _update_hold_queue(self, collection, licensepool, loans, holds, now):
+        """Update a pool's availability and the holds in its queue.
+
+        :param loans: The pool's current loans, ordered by start date.
+        :param holds: The pool's current holds, ordered by start date.
+        """
+        remaining_licenses = licensepool.licenses_owned - len(loans)
 
         if len(holds) > remaining_licenses:
             new_licenses_available = 0
@@ -602,13 +664,50 @@ class ODLWithConsolidatedCopiesAPI(BaseCirculationAPI, BaseSharedCollectionAPI):
             new_licenses_reserved,
             new_patrons_in_hold_queue,
             analytics=self.analytics,
-            as_of=datetime.datetime.utcnow(),
+            as_of=now,
         )
 
-        for hold in holds[:licensepool.licenses_reserved]:
-            if hold.position != 0:
-                # This hold just got a reserved license.
-                self._update_hold_end_date(hold)
+        default_reservation_period = collection.default_reservation_period
+        default_loan_periods = {}
+        current_reservations = holds[:max(new_licenses_reserved, 0)]
+
+        # The holds are in the order they were placed, so a hold's
+        # position is one more than the number of holds before it.
+        # Holds placed at the same moment share a position.
+        holds_before = 0
+        for i, hold in enumerate(holds):
+            if i == 0 or hold.start != holds[i-1].start:
+                holds_before = i
+
+            original_position = hold.position
+            if remaining_licenses > holds_before:
+                # The hold is ready to check out.
+                hold.position = 0
+            else:
+                # Add 1 since position 0 indicates the hold is ready.
+                hold.position = holds_before + 1
+
+            if hold.position == 0 and original_position == 0 and hold.end:
+                # The hold was already reserved and its reservation
+                # period has already started.
+                continue
+            elif hold.position > 0:
+                # Reserved holds come first, so their end dates are
+                # already up to date.
+                borrower = hold.library or hold.integration_client
+                if borrower not in default_loan_periods:
+                    default_loan_periods[borrower] = collection.default_loan_period(borrower)
+                end = self._estimate_hold_end(
+                    hold.position, licensepool.licenses_owned, loans,
+                    current_reservations, default_loan_periods[borrower],
+                    default_reservation_period
+                )
+                if end is not None:
+                    hold.end = end
+            else:
+                # The hold just became available. The patron's
+                # reservation period starts now.
+                hold.end = now + datetime.timedelta(days=default_reservation_period)
 
     def place_hold(self, patron, pin, licensepool, notification_email_address):
         """Create a new hold."""
@@ -926,8 +1025,7 @@ class ODLHoldReaper(CollectionMonitor):
             changed_pools.add(hold.license_pool)
             self._db.delete(hold)
 
-        for pool in changed_pools:
-            self.api.update_hold_queue(pool)
+        self.api.update_hold_queues(changed_pools)
 
 
 class MockODLWithConsolidatedCopiesAPI(ODLWithConsolidatedCopiesAPI):
@@ -1042,7 +1140,11 @@ class SharedODLAPI(BaseCirculationAPI):
         auth_header = 'Bearer ' + base64.b64encode(shared_secret)
         headers['Authorization'] = auth_header
 
-        return do_get(url, headers=headers, allowed_response_codes=allowed_response_codes)
+        return do_get(
+            url, headers=headers,
+            allowed_response_codes=allowed_response_codes,
+            **PatronActivityDeadline.apply({})
+        )
 
     def checkout(self, patron, pin, licensepool, internal_format):
         _db = Session.object_session(patron)
@@ -159,100 +159,130 @@ class ONIXExtractor(object):
 
     @classmethod
     def parse(cls, file, data_source_name):
-        metadata_records = []
+        """Parse an ONIX file into a list of Metadata objects.
 
+        This keeps every record in memory; use `iterparse` for large files.
+        """
+        return list(cls.iterparse(file, data_source_name))
+
+    @classmethod
+    def iterparse(cls, file, data_source_name):
+        """Parse an ONIX file, yielding a Metadata object for each
+        <product>.
+
+        The file is read incrementally, and each <product> is discarded
+        once it's been processed, so memory use doesn't depend on the
+        size of the file.
+        """
         # TODO: ONIX has plain language 'reference names' and short tags that
         # may be used interchangably. This code currently only handles short tags,
         # and it's not comprehensive.
 
         parser = XMLParser()
-        tree = etree.parse(file)
-        root = tree.getroot()
+        for event, record in etree.iterparse(
+            file, events=('end',), tag='product'
+        ):
+            parent = record.getparent()
+            if parent is None or parent.getparent() is not None:
+                # This isn't a top-level <product>. It'll be handled
+                # (or ignored) along with whatever contains it.
+                continue
 
-        for record in root.findall('product'):
-            title = parser.text_of_optional_subtag(record, 'descriptivedetail/titledetail/titleelement/b203')
-            if not title:
-                title_prefix = parser.text_of_optional_subtag(record, 'descriptivedetail/titledetail/titleelement/b030')
-                title_without_prefix = parser.text_of_optional_subtag(record, 'descriptivedetail/titledetail/titleelement/b031')
-                if title_prefix and title_without_prefix:
-                    title = title_prefix + " " + title_without_prefix
+            yield cls._metadata_from_product(
+                parser, record, data_source_name
+            )
+
+            # Get rid of this <product>, and anything that came before
+            # it, now that we're done with it.
+            record.clear()
+            while record.getprevious() is not None:
+                del parent[0]
+
+    @classmethod
+    def _metadata_from_product(cls, parser, record, data_source_name):
+        """Turn a single <product> tag into a Metadata object."""
+        title = parser.text_of_optional_subtag(record, 'descriptivedetail/titledetail/titleelement/b203')
+        if not title:
+            title_prefix = parser.text_of_optional_subtag(record, 'descriptivedetail/titledetail/titleelement/b030')
+            title_without_prefix = parser.text_of_optional_subtag(record, 'descriptivedetail/titledetail/titleelement/b031')
+            if title_prefix and title_without_prefix:
+                title = title_prefix + " " + title_without_prefix
 
-            subtitle = parser.text_of_optional_subtag(record, 'descriptivedetail/titledetail/titleelement/b029')
-            language = parser.text_of_optional_subtag(record, 'descriptivedetail/language/b252') or "eng"
-            publisher = parser.text_of_optional_subtag(record, 'publishingdetail/publisher/b081')
-            imprint = parser.text_of_optional_subtag(record, 'publishingdetail/imprint/b079')
-            if imprint == publisher:
-                imprint = None
+        subtitle = parser.text_of_optional_subtag(record, 'descriptivedetail/titledetail/titleelement/b029')
+        language = parser.text_of_optional_subtag(record, 'descriptivedetail/language/b252') or "eng"
+        publisher = parser.text_of_optional_subtag(record, 'publishingdetail/publisher/b081')
+        imprint = parser.text_of_optional_subtag(record, 'publishingdetail/imprint/b079')
+        if imprint == publisher:
+            imprint = None
 
-            publishing_date = parser.text_of_optional_subtag(record, 'publishingdetail/publishingdate/b306')
-            issued = None
-            if publishing_date:
-                issued = datetime.datetime.strptime(publishing_date, "%Y%m%d")
+        publishing_date = parser.text_of_optional_subtag(record, 'publishingdetail/publishingdate/b306')
+        issued = None
+        if publishing_date:
+            issued = datetime.datetime.strptime(publishing_date, "%Y%m%d")
 
-            identifier_tags = parser._xpath(record, 'productidentifier')
-            identifiers = []
-            primary_identifier = None
-            for tag in identifier_tags:
-                type = parser.text_of_subtag(tag, "b221")
-                if type == '02' or type == '15':
-                    primary_identifier = IdentifierData(Identifier.ISBN, parser.text_of_subtag(tag, 'b244'))
-                    identifiers.append(primary_identifier)
+        identifier_tags = parser._xpath(record, 'productidentifier')
+        identifiers = []
+        primary_identifier = None
+        for tag in identifier_tags:
+            type = parser.text_of_subtag(tag, "b221")
+            if type == '02' or type == '15':
+                primary_identifier = IdentifierData(Identifier.ISBN, parser.text_of_subtag(tag, 'b244'))
+                identifiers.append(primary_identifier)
 
-            subject_tags = parser._xpath(record, 'descriptivedetail/subject')
-            subjects = []
-            for tag in subject_tags:
-                type = parser.text_of_subtag(tag, 'b067')
-                if type in cls.SUBJECT_TYPES:
-                    subjects.append(SubjectData(cls.SUBJECT_TYPES[type],
-                                                parser.text_of_subtag(tag, 'b069')))
+        subject_tags = parser._xpath(record, 'descriptivedetail/subject')
+        subjects = []
+        for tag in subject_tags:
+            type = parser.text_of_subtag(tag, 'b067')
+            if type in cls.SUBJECT_TYPES:
+                subjects.append(SubjectData(cls.SUBJECT_TYPES[type],
+                                            parser.text_of_subtag(tag, 'b069')))
 
-            audience_tags = parser._xpath(record, 'descriptivedetail/audience/b204')
-            audiences = []
-            for tag in audience_tags:
-                if tag.text in cls.AUDIENCE_TYPES:
-                    subjects.append(SubjectData(Subject.FREEFORM_AUDIENCE,
-                                                cls.AUDIENCE_TYPES[tag.text]))
+        audience_tags = parser._xpath(record, 'descriptivedetail/audience/b204')
+        audiences = []
+        for tag in audience_tags:
+            if tag.text in cls.AUDIENCE_TYPES:
+                subjects.append(SubjectData(Subject.FREEFORM_AUDIENCE,
+                                            cls.AUDIENCE_TYPES[tag.text]))
 
-            contributor_tags = parser._xpath(record, 'descriptivedetail/contributor')
-            contributors = []
-            for tag in contributor_tags:
-                type = parser.text_of_subtag(tag, 'b035')
-                if type in cls.CONTRIBUTOR_TYPES:
-                    display_name = parser.text_of_subtag(tag, 'b036')
-                    sort_name = parser.text_of_optional_subtag(tag, 'b037')
-                    family_name = parser.text_of_optional_subtag(tag, 'b040')
-                    bio = parser.text_of_optional_subtag(tag, 'b044')
-                    contributors.append(ContributorData(sort_name=sort_name,
-                                                        display_name=display_name,
-                                                        family_name=family_name,
-                                                        roles=[cls.CONTRIBUTOR_TYPES[type]],
-                                                        biography=bio))
+        contributor_tags = parser._xpath(record, 'descriptivedetail/contributor')
+        contributors = []
+        for tag in contributor_tags:
+            type = parser.text_of_subtag(tag, 'b035')
+            if type in cls.CONTRIBUTOR_TYPES:
+                display_name = parser.text_of_subtag(tag, 'b036')
+                sort_name = parser.text_of_optional_subtag(tag, 'b037')
+                family_name = parser.text_of_optional_subtag(tag, 'b040')
+                bio = parser.text_of_optional_subtag(tag, 'b044')
+                contributors.append(ContributorData(sort_name=sort_name,
+                                                    display_name=display_name,
+                                                    family_name=family_name,
+                                                    roles=[cls.CONTRIBUTOR_TYPES[type]],
+                                                    biography=bio))
 
-            collateral_tags = parser._xpath(record, 'collateraldetail/textcontent')
-            links = []
-            for tag in collateral_tags:
-                type = parser.text_of_subtag(tag, 'x426')
-                # TODO: '03' is the summary in the example I'm testing, but that
-                # might not be generally true.
-                if type == '03':
-                    text = parser.text_of_subtag(tag, 'd104')
-                    links.append(LinkData(rel=Hyperlink.DESCRIPTION,
-                                          media_type=Representation.TEXT_HTML_MEDIA_TYPE,
-                                          content=text))
+        collateral_tags = parser._xpath(record, 'collateraldetail/textcontent')
+        links = []
+        for tag in collateral_tags:
+            type = parser.text_of_subtag(tag, 'x426')
+            # TODO: '03' is the summary in the example I'm testing, but that
+            # might not be generally true.
+            if type == '03':
+                text = parser.text_of_subtag(tag, 'd104')
+                links.append(LinkData(rel=Hyperlink.DESCRIPTION,
+                                      media_type=Representation.TEXT_HTML_MEDIA_TYPE,
+                                      content=text))
 
-            metadata_records.append(Metadata(
-                data_source=data_source_name,
-                title=title,
-                subtitle=subtitle,
-                language=language,
-                medium=Edition.BOOK_MEDIUM,
-                publisher=publisher,
-                imprint=imprint,
-                issued=issued,
-                primary_identifier=primary_identifier,
-                identifiers=identifiers,
-                subjects=subjects,
-                contributors=contributors,
-                links=links
-            ))
-        return metadata_records
+        return Metadata(
+            data_source=data_source_name,
+            title=title,
+            subtitle=subtitle,
+            language=language,
+            medium=Edition.BOOK_MEDIUM,
+            publisher=publisher,
+            imprint=imprint,
+            issued=issued,
+            primary_identifier=primary_identifier,
+            identifiers=identifiers,
+            subjects=subjects,
+            contributors=contributors,
+            links=links
+        )
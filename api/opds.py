@@ -2,7 +2,6 @@ import urllib
 import copy
 import logging
 from nose.tools import set_trace
-from flask import url_for
 from lxml import etree
 from collections import defaultdict
 import uuid
@@ -47,9 +46,9 @@ from api.lanes import (
     CrawlableCustomListBasedLane,
     CrawlableCollectionBasedLane,
 )
-from core.app_server import cdn_url_for
 
 from adobe_vendor_id import AuthdataUtility
+from util.url import URLTemplateCache
 from annotations import AnnotationWriter
 from circulation import BaseCirculationAPI
 from config import Configuration
@@ -58,6 +57,10 @@ from core.analytics import Analytics
 
 class CirculationManagerAnnotator(Annotator):
 
+    # Shared by every annotator in this process, so that each kind of
+    # URL only needs to go through Flask's URL routing once.
+    url_templates = URLTemplateCache()
+
     def __init__(self, lane,
                  active_loans_by_work={}, active_holds_by_work={},
                  active_fulfillments_by_work={}, hidden_content_types=[],
@@ -96,13 +99,15 @@ class CirculationManagerAnnotator(Annotator):
                     new_kwargs[k] = v
             return self.test_url_for(False, *args, **new_kwargs)
         else:
-            return url_for(*args, **kwargs)
+            return self.url_templates.url_for(*args, **kwargs)
 
     def cdn_url_for(self, *args, **kwargs):
         if self.test_mode:
             return self.test_url_for(True, *args, **kwargs)
         else:
-            return cdn_url_for(*args, **kwargs)
+            # This is what core.app_server.cdn_url_for does, but
+            # using the URL template cache.
+            return cdnify(self.url_templates.url_for(*args, **kwargs))
 
     def test_url_for(self, cdn=False, *args, **kwargs):
         # Generate a plausible-looking URL that doesn't depend on Flask
@@ -465,6 +470,15 @@ class LibraryAnnotator(CirculationManagerAnnotator):
         self.identifies_patrons = library_identifies_patrons
         self.facets = facets or None
 
+        # These facts about the library are the same for every entry
+        # in the feed, so look them up once.
+        self.novelist_configured = bool(
+            library and NoveListAPI.is_configured(library)
+        )
+        self.analytics_configured = bool(
+            library and Analytics.is_configured(library)
+        )
+
     @classmethod
     def _hidden_content_types(self, library):
         """Find all content types which this library should not be
@@ -619,7 +633,7 @@ class LibraryAnnotator(CirculationManagerAnnotator):
         if work.series:
             self.add_series_link(work, feed, entry)
 
-        if NoveListAPI.is_configured(self.library):
+        if self.novelist_configured:
             # If NoveList Select is configured, there might be
             # recommendations, too.
             feed.add_link_to_entry(
@@ -637,7 +651,7 @@ class LibraryAnnotator(CirculationManagerAnnotator):
             )
 
         # Add a link for related books if available.
-        if self.related_books_available(work, self.library):
+        if self._related_books_available(work):
             feed.add_link_to_entry(
                 entry,
                 rel='related',
@@ -667,7 +681,7 @@ class LibraryAnnotator(CirculationManagerAnnotator):
                 )
             )
 
-        if Analytics.is_configured(self.library):
+        if self.analytics_configured:
             feed.add_link_to_entry(
                 entry,
                 rel="http://librarysimplified.org/terms/rel/analytics/open-book",
@@ -692,6 +706,13 @@ class LibraryAnnotator(CirculationManagerAnnotator):
                 or work.series
                 or NoveListAPI.is_configured(library))
 
+    def _related_books_available(self, work):
+        """Like related_books_available, but using what we already
+        know about this annotator's library.
+        """
+        contributions = work.sort_author and work.sort_author != Edition.UNKNOWN_AUTHOR
+        return bool(contributions or work.series or self.novelist_configured)
+
     def language_and_audience_key_from_work(self, work):
         language_key = work.language
 
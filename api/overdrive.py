@@ -1,9 +1,14 @@
 from nose.tools import set_trace
+import argparse
 import datetime
+import itertools
 import json
+import time
 import requests
 import flask
 import urlparse
+from collections import deque
+from multiprocessing.pool import ThreadPool
 from flask_babel import lazy_gettext as _
 
 from sqlalchemy.orm import contains_eager
@@ -14,6 +19,7 @@ from circulation import (
     HoldInfo,
     FulfillmentInfo,
     BaseCirculationAPI,
+    PatronActivityDeadline,
 )
 from selftest import (
     HasSelfTests,
@@ -174,7 +180,8 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
             else:
                 method = 'get'
         response = HTTP.request_with_timeout(
-            method, url, headers=headers, data=data
+            method, url, headers=headers, data=data,
+            **PatronActivityDeadline.apply({})
         )
         if response.status_code == 401:
             if exception_on_401:
@@ -804,7 +811,7 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
             return True
         raise CannotReleaseHold(response.content)
 
-    def circulation_lookup(self, book):
+    def circulation_lookup(self, book, exception_on_401=False):
         if isinstance(book, basestring):
             book_id = book
             circulation_link = self.AVAILABILITY_ENDPOINT % dict(
@@ -815,7 +822,9 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
         else:
             book_id = book['id']
             circulation_link = book['availability_link']
-        return book, self.get(circulation_link, {})
+        return book, self.get(
+            circulation_link, {}, exception_on_401=exception_on_401
+        )
 
     def update_formats(self, licensepool):
         """Update the format information for a single book.
@@ -836,7 +845,7 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
         replace = ReplacementPolicy.from_license_source(self._db)
         metadata.apply(edition, self.collection, replace=replace)
 
-    def update_licensepool(self, book_id):
+    def update_licensepool(self, book_id, lookup=None):
         """Update availability information for a single book.
 
         If the book has never been seen before, a new LicensePool
@@ -846,12 +855,16 @@ class OverdriveAPI(BaseOverdriveAPI, BaseCirculationAPI, HasSelfTests):
         circulation information. Bibliographic coverage will be
         ensured for the Overdrive Identifier, and a Work will be
         created for the LicensePool and set as presentation-ready.
+
+        :param lookup: The result of calling circulation_lookup() on
+            `book_id`, if it has already been called. Otherwise
+            circulation_lookup() will be called now.
         """
         # Retrieve current circulation information about this book
         try:
-            book, (status_code, headers, content) = self.circulation_lookup(
-                book_id
-            )
+            if lookup is None:
+                lookup = self.circulation_lookup(book_id)
+            book, (status_code, headers, content) = lookup
         except Exception, e:
             status_code = None
             self.log.error(
@@ -1021,58 +1034,174 @@ class OverdriveCirculationMonitor(CollectionMonitor):
     # that haven't changed, you're probably done.
     MAXIMUM_CONSECUTIVE_UNCHANGED_BOOKS = None
 
-    def __init__(self, _db, collection, api_class=OverdriveAPI):
-        """Constructor."""
+    # Look up availability information for this many books at once.
+    DEFAULT_CONCURRENCY = 5
+
+    # Commit the database session after updating this many books.
+    DEFAULT_BATCH_SIZE = 100
+
+    def __init__(self, _db, collection, api_class=OverdriveAPI,
+                 concurrency=None, batch_size=None):
+        """Constructor.
+
+        :param concurrency: Look up availability information for this
+            many books at once.
+        :param batch_size: Commit the database session after updating
+            this many books.
+        """
         super(OverdriveCirculationMonitor, self).__init__(_db, collection)
         self.api = api_class(_db, collection)
         self.maximum_consecutive_unchanged_books = (
             self.MAXIMUM_CONSECUTIVE_UNCHANGED_BOOKS
         )
+        self.concurrency = max(concurrency or self.DEFAULT_CONCURRENCY, 1)
+        self.batch_size = max(batch_size or self.DEFAULT_BATCH_SIZE, 1)
         self.analytics = Analytics(_db)
 
+    @classmethod
+    def arg_parser(cls):
+        parser = argparse.ArgumentParser()
+        parser.add_argument(
+            '--concurrency', type=int, default=cls.DEFAULT_CONCURRENCY,
+            help="Look up availability information for this many books at once.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=cls.DEFAULT_BATCH_SIZE,
+            help="Commit the database session after updating this many books.",
+        )
+        return parser
+
+    @classmethod
+    def parse_command_line(cls, cmd_args=None):
+        """Turn command-line arguments into constructor arguments."""
+        return vars(cls.arg_parser().parse_args(cmd_args))
+
     def recently_changed_ids(self, start, cutoff):
         return self.api.recently_changed_ids(start, cutoff)
 
     def run_once(self, start, cutoff):
         _db = self._db
-        added_books = 0
-        overdrive_data_source = DataSource.lookup(
-            _db, DataSource.OVERDRIVE)
-
+        started_at = time.time()
         total_books = 0
+        uncommitted_books = 0
         consecutive_unchanged_books = 0
-        for i, book in enumerate(self.recently_changed_ids(start, cutoff)):
-            total_books += 1
-            if not total_books % 100:
-                self.log.info("%s books processed", total_books)
-            if not book:
-                continue
-            license_pool, is_new, is_changed = self.api.update_licensepool(book)
-            # Log a circulation event for this work.
-            if is_new:
-                for library in self.collection.libraries:
-                    self.analytics.collect_event(
-                        library, license_pool, CirculationEvent.DISTRIBUTOR_TITLE_ADD, license_pool.last_checked)
+        stats = dict(waiting=0, updating=0)
 
-            _db.commit()
+        books = self.recently_changed_ids(start, cutoff)
+        if self.concurrency > 1:
+            lookups = self.circulation_lookups_concurrently(books)
+        else:
+            lookups = ((book, None) for book in books)
 
-            if is_changed:
-                consecutive_unchanged_books = 0
-            else:
-                consecutive_unchanged_books += 1
-                if (self.maximum_consecutive_unchanged_books
-                    and consecutive_unchanged_books >=
-                    self.maximum_consecutive_unchanged_books):
-                    # We're supposed to stop this run after finding a
-                    # run of books that have not changed, and we have
-                    # in fact seen that many consecutive unchanged
-                    # books.
-                    self.log.info("Stopping at %d unchanged books.",
-                                  consecutive_unchanged_books)
+        try:
+            while True:
+                # Wait for Overdrive (or for the workers) to tell us
+                # about the next book.
+                a = time.time()
+                try:
+                    book, lookup = next(lookups)
+                except StopIteration:
                     break
+                b = time.time()
+                stats['waiting'] += b - a
+
+                total_books += 1
+                if not total_books % 100:
+                    self.log_throughput(total_books, started_at, stats)
+                if not book:
+                    continue
+
+                license_pool, is_new, is_changed = self.api.update_licensepool(
+                    book, lookup
+                )
+                # Log a circulation event for this work.
+                if is_new:
+                    for library in self.collection.libraries:
+                        self.analytics.collect_event(
+                            library, license_pool, CirculationEvent.DISTRIBUTOR_TITLE_ADD, license_pool.last_checked)
+
+                uncommitted_books += 1
+                if uncommitted_books >= self.batch_size:
+                    _db.commit()
+                    uncommitted_books = 0
+                stats['updating'] += time.time() - b
+
+                if is_changed:
+                    consecutive_unchanged_books = 0
+                else:
+                    consecutive_unchanged_books += 1
+                    if (self.maximum_consecutive_unchanged_books
+                        and consecutive_unchanged_books >=
+                        self.maximum_consecutive_unchanged_books):
+                        # We're supposed to stop this run after finding a
+                        # run of books that have not changed, and we have
+                        # in fact seen that many consecutive unchanged
+                        # books.
+                        self.log.info("Stopping at %d unchanged books.",
+                                      consecutive_unchanged_books)
+                        break
+        finally:
+            # Stop any workers that are looking ahead.
+            lookups.close()
+        _db.commit()
 
         if total_books:
             self.log.info("Processed %d books total.", total_books)
+            self.log_throughput(total_books, started_at, stats)
+
+    def circulation_lookups_concurrently(self, books):
+        """Look up availability information for several books at once.
+
+        Lookups are done by a pool of worker threads, but yielded in
+        the order the books were provided. Only a few books are looked
+        up ahead of the one being processed.
+
+        :yield: A 2-tuple (book, lookup) for each book. `lookup` is
+            the return value of circulation_lookup(), or None if the
+            lookup failed.
+        """
+        def lookup(book):
+            if not book:
+                return None
+            try:
+                # The database session can't be used from a worker
+                # thread, so if the access token has expired, don't
+                # try to refresh it here.
+                return self.api.circulation_lookup(book, exception_on_401=True)
+            except Exception, e:
+                # update_licensepool() will try again on the main
+                # thread, where the access token can be refreshed if
+                # necessary.
+                return None
+
+        # Looking up the collection token may use the database, so
+        # do it before starting the workers.
+        self.api.collection_token
+
+        pool = ThreadPool(self.concurrency)
+        pending = deque()
+        books = iter(books)
+        try:
+            for book in itertools.islice(books, self.concurrency * 2):
+                pending.append((book, pool.apply_async(lookup, (book,))))
+            while pending:
+                book, result = pending.popleft()
+                looked_up = result.get()
+                for next_book in itertools.islice(books, 1):
+                    pending.append(
+                        (next_book, pool.apply_async(lookup, (next_book,)))
+                    )
+                yield book, looked_up
+        finally:
+            pool.terminate()
+
+    def log_throughput(self, total_books, started_at, stats):
+        elapsed = max(time.time() - started_at, 0.001)
+        self.log.info(
+            "%d books processed (%.1f/sec): %.1fs waiting for the next book, %.1fs updating LicensePools.",
+            total_books, total_books / elapsed, stats['waiting'],
+            stats['updating']
+        )
 
 
 class FullOverdriveCollectionMonitor(OverdriveCirculationMonitor):
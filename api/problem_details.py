@@ -316,3 +316,10 @@ SHARED_SECRET_DECRYPTION_ERROR = pd(
     title=_("Decryption error"),
     detail=_("Failed to decrypt a shared secret retrieved from another computer.")
 )
+
+PROXIED_CONTENT_TOO_LARGE = pd(
+    "http://librarysimplified.org/terms/problem/proxied-content-too-large",
+    status_code=502,
+    title=_("Content too large"),
+    detail=_("The distributor's copy of this book is too large for this server to send you."),
+)
@@ -18,6 +18,7 @@ from circulation import (
     FulfillmentInfo,
     HoldInfo,
     LoanInfo,
+    PatronActivityDeadline,
 )
 from circulation_exceptions import *
 
@@ -110,7 +111,7 @@ class RBDigitalAPI(BaseCirculationAPI, HasSelfTests):
     }
 
     BASE_SETTINGS = [x for x in BaseCirculationAPI.SETTINGS
-                     if x['key'] != BaseCirculationAPI.DEFAULT_LOAN_PERIOD]
+                     if x['key'] != BaseCirculationAPI.DEFAULT_LOAN_DURATION_SETTING['key']]
 
     SETTINGS = [
         { "key": ExternalIntegration.PASSWORD, "label": _("Basic Token"), "required": True },
@@ -256,7 +257,7 @@ class RBDigitalAPI(BaseCirculationAPI, HasSelfTests):
         """Actually make an HTTP request."""
         return HTTP.request_with_timeout(
             method, url, headers=headers, data=data,
-            params=params, **kwargs
+            params=params, **PatronActivityDeadline.apply(kwargs)
         )
 
     def request(self, url, method='get', extra_headers={}, data=None,
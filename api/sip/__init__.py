@@ -5,7 +5,10 @@ from api.authenticator import (
     BasicAuthenticationProvider,
     PatronData,
 )
-from api.sip.client import SIPClient
+from api.sip.client import (
+    SIPClient,
+    SIPClientPool,
+)
 from core.util.http import RemoteIntegrationException
 from core.util import MoneyUtility
 from core.model import ExternalIntegration
@@ -117,25 +120,53 @@ class SIP2AuthenticationProvider(BasicAuthenticationProvider):
         self.ssl_cert = integration.setting(self.SSL_CERTIFICATE).value
         self.ssl_key = integration.setting(self.SSL_KEY).value
         self.client = client
+        self._ssl_context = None
 
-    def patron_information(self, username, password):
-        try:
-            if self.client:
-                sip = self.client
-            else:
-                sip = SIPClient(
-                    target_server=self.server, target_port=self.port,
-                    login_user_id=self.login_user_id, login_password=self.login_password,
-                    location_code=self.location_code, separator=self.field_separator,
-                    use_ssl=self.use_ssl, ssl_cert=self.ssl_cert, ssl_key=self.ssl_key
+        # Connections to the SIP server are kept open and logged in
+        # between requests. This provider is rebuilt whenever the site
+        # configuration changes, so unless it's been given a client
+        # for testing, it uses a pool that's shared by every provider
+        # for this integration.
+        if client:
+            self.pool = SIPClientPool(self.make_client)
+        else:
+            settings = (
+                self.server, self.port, self.login_user_id,
+                self.login_password, self.location_code,
+                self.field_separator, self.use_ssl, self.ssl_cert,
+                self.ssl_key
+            )
+            self.pool = SIPClientPool.shared(
+                integration.id, settings, self.make_client
+            )
+
+    def make_client(self):
+        """Create a SIPClient for the connection pool."""
+        if self.client:
+            return self.client
+        if self.use_ssl or self.ssl_cert or self.ssl_key:
+            # Every connection uses the same SSLContext, so the
+            # certificate and key only need to be loaded once.
+            if self._ssl_context is None:
+                self._ssl_context = SIPClient.make_ssl_context(
+                    self.ssl_cert, self.ssl_key
                 )
-            sip.connect()
-            sip.login()
+        return SIPClient(
+            target_server=self.server, target_port=self.port,
+            login_user_id=self.login_user_id, login_password=self.login_password,
+            location_code=self.location_code, separator=self.field_separator,
+            use_ssl=self.use_ssl, ssl_cert=self.ssl_cert, ssl_key=self.ssl_key,
+            ssl_context=self._ssl_context
+        )
+
+    def patron_information(self, username, password):
+        def request(sip):
             info = sip.patron_information(username, password)
             sip.end_session(username, password)
-            sip.disconnect()
             return info
 
+        try:
+            return self.pool.run(request)
         except IOError, e:
             raise RemoteIntegrationException(
                 self.server or 'unknown server', e.message
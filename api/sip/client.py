@@ -29,9 +29,12 @@ import datetime
 import logging
 import os
 import re
+import select
 import socket
 import ssl
 import tempfile
+import threading
+import time
 
 # SIP2 defines a large number of fields which are used in request and
 # response messages. This library focuses on defining the response
@@ -174,6 +177,102 @@ class RequestResend(IOError):
     that it be resent.
     """
 
+class SIPMessageReader(object):
+    """Splits the bytes that come in from a SIP server into messages.
+
+    Incoming bytes are added to a buffer, and only the newly added
+    bytes are scanned for the end of a message. Any bytes that come in
+    after the end of a message are kept for the next message.
+    """
+
+    # A SIP2 message ends with a \r character. Some servers follow it
+    # with \n, which is ignored. A \n on its own may be part of a
+    # field value, so it doesn't end a message.
+    TERMINATOR = "\r"
+    LINE_FEED = "\n"
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, recv, chunk_size=None):
+        """Constructor.
+
+        :param recv: A function that takes a maximum number of bytes
+            and a timeout in seconds (or None, for no deadline), and
+            returns some bytes. An empty string means the connection
+            was closed.
+        """
+        self.recv = recv
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.buffer = bytearray()
+
+        # How much of the buffer is known not to contain a terminator.
+        self.scanned = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def clear(self):
+        """Forget about any buffered bytes."""
+        self.buffer = bytearray()
+        self.scanned = 0
+
+    def feed(self, data):
+        """Add bytes to the buffer."""
+        self.buffer.extend(data)
+
+    def read_message(self, max_size=1024*1024, deadline=None):
+        """Read the next message, receiving more bytes as needed.
+
+        :param max_size: Raise IOError if the message is longer than this.
+        :param deadline: Raise IOError if the message hasn't been
+            received by this time (as returned by time.time()).
+        :return: The message, without its terminator.
+        """
+        while True:
+            message = self.next_message(max_size)
+            if message is not None:
+                return message
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    raise IOError("Timed out waiting for SIP2 response.")
+            data = self.recv(self.chunk_size, timeout)
+            if not data:
+                raise IOError("No data read from socket.")
+            self.feed(data)
+
+    def next_message(self, max_size=1024*1024):
+        """Take a complete message out of the buffer, if there is one.
+
+        :return: The message, without its terminator, or None if the
+            buffer doesn't contain a complete message.
+        """
+        buffer = self.buffer
+
+        # Skip over the \n of a \r\n that ended the previous message.
+        start = 0
+        while start < len(buffer) and chr(buffer[start]) == self.LINE_FEED:
+            start += 1
+        if start:
+            del buffer[:start]
+            self.scanned = max(self.scanned - start, 0)
+
+        end = buffer.find(self.TERMINATOR, self.scanned)
+        if end == -1:
+            self.scanned = len(buffer)
+            if len(buffer) > max_size:
+                raise IOError("SIP2 response too large.")
+            return None
+
+        if end > max_size:
+            raise IOError("SIP2 response too large.")
+        message = str(buffer[:end])
+        del buffer[:end+1]
+        self.scanned = 0
+        return message
+
+
 class Constants(object):
     UNKNOWN_LANGUAGE = "000"
     ENGLISH = "001"
@@ -183,6 +282,13 @@ class SIPClient(Constants):
 
     log = logging.getLogger("SIPClient")
 
+    # Give up on a socket operation after this many seconds.
+    TIMEOUT = 12
+
+    # Give up on a response message after this many seconds, even if
+    # the server is still sending data.
+    MESSAGE_TIMEOUT = 30
+
     # These are the subfield names associated with the 'patron status'
     # field as specified in the SIP2 spec.
     CHARGE_PRIVILEGES_DENIED = 'charge privileges denied'
@@ -235,7 +341,8 @@ class SIPClient(Constants):
 
     def __init__(self, target_server, target_port, login_user_id=None,
                  login_password=None, location_code=None, separator=None,
-                 use_ssl=False, ssl_cert=None, ssl_key=None
+                 use_ssl=False, ssl_cert=None, ssl_key=None,
+                 ssl_context=None
     ):
         """Initialize a client for (but do not connect to) a SIP2 server.
 
@@ -245,6 +352,9 @@ class SIPClient(Constants):
             connecting to the SIP server.
         :param ssl_key: A string containing an SSL certificate to use when
             connecting to the SIP server.
+        :param ssl_context: An ssl.SSLContext to use when connecting to
+            the SIP server. If this is not provided, one will be built
+            from `ssl_cert` and `ssl_key` the first time it's needed.
         """
         self.target_server = target_server
         if not target_port:
@@ -257,6 +367,8 @@ class SIPClient(Constants):
         self.use_ssl = use_ssl or ssl_cert or ssl_key
         self.ssl_cert = ssl_cert
         self.ssl_key = ssl_key
+        self._ssl_context = ssl_context
+        self.reader = SIPMessageReader(self.recv)
 
         # Turn the separator string into a regular expression that splits
         # field name/field value pairs on the separator string.
@@ -322,7 +434,7 @@ class SIPClient(Constants):
                     self.target_server, self.target_port
                 )
             )
-        self.connection.settimeout(12)
+        self.connection.settimeout(self.TIMEOUT)
         # Since this is a new socket connection, reset the message count
         self.reset_connection_state()
 
@@ -332,6 +444,32 @@ class SIPClient(Constants):
 
     def make_secure_connection(self):
         """Create an SSL-enabled socket connection."""
+        connection = self.make_insecure_connection()
+        return self.ssl_context.wrap_socket(connection)
+
+    @property
+    def ssl_context(self):
+        """The SSLContext used to wrap this client's connections.
+
+        The context is built once and reused every time the client
+        connects.
+        """
+        if self._ssl_context is None:
+            self._ssl_context = self.make_ssl_context(
+                self.ssl_cert, self.ssl_key
+            )
+        return self._ssl_context
+
+    @classmethod
+    def make_ssl_context(cls, ssl_cert=None, ssl_key=None):
+        """Create an SSLContext that presents the given certificate and key.
+
+        Like ssl.wrap_socket(), the context does not verify the
+        server's certificate.
+        """
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        if not ssl_cert:
+            return context
 
         # If a certificate and/or key were provided, write them to
         # temporary files so OpenSSL can find them.
@@ -341,42 +479,61 @@ class SIPClient(Constants):
         # online include M2Crypt, a pure Python SSL implementation.
         # M2Crypt seems like it will work, but I couldn't find the
         # documentation I needed, so for the time being... temporary
-        # files.
+        # files. At least they're only needed when the context is built,
+        # not every time we connect.
         tmp_ssl_cert_path = None
         tmp_ssl_key_path = None
-        if self.ssl_cert:
+        try:
             fd, tmp_ssl_cert_path = tempfile.mkstemp()
-            os.write(fd, self.ssl_cert)
-            os.close(fd)
-        if self.ssl_key:
-            fd, tmp_ssl_key_path = tempfile.mkstemp()
-            os.write(fd, self.ssl_key)
+            os.write(fd, ssl_cert)
             os.close(fd)
-        connection = self.make_insecure_connection()
-        connection = ssl.wrap_socket(
-            connection, certfile=tmp_ssl_cert_path,
-            keyfile=tmp_ssl_key_path
-        )
-
-        # Now that the connection has been established, the temporary
-        # files are no longer needed. Remove them.
-        for path in tmp_ssl_cert_path, tmp_ssl_key_path:
-            if path and os.path.exists(path):
-                os.remove(path)
-
-        return connection
+            if ssl_key:
+                fd, tmp_ssl_key_path = tempfile.mkstemp()
+                os.write(fd, ssl_key)
+                os.close(fd)
+            context.load_cert_chain(
+                certfile=tmp_ssl_cert_path, keyfile=tmp_ssl_key_path
+            )
+        finally:
+            # Now that the certificate and key have been loaded, the
+            # temporary files are no longer needed. Remove them.
+            for path in tmp_ssl_cert_path, tmp_ssl_key_path:
+                if path and os.path.exists(path):
+                    os.remove(path)
+        return context
 
     def reset_connection_state(self):
         """Reset connection-specific state.
-        Specifically, the sequence number.
+        Specifically, the sequence number and any unread data.
         """
         self.sequence_number = 0
+        self.reader.clear()
 
     def disconnect(self):
         """Close the connection to the SIP server."""
-        self.connection.close()
+        if self.connection:
+            self.connection.close()
         self.connection = None
 
+    def connection_is_healthy(self):
+        """Can this client's connection be used for another request?
+
+        This is a cheap check that doesn't send anything to the
+        server. An idle connection should have nothing waiting to be
+        read. If there is something to read, the server has either
+        closed the connection or sent something we weren't expecting.
+        Either way, the connection shouldn't be used.
+        """
+        if not self.connection or len(self.reader):
+            return False
+        try:
+            readable, writable, errored = select.select(
+                [self.connection], [], [], 0
+            )
+        except (select.error, socket.error, TypeError, ValueError), e:
+            return False
+        return not readable
+
     def make_request(self, message_creator, parser, *args, **kwargs):
         """Send a request to a SIP server and parse the response.
 
@@ -756,23 +913,33 @@ class SIPClient(Constants):
         """
         self.connection.send(data)
 
-    def read_message(self, max_size=1024*1024):
+    def read_message(self, max_size=1024*1024, timeout=None):
         """Read a SIP2 message from the socket connection.
 
         A SIP2 message ends with a \r character.
+
+        :param timeout: Give up if the whole message hasn't arrived
+            after this many seconds. Defaults to MESSAGE_TIMEOUT.
         """
-        done = False
-        data = ""
-        while not done:
-            tmp = self.connection.recv(4096)
-            data = data + tmp
-            if not tmp:
-                raise IOError("No data read from socket.")
-            if ord(data[-1]) == 13 or ord(data[-1]) == 10:
-                done = True
-            if len(data) > max_size:
-                raise IOError("SIP2 response too large.")
-        return data
+        if timeout is None:
+            timeout = self.MESSAGE_TIMEOUT
+        return self.reader.read_message(max_size, time.time() + timeout)
+
+    def recv(self, size, timeout=None):
+        """Receive up to `size` bytes from the socket connection.
+
+        This method exists only to be subclassed by MockSIPClient.
+
+        :param timeout: Wait no longer than this many seconds.
+        """
+        if timeout is None:
+            return self.connection.recv(size)
+        old_timeout = self.connection.gettimeout()
+        self.connection.settimeout(min(timeout, self.TIMEOUT))
+        try:
+            return self.connection.recv(size)
+        finally:
+            self.connection.settimeout(old_timeout)
 
     def append_checksum(self, text, include_sequence_number=True):
         """Calculates checksum for passed-in message, and returns the message
@@ -816,6 +983,216 @@ class SIPClient(Constants):
         return text
 
 
+class SIPClientPool(object):
+    """A thread-safe pool of connected, logged-in SIPClients.
+
+    Reusing a connection saves the TCP handshake, the TLS handshake
+    (if any) and the login request that would otherwise precede every
+    SIP2 request. Each connection keeps its own sequence number, which
+    is reset whenever a new connection is made.
+    """
+
+    DEFAULT_MAX_SIZE = 5
+
+    # Connections that have been idle longer than this many seconds
+    # are closed rather than reused, since the server may have given
+    # up on them.
+    DEFAULT_MAX_IDLE_TIME = 60
+
+    # If all the connections are in use, give up after waiting this
+    # many seconds for one to become available.
+    DEFAULT_ACQUIRE_TIMEOUT = 10
+
+    log = logging.getLogger("SIPClientPool")
+
+    # Pools that outlive the objects using them, keyed by whatever
+    # identifies the SIP server they connect to. Each value is a
+    # (SIPClientPool, settings) 2-tuple.
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, client_factory, max_size=None, max_idle_time=None,
+                 acquire_timeout=None):
+        """Constructor.
+
+        :param client_factory: A function that takes no arguments and
+            returns a new, unconnected SIPClient.
+        :param max_size: No more than this many connections will be
+            in use at once.
+        :param max_idle_time: Close connections that have been idle for
+            this many seconds.
+        :param acquire_timeout: Raise IOError if no connection becomes
+            available within this many seconds.
+        """
+        self.client_factory = client_factory
+        self.max_size = max_size or self.DEFAULT_MAX_SIZE
+        if max_idle_time is None:
+            max_idle_time = self.DEFAULT_MAX_IDLE_TIME
+        self.max_idle_time = max_idle_time
+        if acquire_timeout is None:
+            acquire_timeout = self.DEFAULT_ACQUIRE_TIMEOUT
+        self.acquire_timeout = acquire_timeout
+        self.closed = False
+
+        # A list of (SIPClient, time it was last used) 2-tuples.
+        self._idle = []
+        self._lock = threading.Lock()
+
+        # The number of connections currently in use.
+        self._in_use = 0
+        self._available = threading.Condition(self._lock)
+
+    @classmethod
+    def shared(cls, key, settings, client_factory):
+        """Find the pool for `key`, creating it if necessary.
+
+        The objects that use a SIPClientPool may be rebuilt much more
+        often than the SIP server's configuration changes. Sharing a
+        pool between them keeps each rebuild from leaving a pool full
+        of open connections behind.
+
+        :param key: Identifies the SIP server, e.g. the ID of its
+            ExternalIntegration.
+        :param settings: The settings `client_factory` uses to create
+            clients. If the pool for `key` was created with different
+            settings, it's closed and replaced.
+        :param client_factory: A function that takes no arguments and
+            returns a new, unconnected SIPClient. This replaces the
+            factory of an existing pool.
+        """
+        with cls._shared_lock:
+            pool, old_settings = cls._shared.get(key, (None, None))
+            if pool is not None and old_settings == settings:
+                pool.client_factory = client_factory
+                return pool
+            if pool is not None:
+                pool.close()
+            pool = cls(client_factory)
+            cls._shared[key] = (pool, settings)
+            return pool
+
+    def acquire(self):
+        """Wait for permission to use a connection.
+
+        :raise IOError: If all the connections are in use and none
+            becomes available within `acquire_timeout` seconds.
+        """
+        deadline = time.time() + self.acquire_timeout
+        with self._available:
+            while self._in_use >= self.max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise IOError(
+                        "Timed out waiting for a SIP2 connection."
+                    )
+                self._available.wait(remaining)
+            self._in_use += 1
+
+    def release(self):
+        """Give up permission to use a connection."""
+        with self._available:
+            self._in_use -= 1
+            self._available.notify()
+
+    def run(self, request):
+        """Call `request` with a connected, logged-in SIPClient.
+
+        If a connection taken from the pool turns out to be dead, it's
+        closed and `request` is tried again on a brand new connection.
+
+        :param request: A function that takes a SIPClient.
+        :return: Whatever `request` returns.
+        :raise IOError: If the SIP server can't be reached.
+        """
+        self.acquire()
+        try:
+            client = self.checkout()
+            reused = client is not None
+            if not reused:
+                client = self.connect()
+            try:
+                result = request(client)
+            except IOError, e:
+                self.discard(client)
+                if not reused:
+                    raise
+                self.log.info(
+                    "Pooled SIP2 connection failed (%s); reconnecting.", e
+                )
+                client = self.connect()
+                try:
+                    result = request(client)
+                except Exception, e:
+                    self.discard(client)
+                    raise
+            except Exception, e:
+                # We don't know what state the connection is in, so
+                # it can't be reused.
+                self.discard(client)
+                raise
+            self.checkin(client)
+            return result
+        finally:
+            self.release()
+
+    def connect(self):
+        """Create a new client, connect it, and log it in."""
+        client = self.client_factory()
+        try:
+            client.connect()
+            client.login()
+        except Exception, e:
+            self.discard(client)
+            raise
+        return client
+
+    def checkout(self):
+        """Take the most recently used healthy client out of the pool.
+
+        :return: A SIPClient, or None if there are no healthy clients.
+        """
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                client, last_used = self._idle.pop()
+            if (now - last_used <= self.max_idle_time
+                and client.connection_is_healthy()):
+                return client
+            self.discard(client)
+
+    def checkin(self, client):
+        """Put a client back in the pool, or close it if the pool has
+        been closed.
+        """
+        with self._lock:
+            if not self.closed:
+                self._idle.append((client, time.time()))
+                return
+        self.discard(client)
+
+    def discard(self, client):
+        """Close a client's connection without putting it back in
+        the pool.
+        """
+        try:
+            client.disconnect()
+        except Exception, e:
+            self.log.warn("Error closing SIP2 connection: %s", e)
+
+    def close(self):
+        """Close all idle connections. Connections in use are closed
+        when they're checked back in.
+        """
+        with self._lock:
+            self.closed = True
+            idle = self._idle
+            self._idle = []
+        for client, last_used in idle:
+            self.discard(client)
+
+
 class MockSIPClient(SIPClient):
     """A SIP client that relies on canned responses rather than a socket
     connection.
@@ -845,11 +1222,13 @@ class MockSIPClient(SIPClient):
     def do_send(self, data):
         self.requests.append(data)
 
-    def read_message(self, max_size=1024*1024):
-        """Read a response message off the queue."""
+    def recv(self, size, timeout=None):
+        """Read a response message off the queue, as though the server
+        had sent it.
+        """
         response = self.responses[0]
         self.responses = self.responses[1:]
-        return response
+        return response + "\r"
 
     def end_session(self, *args, **kwargs):
         pass
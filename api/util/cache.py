@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """A thread-safe, in-process key-value store whose items expire
+    after a certain number of seconds.
+
+    Once the store holds `capacity` items, adding a new item discards
+    the least recently used one.
+
+    Code that uses an LRUCache should only call `get`, `set` and
+    `delete`, so that any object implementing those three methods
+    (e.g. a client for a store shared between processes) can be
+    used in its place.
+    """
+
+    DEFAULT_CAPACITY = 10000
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or self.DEFAULT_CAPACITY
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """Look up an item.
+
+        :return: The stored value, or `default` if there is no
+            unexpired value for `key`.
+        """
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            expires, value = item
+            if expires is not None and expires < time.time():
+                return default
+            # Move the item to the most recently used end of the queue.
+            self._items[key] = item
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store an item.
+
+        :param ttl: The item will expire after this many seconds. If
+            this is None, the item will only go away if it's deleted
+            or pushed out by newer items.
+        """
+        if ttl is None:
+            expires = None
+        else:
+            expires = time.time() + ttl
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (expires, value)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        """Remove an item, if it's present."""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
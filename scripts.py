@@ -6,6 +6,7 @@ from datetime import (
 )
 from nose.tools import set_trace
 import csv
+import hashlib
 import json
 import os
 import sys
@@ -13,6 +14,7 @@ import time
 import urlparse
 import logging
 import argparse
+import multiprocessing
 
 from sqlalchemy import (
     or_,
@@ -48,6 +50,7 @@ from core.model import (
     Edition,
     ExternalIntegration,
     get_one,
+    get_one_or_create,
     Hold,
     Hyperlink,
     Identifier,
@@ -60,6 +63,7 @@ from core.model import (
     Subject,
     Timestamp,
     Work,
+    production_session,
 )
 from core.scripts import (
     Script as CoreScript,
@@ -77,6 +81,7 @@ from core.lane import (
     Pagination,
     Facets,
     FeaturedFacets,
+    WorkList,
 )
 from core.opds_import import (
     MetadataWranglerOPDSLookup,
@@ -113,6 +118,7 @@ from api.bibliotheca import (
     BibliothecaCirculationSweep
 )
 from api.nyt import NYTBestSellerAPI
+from api.monitor import delete_in_batches
 from api.opds_for_distributors import (
     OPDSForDistributorsImporter,
     OPDSForDistributorsImportMonitor,
@@ -126,12 +132,14 @@ from api.odl import (
 )
 from core.scripts import OPDSImportScript
 from api.novelist import (
-    NoveListAPI
+    NoveListAPI,
+    NoveListRecommendationCache,
 )
 from core.metadata_layer import MARCExtractor
 from api.onix import ONIXExtractor
 from core.marc import MARCExporter
 from api.marc import LibraryAnnotator as MARCLibraryAnnotator
+from api.admin.dashboard_stats import DashboardStatistics
 
 class Script(CoreScript):
     def load_config(self):
@@ -314,10 +322,38 @@ class UpdateStaffPicksScript(Script):
         return StringIO(representation.content)
 
 
+# When CacheRepresentationPerLane runs with more than one worker, each
+# worker process gets its own copy of the script, with its own
+# database session and request context.
+_cache_worker = None
+
+def _initialize_cache_worker(script_class, cmd_args, testing, engine):
+    global _cache_worker
+    # The worker was forked from the main process, so it starts out
+    # with a copy of the main process's connection pool. Those
+    # connections belong to the main process, so throw them away and
+    # start a new session.
+    engine.dispose()
+    _db = production_session()
+    _cache_worker = script_class(_db, cmd_args=cmd_args, testing=testing)
+    ctx = _cache_worker.app.test_request_context(
+        base_url=_cache_worker.base_url
+    )
+    ctx.push()
+
+def _run_cache_task(task):
+    return _cache_worker.process_task(*task)
+
+
 class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
 
     name = "Cache one representation per lane"
 
+    # If this is True, the time it took to process each lane is stored
+    # in a Timestamp for the library, so the next run can start with
+    # the slowest lanes.
+    SAVE_LANE_TIMINGS = False
+
     @classmethod
     def arg_parser(cls, _db):
         parser = LaneSweeperScript.arg_parser(_db)
@@ -338,6 +374,17 @@ class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
             type=int,
             default=1
         )
+        parser.add_argument(
+            '--workers',
+            help='Generate feeds in this many worker processes.',
+            type=int,
+            default=1
+        )
+        parser.add_argument(
+            '--skip-fresh',
+            help="Don't regenerate feeds that have been cached recently enough.",
+            dest='skip_fresh', action='store_true',
+        )
         return parser
 
     def __init__(self, _db=None, cmd_args=None, testing=False, manager=None,
@@ -357,7 +404,15 @@ class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
         """
 
         super(CacheRepresentationPerLane, self).__init__(_db, *args, **kwargs)
+        self.cmd_args = cmd_args
+        self.testing = testing
         self.parse_args(cmd_args)
+
+        # While this is a list, process_lane only makes a note of the
+        # lanes to process, so they can be handed out to workers.
+        self.lane_queue = None
+        self.lane_timings = {}
+        self.lane_names = {}
         if not manager:
             manager = CirculationManager(self._db, testing=testing)
         from api.app import app
@@ -378,6 +433,8 @@ class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
                     self.log.warn("Ignored unrecognized language code %s", alpha)
         self.max_depth = parsed.max_depth
         self.min_depth = parsed.min_depth
+        self.workers = parsed.workers
+        self.force_refresh = not parsed.skip_fresh
 
         # Return the parsed arguments in case a subclass needs to
         # process more args.
@@ -427,9 +484,21 @@ class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
         client = self.app.test_client()
         ctx = self.app.test_request_context(base_url=self.base_url)
         ctx.push()
-        super(CacheRepresentationPerLane, self).process_library(library)
+        self.lane_timings = {}
+        self.lane_names = {}
+        if self.workers > 1:
+            # Find the lanes that need to be processed, then hand them
+            # out to the workers.
+            self.lane_queue = []
+            super(CacheRepresentationPerLane, self).process_library(library)
+            lanes, self.lane_queue = self.lane_queue, None
+            self.process_lanes_in_parallel(library, lanes)
+        else:
+            super(CacheRepresentationPerLane, self).process_library(library)
         ctx.pop()
         end = time.time()
+        self.report_lane_timings()
+        self.save_lane_timings(library)
         self.log.info(
             "Processed library %s in %.2fsec", library.short_name, end-begin
         )
@@ -439,29 +508,183 @@ class CacheRepresentationPerLane(TimestampScript, LaneSweeperScript):
         One feed will be generated for each combination of Facets and
         Pagination objects returned by facets() and pagination().
         """
+        if self.lane_queue is not None:
+            self.lane_queue.append(lane)
+            return []
+
+        a = time.time()
         cached_feeds = []
         for facets in self.facets(lane):
-            for pagination in self.pagination(lane):
-                extra_description = ""
-                if facets:
-                    extra_description += " Facets: %s." % facets.query_string
-                if pagination:
-                    extra_description += " Pagination: %s." % pagination.query_string
+            cached_feeds.extend(self.process_facets(lane, facets))
+        self.record_lane_timing(lane, time.time() - a)
+        return cached_feeds
+
+    def process_facets(self, lane, facets):
+        """Generate a feed for this lane and these facets, for each
+        Pagination object returned by pagination().
+        """
+        cached_feeds = []
+        for pagination in self.pagination(lane):
+            extra_description = ""
+            if facets:
+                extra_description += " Facets: %s." % facets.query_string
+            if pagination:
+                extra_description += " Pagination: %s." % pagination.query_string
+            self.log.info(
+                "Generating feed for %s.%s", lane.full_identifier,
+                extra_description
+            )
+            a = time.time()
+            feed = self.do_generate(lane, facets, pagination)
+            b = time.time()
+            if feed:
+                cached_feeds.append(feed)
                 self.log.info(
-                    "Generating feed for %s.%s", lane.full_identifier,
-                    extra_description
+                    "Took %.2f sec to make %d bytes.", (b-a), len(feed)
                 )
-                a = time.time()
-                feed = self.do_generate(lane, facets, pagination)
-                b = time.time()
-                if feed:
-                    cached_feeds.append(feed)
-                    self.log.info(
-                        "Took %.2f sec to make %d bytes.", (b-a), len(feed)
-                    )
-        total_size = sum(len(x) for x in cached_feeds)
         return cached_feeds
 
+    def lane_key(self, lane):
+        """A string that identifies this lane in the stored timings.
+
+        Only the library's top-level WorkList has no database ID.
+        """
+        if isinstance(lane, Lane):
+            return str(lane.id)
+        return "top"
+
+    def record_lane_timing(self, lane, elapsed):
+        key = self.lane_key(lane)
+        self.lane_names[key] = lane.full_identifier
+        self.lane_timings[key] = self.lane_timings.get(key, 0) + elapsed
+
+    def load_lane_timings(self, library):
+        """Find out how long it took to process each lane last time.
+
+        :return: A dictionary mapping lane_key() to seconds.
+        """
+        if not self.SAVE_LANE_TIMINGS:
+            return {}
+        timestamp = get_one(
+            self._db, Timestamp, **self.lane_timings_timestamp_args(library)
+        )
+        if not timestamp:
+            return {}
+        try:
+            return json.loads(timestamp.achievements or "{}")
+        except ValueError, e:
+            return {}
+
+    def save_lane_timings(self, library):
+        if not self.SAVE_LANE_TIMINGS or not self.lane_timings:
+            return
+        timings = self.load_lane_timings(library)
+        timings.update(self.lane_timings)
+        timestamp, is_new = get_one_or_create(
+            self._db, Timestamp, **self.lane_timings_timestamp_args(library)
+        )
+        timestamp.achievements = unicode(json.dumps(timings))
+        timestamp.finish = datetime.utcnow()
+        self._db.commit()
+
+    def lane_timings_timestamp_args(self, library):
+        """Identify the Timestamp where the lane timings for `library`
+        are stored.
+        """
+        return dict(
+            service=u"%s: library %s" % (self.name, library.id),
+            service_type=Timestamp.SCRIPT_TYPE, collection=None
+        )
+
+    def report_lane_timings(self):
+        """Log how long each lane took, slowest first."""
+        for key, elapsed in sorted(
+            self.lane_timings.items(), key=lambda x: -x[1]
+        ):
+            self.log.info(
+                "%.2fsec %s", elapsed, self.lane_names.get(key, key)
+            )
+
+    def order_lanes(self, library, lanes):
+        """Put the lanes that took the longest last time first, so the
+        slowest ones don't hold up the end of the run. Lanes with no
+        recorded time go before all the others.
+        """
+        timings = self.load_lane_timings(library)
+        def cost(lane):
+            return -timings.get(self.lane_key(lane), float('inf'))
+        return sorted(lanes, key=cost)
+
+    def process_lanes_in_parallel(self, library, lanes):
+        """Generate feeds for each lane, spreading the work across
+        worker processes. Each combination of a lane and a set of
+        facets is a separate task.
+        """
+        tasks = []
+        for lane in self.order_lanes(library, lanes):
+            self.lane_names[self.lane_key(lane)] = lane.full_identifier
+            lane_id = None
+            if isinstance(lane, Lane):
+                lane_id = lane.id
+            for i, facets in enumerate(self.facets(lane)):
+                tasks.append((library.id, lane_id, i))
+
+        # Don't leave a transaction open while the workers are busy.
+        self._db.commit()
+
+        for key, elapsed in self.run_tasks(tasks):
+            self.lane_timings[key] = self.lane_timings.get(key, 0) + elapsed
+
+    def run_tasks(self, tasks):
+        """Run tasks in a pool of worker processes.
+
+        :yield: The result of each task as it finishes.
+        """
+        # Close this process's pooled database connections, so the
+        # workers don't inherit any that are still open.
+        bind = self._db.get_bind()
+        engine = getattr(bind, 'engine', bind)
+        engine.dispose()
+        pool = multiprocessing.Pool(
+            self.workers, initializer=_initialize_cache_worker,
+            initargs=(self.__class__, self.cmd_args, self.testing, engine)
+        )
+        try:
+            for result in pool.imap_unordered(_run_cache_task, tasks):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def process_task(self, library_id, lane_id, facets_index):
+        """Generate the feeds for one lane and one set of facets.
+
+        This is called in a worker process.
+
+        :return: A 2-tuple (lane_key, seconds taken).
+        """
+        a = time.time()
+        library = get_one(self._db, Library, id=library_id)
+        if lane_id is None:
+            lane = WorkList.top_level_for_library(self._db, library)
+        else:
+            lane = get_one(self._db, Lane, id=lane_id)
+            if not lane:
+                # The lane was deleted after the run started.
+                return str(lane_id), time.time() - a
+        key = self.lane_key(lane)
+        try:
+            facets = list(self.facets(lane))[facets_index]
+            self.process_facets(lane, facets)
+            self._db.commit()
+        except Exception, e:
+            self.log.error(
+                "Error generating feeds for %s", lane.full_identifier,
+                exc_info=e
+            )
+            self._db.rollback()
+        return key, time.time() - a
+
     def facets(self, lane):
         """Yield a Facets object for each set of facets this
         script is expected to handle.
@@ -486,6 +709,8 @@ class CacheFacetListsPerLane(CacheRepresentationPerLane):
 
     name = "Cache paginated OPDS feed for each lane"
 
+    SAVE_LANE_TIMINGS = True
+
     @classmethod
     def arg_parser(cls, _db):
         parser = CacheRepresentationPerLane.arg_parser(_db)
@@ -641,7 +866,7 @@ class CacheFacetListsPerLane(CacheRepresentationPerLane):
         return feed_class.page(
             _db=self._db, title=title, url=url, lane=lane,
             annotator=annotator, facets=facets, pagination=pagination,
-            force_refresh=True
+            force_refresh=self.force_refresh
         )
 
 
@@ -649,6 +874,8 @@ class CacheOPDSGroupFeedPerLane(CacheRepresentationPerLane):
 
     name = "Cache OPDS grouped feed for each lane"
 
+    SAVE_LANE_TIMINGS = True
+
     def should_process_lane(self, lane):
         # OPDS group feeds are only generated for lanes that have sublanes.
         if not lane.children:
@@ -664,7 +891,7 @@ class CacheOPDSGroupFeedPerLane(CacheRepresentationPerLane):
         feed_class = feed_class or AcquisitionFeed
         return feed_class.groups(
             _db=self._db, title=title, url=url, lane=lane, annotator=annotator,
-            force_refresh=True, facets=facets
+            force_refresh=self.force_refresh, facets=facets
         )
 
     def facets(self, lane):
@@ -778,21 +1005,80 @@ class CacheMARCFiles(LaneSweeperScript):
             self.log.info("Skipping lane %s because last update was less than %d days ago" % (lane.display_name, update_frequency))
             return
 
+        start_time = None
+        if last_update:
+            # Allow one day of overlap to ensure we don't miss anything due to script timing.
+            start_time = last_update - timedelta(days=1)
+
+        fingerprint = self.lane_fingerprint(
+            lane, annotator.settings(exporter.integration)
+        )
+        timestamp = self.fingerprint_timestamp(library, lane)
+        if (not self.force and start_time and fingerprint is not None
+            and timestamp.achievements == fingerprint):
+            # The lane contains exactly the same works as it did when
+            # the last file was made, none of them has changed, and
+            # neither have the export settings, so the existing files
+            # are still accurate.
+            self.log.info("Skipping lane %s because neither its contents nor the export settings have changed since the last update" % lane.display_name)
+            return
+
         # First update the file with ALL the records.
         records = exporter.records(
             lane, annotator=annotator,
         )
 
         # Then create a new file with changes since the last update.
-        start_time = None
-        if last_update:
-            # Allow one day of overlap to ensure we don't miss anything due to script timing.
-            start_time = last_update - timedelta(days=1)
-
+        if start_time:
             records = exporter.records(
                 lane, annotator=annotator, start_time=start_time,
             )
 
+        now = datetime.utcnow()
+        timestamp.start = timestamp.finish = now
+        timestamp.achievements = fingerprint
+
+    def lane_fingerprint(self, lane, settings=None):
+        """Summarize what a MARC file for `lane` would contain.
+
+        The summary covers which works are in the lane and when each
+        was last updated. Works being added, removed or suppressed,
+        losing their licenses, or changing in any way all change the
+        summary. So do changes to the lane's own definition or to the
+        custom lists it's based on.
+
+        :param settings: The MARCExportSettings the records would be
+            made with. Changing any of them changes the summary.
+        :return: A string, or None if the lane's works can't be found.
+        """
+        from core.model import MaterializedWorkWithGenre as mw
+        qu = lane.works(self._db)
+        if qu is None:
+            return None
+        qu = qu.order_by(None).with_entities(mw.works_id, mw.last_update_time)
+        fingerprint = hashlib.sha1()
+        if settings:
+            fingerprint.update("%r\n" % ((
+                settings.marc_org, settings.include_summary,
+                settings.include_genres, settings.book_url_prefixes
+            ),))
+        for work_id, last_update_time in sorted(qu):
+            fingerprint.update("%s %s\n" % (work_id, last_update_time))
+        return unicode(fingerprint.hexdigest())
+
+    def fingerprint_timestamp(self, library, lane):
+        """Find the Timestamp recording the fingerprint of `lane` as of
+        its last MARC file.
+        """
+        service = u"%s: library %s" % (self.name, library.id)
+        if isinstance(lane, Lane):
+            service += u", lane %s" % lane.id
+        timestamp, is_new = get_one_or_create(
+            self._db, Timestamp, service=service,
+            service_type=Timestamp.SCRIPT_TYPE, collection=None
+        )
+        return timestamp
+
 
 class AdobeAccountIDResetScript(PatronInputScript):
 
@@ -980,13 +1266,16 @@ class LoanReaperScript(TimestampScript):
 
     name = "Remove expired loans and holds from local database"
 
+    # Loans and holds are deleted this many at a time.
+    BATCH_SIZE = 1000
+
     def do_run(self):
         now = datetime.utcnow()
 
         # Reap loans and holds that we know have expired.
         for obj, what in ((Loan, 'loans'), (Hold, 'holds')):
-            qu = self._db.query(obj).filter(obj.end < now)
-            self._reap(qu, "expired %s" % what)
+            qu = self._db.query(obj.id).filter(obj.end < now)
+            self._reap(obj, qu, "expired %s" % what)
 
         for obj, what, max_age in (
                 (Loan, 'loans', timedelta(days=90)),
@@ -996,7 +1285,7 @@ class LoanReaperScript(TimestampScript):
             # old. It's very likely these loans and holds have expired
             # and we simply don't have the information.
             older_than = now - max_age
-            qu = self._db.query(obj).join(obj.license_pool).filter(
+            qu = self._db.query(obj.id).join(obj.license_pool).filter(
                 obj.end == None).filter(
                     obj.start < older_than).filter(
                         LicensePool.open_access == False
@@ -1004,23 +1293,34 @@ class LoanReaperScript(TimestampScript):
             explain = "%s older than %s" % (
                 what, older_than.strftime("%Y-%m-%d")
             )
-            self._reap(qu, explain)
+            self._reap(obj, qu, explain)
 
-    def _reap(self, qu, what):
-        """Delete every database object that matches the given query.
+    def _reap(self, model_class, qu, what):
+        """Delete every database row that matches the given query.
 
-        :param qu: The query that yields objects to delete.
+        :param model_class: Loan or Hold.
+        :param qu: A query that finds the IDs of the rows to delete.
         :param what: A human-readable explanation of what's being
                      deleted.
         """
-        counter = 0
-        print "Reaping %d %s." % (qu.count(), what)
-        for o in qu:
-            self._db.delete(o)
-            counter += 1
-            if not counter % 100:
-                print counter
-                self._db.commit()
+        print "Reaping %s." % what
+        deleted = 0
+        for deleted in delete_in_batches(
+            self._db, model_class, qu, self.BATCH_SIZE
+        ):
+            print deleted
+        print "Reaped %d %s." % (deleted, what)
+
+
+class DashboardStatisticsScript(TimestampScript):
+    """Recalculate the statistics shown on the admin dashboard, so
+    loading the dashboard doesn't have to.
+    """
+
+    name = "Recalculate admin dashboard statistics"
+
+    def do_run(self):
+        DashboardStatistics(self._db).recalculate()
         self._db.commit()
 
 
@@ -1213,6 +1513,10 @@ class DirectoryImportScript(TimestampScript):
 
     name = "Import new titles from a directory on disk"
 
+    # Commit the database session after this many titles have been
+    # imported.
+    BATCH_SIZE = 100
+
     @classmethod
     def arg_parser(cls, _db):
         parser = argparse.ArgumentParser()
@@ -1296,13 +1600,15 @@ class DirectoryImportScript(TimestampScript):
         replacement_policy = ReplacementPolicy.from_license_source(self._db)
         replacement_policy.mirror = mirror
         metadata_records = self.load_metadata(metadata_file, metadata_format, data_source_name)
-        for metadata in metadata_records:
+        for i, metadata in enumerate(metadata_records):
             self.work_from_metadata(
                 collection, metadata, replacement_policy, cover_directory,
                 ebook_directory, rights_uri
             )
-            if not dry_run:
+            if not dry_run and (i+1) % self.BATCH_SIZE == 0:
                 self._db.commit()
+        if not dry_run:
+            self._db.commit()
 
     def load_collection(self, collection_name, data_source_name):
         """Create or locate a Collection with the given name.
@@ -1362,17 +1668,19 @@ class DirectoryImportScript(TimestampScript):
         return collection, mirror
 
     def load_metadata(self, metadata_file, metadata_format, data_source_name):
-        """Read a metadata file and convert the data into Metadata records."""
-        metadata_records = []
+        """Read a metadata file and convert the data into Metadata records.
 
+        :return: A generator of Metadata objects. An ONIX file is parsed
+            one <product> at a time, as the records are needed.
+        """
         if metadata_format == 'marc':
-            extractor = MARCExtractor()
+            parse = MARCExtractor().parse
         elif metadata_format == 'onix':
-            extractor = ONIXExtractor()
+            parse = ONIXExtractor().iterparse
 
         with open(metadata_file) as f:
-            metadata_records.extend(extractor.parse(f, data_source_name))
-        return metadata_records
+            for metadata in parse(f, data_source_name):
+                yield metadata
 
     def work_from_metadata(self, collection, metadata, policy, *args, **kwargs):
         self.annotate_metadata(metadata, policy, *args, **kwargs)
@@ -1651,6 +1959,38 @@ class NovelistSnapshotScript(TimestampScript, LibraryInputScript):
 
                 output.write(result)
 
+class NoveListRecommendationsScript(TimestampScript, LibraryInputScript):
+    """Look up NoveList recommendations for a library's books ahead
+    of time, so related books feeds don't have to wait for NoveList.
+    """
+
+    name = "Look up NoveList recommendations"
+
+    def novelist_api(self, library):
+        return NoveListAPI.from_config(library)
+
+    def process_library(self, library):
+        try:
+            api = self.novelist_api(library)
+        except ValueError, e:
+            # NoveList isn't configured for this library.
+            return
+
+        cache = NoveListRecommendationCache(library)
+        for identifier in cache.pending():
+            try:
+                cache.resolve(api, identifier)
+            except Exception, e:
+                # The book will be tried again next time.
+                self.log.error(
+                    "Could not look up NoveList recommendations for %r",
+                    identifier, exc_info=e
+                )
+                self._db.rollback()
+                continue
+            self._db.commit()
+
+
 class ODLBibliographicImportScript(OPDSImportScript):
     """Import bibliographic information from the feed associated
     with an ODL collection."""
@@ -34,6 +34,7 @@ from api.admin.controller import (
     PatronController,
     TimestampsController
 )
+from api.admin.dashboard_stats import DashboardStatistics
 from api.admin.problem_details import *
 from api.admin.exceptions import *
 from api.admin.routes import setup_admin
@@ -2451,6 +2452,10 @@ class TestLanesController(AdminControllerTest):
             assert_raises(AdminNotAuthorized, self.manager.admin_lanes_controller.lanes)
             self.admin.add_role(AdminRole.LIBRARIAN, library)
             response = self.manager.admin_lanes_controller.lanes()
+            eq_(200, response.status_code)
+            etag = response.headers.get("ETag")
+            assert etag
+            response = json.loads(response.data)
 
             eq_(3, len(response.get("lanes")))
             [english_info, spanish_info, list_info] = response.get("lanes")
@@ -2492,6 +2497,29 @@ class TestLanesController(AdminControllerTest):
             eq_([list.id], list_info.get("custom_list_ids"))
             eq_(True, list_info.get("inherit_parent_restrictions"))
 
+        # If the lanes haven't changed, the admin interface doesn't
+        # get them again.
+        with self.request_context_with_library_and_admin(
+            "/", headers={"If-None-Match": etag}
+        ):
+            flask.request.library = library
+            response = self.manager.admin_lanes_controller.lanes()
+            eq_(304, response.status_code)
+
+        # Once they've changed, it does.
+        spanish.display_name = "Espanol"
+        with self.request_context_with_library_and_admin(
+            "/", headers={"If-None-Match": etag}
+        ):
+            flask.request.library = library
+            response = self.manager.admin_lanes_controller.lanes()
+            eq_(200, response.status_code)
+            assert etag != response.headers.get("ETag")
+            [english_info, spanish_info, list_info] = json.loads(
+                response.data
+            ).get("lanes")
+            eq_("Espanol", spanish_info.get("display_name"))
+
     def test_lanes_post_errors(self):
         with self.request_context_with_library_and_admin("/", method='POST'):
             flask.request.form = MultiDict([
@@ -2858,7 +2886,7 @@ class TestDashboardController(AdminControllerTest):
 
         with self.app.test_request_context("/"):
             response, requested_date = self.manager.admin_dashboard_controller.bulk_circulation_events()
-        rows = response[1::] # skip header row
+            rows = list(response)[1::] # skip header row
         eq_(num, len(rows))
         eq_(types, [row[1] for row in rows])
         eq_([identifier.identifier]*num, [row[2] for row in rows])
@@ -2876,15 +2904,42 @@ class TestDashboardController(AdminControllerTest):
         today = date.strftime(date.today() - timedelta(days=1), "%Y-%m-%d")
         with self.app.test_request_context("/?date=%s" % today):
             response, requested_date = self.manager.admin_dashboard_controller.bulk_circulation_events()
-        rows = response[1::] # skip header row
+            rows = list(response)[1::] # skip header row
         eq_(0, len(rows))
+        eq_(today, requested_date)
+
+        # A range of dates can be requested. The events are read a
+        # chunk at a time, and the genres are looked up for each chunk.
+        tomorrow = date.strftime(date.today() + timedelta(days=1), "%Y-%m-%d")
+        self.manager.admin_dashboard_controller.CIRCULATION_EVENTS_CHUNK_SIZE = 2
+        try:
+            with self.app.test_request_context("/?date=%s&dateEnd=%s" % (today, tomorrow)):
+                response, requested_date = self.manager.admin_dashboard_controller.bulk_circulation_events()
+                rows = list(response)[1::]
+        finally:
+            del self.manager.admin_dashboard_controller.CIRCULATION_EVENTS_CHUNK_SIZE
+        eq_(types, [row[1] for row in rows])
+        eq_([ordered_genre_string]*num, [row[11] for row in rows])
+        eq_("%s_%s" % (today, tomorrow), requested_date)
+
+        # An invalid date is a problem.
+        with self.app.test_request_context("/?date=yesterday"):
+            response, requested_date = self.manager.admin_dashboard_controller.bulk_circulation_events()
+        eq_(INVALID_DATE_FORMAT, response)
+
+    def recalculated_stats(self):
+        """Recalculate the dashboard statistics, as
+        DashboardStatisticsScript would, and load the dashboard.
+        """
+        DashboardStatistics(self._db).recalculate()
+        return self.manager.admin_dashboard_controller.stats()
 
     def test_stats_patrons(self):
         with self.request_context_with_admin("/"):
             self.admin.add_role(AdminRole.SYSTEM_ADMIN)
 
             # At first, there's one patron in the database.
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             for data in [library_data, total_data]:
@@ -2911,7 +2966,7 @@ class TestDashboardController(AdminControllerTest):
             patron3 = self._patron()
             open_access_pool.loan_to(patron3)
 
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             for data in [library_data, total_data]:
@@ -2926,7 +2981,7 @@ class TestDashboardController(AdminControllerTest):
             l2 = self._library()
             patron4 = self._patron(library=l2)
 
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             eq_(4, library_data.get('patrons').get('total'))
@@ -2937,7 +2992,7 @@ class TestDashboardController(AdminControllerTest):
             self.admin.remove_role(AdminRole.SYSTEM_ADMIN)
             self.admin.add_role(AdminRole.LIBRARIAN, self._default_library)
 
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             eq_(4, library_data.get('patrons').get('total'))
@@ -2949,7 +3004,7 @@ class TestDashboardController(AdminControllerTest):
 
             # At first, there is 1 open access title in the database,
             # created in CirculationControllerTest.setup.
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             for data in [library_data, total_data]:
@@ -2974,7 +3029,7 @@ class TestDashboardController(AdminControllerTest):
             pool3.licenses_owned = 5
             pool3.licenses_available = 4
 
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             for data in [library_data, total_data]:
@@ -2989,7 +3044,7 @@ class TestDashboardController(AdminControllerTest):
             pool4.licenses_owned = 2
             pool4.licenses_available = 2
 
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             eq_(3, library_data.get('inventory').get('titles'))
@@ -3004,7 +3059,7 @@ class TestDashboardController(AdminControllerTest):
 
             # The admin can no longer see the other collection, so it's not
             # counted in the totals.
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             for data in [library_data, total_data]:
@@ -3019,7 +3074,7 @@ class TestDashboardController(AdminControllerTest):
 
             # At first, there is 1 open access title in the database,
             # created in CirculationControllerTest.setup.
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             for data in [library_data, total_data]:
@@ -3066,7 +3121,7 @@ class TestDashboardController(AdminControllerTest):
             pool4.licenses_owned = 5
             pool4.licenses_available = 5
 
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             library_collections_data = library_data.get('collections')
@@ -3098,7 +3153,7 @@ class TestDashboardController(AdminControllerTest):
 
             # c2 is no longer included in the totals since the admin's library does
             # not use it.
-            response = self.manager.admin_dashboard_controller.stats()
+            response = self.recalculated_stats()
             library_data = response.get(self._default_library.short_name)
             total_data = response.get("total")
             for data in [library_data, total_data]:
@@ -3118,6 +3173,61 @@ class TestDashboardController(AdminControllerTest):
                 eq_(0, c3_data.get('licenses'))
                 eq_(0, c3_data.get('available_licenses'))
 
+    def test_stats_are_stored(self):
+        with self.request_context_with_admin("/"):
+            self.admin.add_role(AdminRole.SYSTEM_ADMIN)
+
+            # The statistics haven't been calculated yet, so there's
+            # nothing to show.
+            response = self.manager.admin_dashboard_controller.stats()
+            total_data = response.get("total")
+            eq_(0, total_data.get('patrons').get('total'))
+            eq_(None, total_data.get('computed_at'))
+
+            response = self.recalculated_stats()
+            total_data = response.get("total")
+            eq_(1, total_data.get('patrons').get('total'))
+
+            # The response says when the statistics were calculated.
+            computed_at = total_data.get('computed_at')
+            assert computed_at
+            library_data = response.get(self._default_library.short_name)
+            eq_(computed_at, library_data.get('computed_at'))
+
+            # A new patron isn't counted, because loading the
+            # dashboard doesn't recalculate the statistics.
+            self._patron()
+            response = self.manager.admin_dashboard_controller.stats()
+            total_data = response.get("total")
+            eq_(1, total_data.get('patrons').get('total'))
+            eq_(computed_at, total_data.get('computed_at'))
+
+            # Once they're recalculated, the patron is counted.
+            response = self.recalculated_stats()
+            eq_(2, response.get("total").get('patrons').get('total'))
+
+        # A librarian can ask for the statistics to be recalculated
+        # when the dashboard is loaded.
+        self._patron()
+        self.admin.remove_role(AdminRole.SYSTEM_ADMIN)
+        with self.request_context_with_admin("/?recompute=true"):
+            assert_raises(
+                AdminNotAuthorized,
+                self.manager.admin_dashboard_controller.stats
+            )
+
+        self.admin.add_role(AdminRole.LIBRARIAN, self._default_library)
+        with self.request_context_with_admin("/?recompute=true"):
+            response = self.manager.admin_dashboard_controller.stats()
+            library_data = response.get(self._default_library.short_name)
+            eq_(3, library_data.get('patrons').get('total'))
+
+        # The recalculated statistics were stored.
+        with self.request_context_with_admin("/"):
+            response = self.manager.admin_dashboard_controller.stats()
+            library_data = response.get(self._default_library.short_name)
+            eq_(3, library_data.get('patrons').get('total'))
+
 
 class SettingsControllerTest(AdminControllerTest):
     """Test some part of the settings controller."""
@@ -0,0 +1,87 @@
+from nose.tools import (
+    eq_,
+    set_trace,
+)
+import json
+from datetime import datetime, timedelta
+
+from api.admin.dashboard_stats import DashboardStatistics
+
+from .. import DatabaseTest
+
+
+class TestDashboardStatistics(DatabaseTest):
+
+    def setup(self):
+        super(TestDashboardStatistics, self).setup()
+        self.statistics = DashboardStatistics(self._db)
+
+    def test_calculate(self):
+        library = self._default_library
+        other_library = self._library()
+        tomorrow = datetime.now() + timedelta(days=1)
+
+        edition, pool = self._edition(
+            with_license_pool=True, with_open_access_download=False
+        )
+        pool.open_access = False
+        pool.licenses_owned = 5
+        pool.licenses_available = 2
+        ignore, open_access_pool = self._edition(
+            with_open_access_download=True
+        )
+
+        # One patron has a loan and a hold, and another patron has a
+        # hold.
+        patron1 = self._patron()
+        pool.loan_to(patron1, end=tomorrow)
+        open_access_pool.on_hold_to(patron1)
+        patron2 = self._patron()
+        pool.on_hold_to(patron2)
+
+        # A patron from another library has a hold.
+        patron3 = self._patron(library=other_library)
+        open_access_pool.on_hold_to(patron3)
+
+        now = datetime(2018, 1, 2, 3, 4, 5)
+        statistics = self.statistics.calculate(now)
+        eq_("2018-01-02T03:04:05Z", statistics["computed_at"])
+
+        eq_(dict(licensed_titles=1, open_access_titles=1, licenses=5,
+                 available_licenses=2),
+            statistics["collections"][str(self._default_collection.id)])
+
+        eq_(dict(total=2, with_active_loans=1, with_active_loans_or_holds=2,
+                 loans=1, holds=2),
+            statistics["libraries"][str(library.id)])
+        eq_(dict(total=1, with_active_loans=0, with_active_loans_or_holds=1,
+                 loans=0, holds=1),
+            statistics["libraries"][str(other_library.id)])
+
+    def test_recalculate(self):
+        # There are no statistics yet.
+        eq_(None, self.statistics.load())
+        eq_(dict(computed_at=None, collections={}, libraries={}),
+            self.statistics.get())
+
+        # Once they're calculated, they're stored in a Timestamp.
+        now = datetime(2018, 1, 1)
+        statistics = self.statistics.recalculate(now)
+        eq_(now, DashboardStatistics.computed_at(statistics))
+        eq_(statistics, self.statistics.load())
+        eq_(statistics, self.statistics.get())
+
+        timestamp = self.statistics.timestamp()
+        eq_(DashboardStatistics.SERVICE_NAME, timestamp.service)
+        eq_(now, timestamp.finish)
+
+        # Recalculating them replaces what was stored.
+        later = datetime(2018, 1, 2)
+        self.statistics.recalculate(later)
+        eq_(later, DashboardStatistics.computed_at(self.statistics.get()))
+        eq_(timestamp, self.statistics.timestamp())
+
+        # Statistics that can't be understood are ignored.
+        timestamp.achievements = json.dumps(dict(foo="bar"))
+        eq_(None, self.statistics.load())
+        eq_(None, self.statistics.get()["computed_at"])
@@ -64,6 +64,71 @@ class TestSIP2AuthenticationProvider(DatabaseTest):
         provider = p(self._default_library, integration)
         eq_(1234, provider.port)
 
+    def test_make_client(self):
+        p = SIP2AuthenticationProvider
+        integration = self._external_integration(self._str)
+        integration.url = "server.com"
+        integration.setting(p.PORT).value = "1234"
+        integration.setting(p.USE_SSL).value = "true"
+        provider = p(self._default_library, integration)
+
+        # The connection pool gets its clients from make_client.
+        eq_(provider.make_client, provider.pool.client_factory)
+
+        # A provider rebuilt from the same configuration uses the same
+        # connection pool.
+        provider2 = p(self._default_library, integration)
+        eq_(provider.pool, provider2.pool)
+        eq_(provider2.make_client, provider.pool.client_factory)
+
+        # Once the configuration changes, the old pool is closed.
+        integration.setting(p.PORT).value = "5678"
+        provider3 = p(self._default_library, integration)
+        assert provider3.pool != provider.pool
+        eq_(True, provider.pool.closed)
+        integration.setting(p.PORT).value = "1234"
+
+        # Each client is configured from the integration...
+        client1 = provider.make_client()
+        client2 = provider.make_client()
+        assert client1 != client2
+        eq_("server.com", client1.target_server)
+        eq_(1234, client1.target_port)
+        eq_(True, client1.use_ssl)
+
+        # ...and they share an SSLContext, which only needs to be
+        # built once.
+        assert client1.ssl_context is not None
+        assert client1.ssl_context is client2.ssl_context
+
+        # If a client was passed into the constructor, it's used
+        # instead.
+        client = MockSIPClient()
+        provider = p(self._default_library, integration, client=client)
+        eq_(client, provider.make_client())
+
+    def test_connection_is_reused(self):
+        # The SIP server connection is kept open between requests.
+        class Mock(MockSIPClient):
+            connected = False
+            def connect(self):
+                super(Mock, self).connect()
+                self.connected = True
+            def connection_is_healthy(self):
+                return self.connected
+
+        integration = self._external_integration(self._str)
+        client = Mock()
+        auth = SIP2AuthenticationProvider(
+            self._default_library, integration, client=client
+        )
+        client.queue_response(self.sierra_valid_login)
+        client.queue_response(self.sierra_valid_login)
+        auth.remote_authenticate("user", "pass")
+        auth.remote_authenticate("user", "pass")
+        eq_(["Creating new socket connection."], client.status)
+        eq_(2, len(client.requests))
+
     def test_remote_authenticate(self):
         integration = self._external_integration(self._str)
         client = MockSIPClient()
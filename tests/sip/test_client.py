@@ -8,9 +8,12 @@ from nose.tools import (
 import os
 import socket
 import ssl
+import time
 from api.sip.client import (
     MockSIPClient,
     SIPClient,
+    SIPClientPool,
+    SIPMessageReader,
 )
 
 class MockSocket(object):
@@ -26,12 +29,26 @@ class MockSocket(object):
     def settimeout(self, value):
         self.timeout = value
 
-class MockWrapSocket(object):
-    def __init__(self):
-        self.called_with = None
+    def close(self):
+        pass
 
-    def __call__(self, connection, **kwargs):
-        self.called_with = (connection, kwargs)
+class MockSSLContext(object):
+    """Stands in for ssl.SSLContext."""
+    instances = []
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.loaded = None
+        self.wrapped = []
+        self.instances.append(self)
+
+    def load_cert_chain(self, certfile, keyfile=None):
+        self.loaded = dict(certfile=certfile, keyfile=keyfile)
+        # The temporary files exist while the certificate is loaded.
+        self.contents = [open(x).read() for x in (certfile, keyfile)]
+
+    def wrap_socket(self, connection):
+        self.wrapped.append(connection)
         return connection
 
 
@@ -70,46 +87,355 @@ class TestSIPClient(object):
         old_socket = socket.socket
         socket.socket = MockSocket
 
-        # Mock the ssl.wrap_socket function
-        old_wrap_socket = ssl.wrap_socket
-        wrap_socket = MockWrapSocket()
-        ssl.wrap_socket = wrap_socket
+        # Mock the ssl.SSLContext class.
+        old_ssl_context = ssl.SSLContext
+        ssl.SSLContext = MockSSLContext
+        MockSSLContext.instances = []
 
         try:
-            # When an insecure connection is created, wrap_socket is
-            # not called.
+            # When an insecure connection is created, no SSLContext
+            # is created.
             insecure.connect()
-            eq_(None, wrap_socket.called_with)
+            eq_([], MockSSLContext.instances)
 
             # When a secure connection is created with no SSL
-            # certificate, wrap_socket() is called on the connection
-            # (in this case, a MockSocket), but no other arguments are
-            # passed in to wrap_socket().
+            # certificate, an SSLContext is created with no
+            # certificate, and used to wrap the connection (in this
+            # case, a MockSocket).
             no_cert.connect()
-            connection, kwargs = wrap_socket.called_with
+            [context] = MockSSLContext.instances
+            eq_(None, context.loaded)
+            [connection] = context.wrapped
             assert isinstance(connection, MockSocket)
-            eq_(dict(keyfile=None, certfile=None), kwargs)
 
             # When a secure connection is created with an SSL
             # certificate, the certificate and key are written to
-            # temporary files, and the paths to those files are passed
-            # in along with the collection to wrap_socket().
-            wrap_socket.called_with = None
+            # temporary files so they can be loaded into the
+            # SSLContext.
             with_cert.connect()
-            connection, kwargs = wrap_socket.called_with
-            assert isinstance(connection, MockSocket)
-            eq_(set(['keyfile', 'certfile']), set(kwargs.keys()))
-            for tmpfile in kwargs.values():
+            context = MockSSLContext.instances[-1]
+            eq_(["cert", "key"], context.contents)
+            for tmpfile in context.loaded.values():
                 assert tmpfile.startswith("/tmp")
-                # By the time the SSL socket has been wrapped, the
-                # temporary file has already been removed.  Because of
-                # that we can't verify from within a unit testthat the
-                # correct contents were written to the file.
+                # By the time the SSLContext has been created, the
+                # temporary file has already been removed.
                 assert not os.path.exists(tmpfile)
+            [connection] = context.wrapped
+            assert isinstance(connection, MockSocket)
+
+            # Connecting again reuses the SSLContext rather than
+            # loading the certificate again.
+            with_cert.connect()
+            eq_(2, len(MockSSLContext.instances))
+            eq_(2, len(context.wrapped))
+
+            # An SSLContext can also be passed in to the constructor.
+            shared = MockSSLContext(None)
+            client = SIPClient(
+                target_server, 999, use_ssl=True, ssl_context=shared
+            )
+            client.connect()
+            eq_(1, len(shared.wrapped))
         finally:
             # Un-mock the old functions.
             socket.socket = old_socket
-            ssl.wrap_socket = old_wrap_socket
+            ssl.SSLContext = old_ssl_context
+
+    def test_connection_is_healthy(self):
+        # A client that isn't connected can't be used.
+        sip = SIPClient("server", 999)
+        eq_(False, sip.connection_is_healthy())
+
+        # A connection with nothing to read is healthy.
+        a, b = socket.socketpair()
+        sip.connection = a
+        eq_(True, sip.connection_is_healthy())
+
+        # A connection with unread data is not.
+        b.send("unexpected")
+        eq_(False, sip.connection_is_healthy())
+
+        # Neither is a connection the other side has closed.
+        a2, b2 = socket.socketpair()
+        sip.connection = a2
+        b2.close()
+        eq_(False, sip.connection_is_healthy())
+        for s in a, b, a2:
+            s.close()
+
+
+class PooledMockSIPClient(MockSIPClient):
+    """A MockSIPClient that tracks its own connection state."""
+
+    def __init__(self, *args, **kwargs):
+        super(PooledMockSIPClient, self).__init__(*args, **kwargs)
+        self.connected = False
+        self.healthy = True
+
+    def connect(self):
+        super(PooledMockSIPClient, self).connect()
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def connection_is_healthy(self):
+        return self.connected and self.healthy
+
+
+class TestSIPMessageReader(object):
+
+    def setup(self):
+        self.chunks = []
+        self.recv_calls = []
+        self.reader = SIPMessageReader(self.recv)
+
+    def recv(self, size, timeout):
+        self.recv_calls.append((size, timeout))
+        if not self.chunks:
+            return ""
+        return self.chunks.pop(0)
+
+    def test_message_split_across_chunks(self):
+        self.chunks = ["941", "AY0", "AZ1234\r"]
+        eq_("941AY0AZ1234", self.reader.read_message())
+        eq_(3, len(self.recv_calls))
+        eq_(0, len(self.reader))
+
+    def test_leftover_bytes_are_kept(self):
+        # Two messages, and the start of a third, arrive at once.
+        self.chunks = ["first\r\nsecond\rthi", "rd\r"]
+        eq_("first", self.reader.read_message())
+        eq_(1, len(self.recv_calls))
+
+        # The second message is already in the buffer; no need to
+        # receive anything.
+        eq_("second", self.reader.read_message())
+        eq_(1, len(self.recv_calls))
+
+        eq_("third", self.reader.read_message())
+        eq_(2, len(self.recv_calls))
+
+    def test_line_feed_is_not_a_terminator(self):
+        # A \n on its own doesn't end a message; only \r does.
+        self.chunks = ["AFline one\nline two|\r", "\n941\r"]
+        eq_("AFline one\nline two|", self.reader.read_message())
+
+        # The \n after a \r is dropped rather than being taken as
+        # the start of the next message.
+        eq_("941", self.reader.read_message())
+
+    def test_only_new_bytes_are_scanned(self):
+        self.reader.feed("abc")
+        eq_(None, self.reader.next_message())
+        eq_(3, self.reader.scanned)
+        self.reader.feed("de\rf")
+        eq_("abcde", self.reader.next_message())
+        eq_(0, self.reader.scanned)
+        eq_("f", str(self.reader.buffer))
+
+    def test_connection_closed(self):
+        self.chunks = ["incomplete"]
+        assert_raises(IOError, self.reader.read_message)
+
+    def test_message_too_large(self):
+        self.chunks = ["x" * 10, "x" * 10]
+        assert_raises(IOError, self.reader.read_message, max_size=15)
+
+        self.reader.clear()
+        self.chunks = ["x" * 20 + "\r"]
+        assert_raises(IOError, self.reader.read_message, max_size=15)
+
+    def test_deadline(self):
+        # The time remaining before the deadline is passed into recv().
+        self.chunks = ["message\r"]
+        deadline = time.time() + 100
+        self.reader.read_message(deadline=deadline)
+        [(size, timeout)] = self.recv_calls
+        eq_(SIPMessageReader.CHUNK_SIZE, size)
+        assert 99 < timeout <= 100
+
+        # Once the deadline has passed, we stop waiting for the
+        # rest of the message.
+        self.chunks = ["partial"]
+        assert_raises(
+            IOError, self.reader.read_message, deadline=time.time() - 1
+        )
+
+    def test_client_reads_from_socket(self):
+        a, b = socket.socketpair()
+        sip = SIPClient("server", 999)
+        sip.connection = a
+        a.settimeout(5)
+        b.send("941AY0AZ1234\r981AY1AZ5678\r")
+        eq_("941AY0AZ1234", sip.read_message())
+        eq_("981AY1AZ5678", sip.read_message())
+
+        # Reading a message doesn't change the socket's timeout.
+        eq_(5, a.gettimeout())
+
+        # When the connection is reset, leftover data is discarded.
+        b.send("unexpected\r")
+        sip.reader.feed("leftover")
+        eq_(False, sip.connection_is_healthy())
+        sip.reset_connection_state()
+        eq_(0, len(sip.reader))
+        a.close()
+        b.close()
+
+    def test_mock_client_uses_reader(self):
+        sip = MockSIPClient()
+        sip.queue_response("941")
+        sip.queue_response("981")
+        eq_("941", sip.read_message())
+        eq_("981", sip.read_message())
+        eq_(0, len(sip.reader))
+
+
+class TestSIPClientPool(object):
+
+    def setup(self):
+        self.clients = []
+        def factory():
+            client = PooledMockSIPClient(
+                login_user_id="user_id", login_password="password"
+            )
+            client.queue_response(self.login_ok)
+            self.clients.append(client)
+            return client
+        self.pool = SIPClientPool(factory)
+
+    def request(self, sip):
+        sip.queue_response(self.patron_info)
+        return sip.patron_information("patron")
+
+    patron_info = "64              000201610210000142637000000000000000000000000AOnypl |AA12345|AESHELDON, ALICE|BZ0030|CA0050|CB0050|BLY|CQY|BV0|CC15.00|BEfoo@example.com|AY1AZD1B7"
+    login_ok = "941"
+
+    def test_connection_is_reused(self):
+        # The first request creates a new connection and logs in.
+        eq_("first", self.pool.run(lambda sip: "first"))
+        [client] = self.clients
+        eq_(1, len(client.requests))
+        assert client.requests[0].startswith("93")
+
+        # The second request reuses the logged-in connection.
+        info = self.pool.run(self.request)
+        eq_("12345", info['patron_identifier'])
+        eq_([client], self.clients)
+        eq_(2, len(client.requests))
+        assert client.requests[1].startswith("63")
+
+        # Requests on the same connection get consecutive sequence
+        # numbers.
+        assert "AY0AZ" in client.requests[0]
+        assert "AY1AZ" in client.requests[1]
+
+    def test_unhealthy_connection_is_replaced(self):
+        self.pool.run(lambda sip: None)
+        [old] = self.clients
+        old.healthy = False
+
+        self.pool.run(lambda sip: None)
+        eq_(2, len(self.clients))
+        eq_(False, old.connected)
+        eq_(True, self.clients[1].connected)
+
+    def test_idle_connection_is_replaced(self):
+        self.pool.max_idle_time = 0
+        self.pool.run(lambda sip: None)
+        [old] = self.clients
+        # Make the connection look like it's been idle for a while.
+        [(client, last_used)] = self.pool._idle
+        self.pool._idle = [(client, last_used - 1)]
+
+        self.pool.run(lambda sip: None)
+        eq_(2, len(self.clients))
+        eq_(False, old.connected)
+
+    def test_ioerror_on_reused_connection_is_retried(self):
+        self.pool.run(lambda sip: None)
+        attempts = []
+        def request(sip):
+            attempts.append(sip)
+            if len(attempts) == 1:
+                raise IOError("Connection reset by peer")
+            return "ok"
+        eq_("ok", self.pool.run(request))
+        old, new = self.clients
+        eq_([old, new], attempts)
+        eq_(False, old.connected)
+
+        # The new connection went back into the pool.
+        eq_([new], [client for client, last_used in self.pool._idle])
+
+    def test_ioerror_on_new_connection_is_raised(self):
+        def request(sip):
+            raise IOError("Doom!")
+        assert_raises(IOError, self.pool.run, request)
+        [client] = self.clients
+        eq_(False, client.connected)
+        eq_([], self.pool._idle)
+
+    def test_other_errors_discard_connection(self):
+        self.pool.run(lambda sip: None)
+        def request(sip):
+            raise ValueError("Bad response")
+        assert_raises(ValueError, self.pool.run, request)
+        [client] = self.clients
+        eq_(False, client.connected)
+        eq_([], self.pool._idle)
+
+    def test_close(self):
+        self.pool.run(lambda sip: None)
+        self.pool.close()
+        [client] = self.clients
+        eq_(False, client.connected)
+        eq_([], self.pool._idle)
+
+        # A connection that was in use when the pool was closed is
+        # closed when it's checked in.
+        eq_(True, self.pool.closed)
+        self.pool.run(lambda sip: None)
+        old, new = self.clients
+        eq_(False, new.connected)
+        eq_([], self.pool._idle)
+
+    def test_acquire_timeout(self):
+        self.pool.max_size = 1
+        self.pool.acquire_timeout = 0.01
+
+        # If every connection is in use, we don't wait forever for
+        # one to become available.
+        self.pool.acquire()
+        assert_raises(IOError, self.pool.run, lambda sip: None)
+        eq_([], self.clients)
+
+        self.pool.release()
+        eq_("ok", self.pool.run(lambda sip: "ok"))
+        eq_(0, self.pool._in_use)
+
+    def test_shared(self):
+        def factory():
+            pass
+        def factory2():
+            pass
+        key = object()
+        pool = SIPClientPool.shared(key, ("server", 1234), factory)
+
+        # The same settings get the same pool, but the most recent
+        # factory is used.
+        eq_(pool, SIPClientPool.shared(key, ("server", 1234), factory2))
+        eq_(factory2, pool.client_factory)
+        eq_(False, pool.closed)
+
+        # Different settings get a new pool, and the old one is closed.
+        pool2 = SIPClientPool.shared(key, ("server", 5678), factory)
+        assert pool2 != pool
+        eq_(True, pool.closed)
+        eq_(False, pool2.closed)
+        del SIPClientPool._shared[key]
+
 
 class TestBasicProtocol(object):
 
@@ -2387,6 +2387,160 @@ class TestBasicAuthenticationProviderAuthenticate(AuthenticatorTest):
     # appear no different to us than a patron who has never used the
     # circulation manager before.
 
+    def _caching_provider(self, **kwargs):
+        """Create a MockBasic that remembers credentials, and that counts
+        calls to remote_authenticate().
+        """
+        class Counting(MockBasic):
+            calls = 0
+            def remote_authenticate(self, username, password):
+                self.calls += 1
+                return self.patrondata
+
+        integration = self._external_integration(
+            self._str, ExternalIntegration.PATRON_AUTH_GOAL
+        )
+        integration.setting(
+            BasicAuthenticationProvider.CREDENTIAL_CACHE_TIME
+        ).value = 600
+        return Counting(self._default_library, integration, **kwargs)
+
+    def test_credential_cache_off_by_default(self):
+        provider = self.mock_basic()
+        eq_(None, provider.credential_cache_key("user", "pass"))
+        provider.cache_remote_authenticate(None, PatronData())
+        eq_(0, len(provider.credential_cache))
+
+    def test_credential_cache_key(self):
+        provider = self._caching_provider()
+        key = provider.credential_cache_key("user", "pass")
+
+        # The key is consistent but reveals nothing about the
+        # credentials.
+        eq_(key, provider.credential_cache_key("user", "pass"))
+        assert "pass" not in key
+        assert key != provider.credential_cache_key("user", "pass2")
+        assert key != provider.credential_cache_key("user2", "pass")
+
+        # Another provider uses a different salt.
+        other = self._caching_provider()
+        assert key != other.credential_cache_key("user", "pass")
+
+    def test_credential_cache_skips_remote_authenticate(self):
+        patron = self._patron()
+        patrondata = PatronData(permanent_id=patron.external_identifier)
+        provider = self._caching_provider(patrondata=patrondata)
+
+        eq_(patron, provider.authenticate(self._db, self.credentials))
+        eq_(1, provider.calls)
+
+        # The second time, the source of truth isn't consulted, but
+        # the patron is still looked up in the database.
+        eq_(patron, provider.authenticate(self._db, self.credentials))
+        eq_(1, provider.calls)
+
+        # Different credentials are checked with the source of truth.
+        eq_(patron, provider.authenticate(
+            self._db, dict(username="user", password="other")
+        ))
+        eq_(2, provider.calls)
+
+    def test_credential_cache_holds_no_account_information(self):
+        patron = self._patron()
+        patrondata = PatronData(
+            permanent_id=patron.external_identifier,
+            authorization_identifier=patron.authorization_identifier,
+            external_type=u"a",
+        )
+        provider = self._caching_provider(patrondata=patrondata)
+        eq_(patron, provider.authenticate(self._db, self.credentials))
+        eq_(u"a", patron.external_type)
+        synced = patron.last_external_sync
+
+        # Only the patron's identifiers are remembered.
+        key = provider.credential_cache_key(
+            self.credentials['username'], self.credentials['password']
+        )
+        eq_(dict(permanent_id=patron.external_identifier,
+                 authorization_identifier=[patron.authorization_identifier],
+                 username=None, library_identifier=None),
+            provider.credential_cache.get(key))
+
+        # The patron's account has changed since then. A cache hit
+        # doesn't overwrite the new information with the old, or
+        # pretend the patron was just synced.
+        patron.external_type = u"b"
+        eq_(patron, provider.authenticate(self._db, self.credentials))
+        eq_(1, provider.calls)
+        eq_(u"b", patron.external_type)
+        eq_(synced, patron.last_external_sync)
+
+        # Once the patron needs an external sync, their account is
+        # looked up, even though their credentials are remembered.
+        patron.last_external_sync = None
+        provider.remote_patron_lookup_patrondata = PatronData(
+            permanent_id=patron.external_identifier, external_type=u"c",
+        )
+        eq_(patron, provider.authenticate(self._db, self.credentials))
+        eq_(1, provider.calls)
+        eq_(u"c", patron.external_type)
+        assert patron.last_external_sync is not None
+
+        # A Patron object is never remembered.
+        provider.credential_cache.clear()
+        provider.patrondata = patron
+        provider.cache_remote_authenticate(key, patron)
+        eq_(0, len(provider.credential_cache))
+
+    def test_credential_cache_remembers_invalid_credentials(self):
+        provider = self._caching_provider(patrondata=None)
+        eq_(None, provider.authenticate(self._db, self.credentials))
+        eq_(None, provider.authenticate(self._db, self.credentials))
+        eq_(1, provider.calls)
+
+        # Unless negative caching is turned off.
+        provider = self._caching_provider(patrondata=None)
+        provider.negative_credential_cache_time = 0
+        eq_(None, provider.authenticate(self._db, self.credentials))
+        eq_(None, provider.authenticate(self._db, self.credentials))
+        eq_(2, provider.calls)
+
+    def test_credential_cache_ignores_errors(self):
+        provider = self._caching_provider(
+            patrondata=UNSUPPORTED_AUTHENTICATION_MECHANISM
+        )
+        provider.authenticate(self._db, self.credentials)
+        provider.authenticate(self._db, self.credentials)
+        eq_(2, provider.calls)
+
+    def test_credential_cache_forgets_blocked_patron(self):
+        patron = self._patron()
+        patrondata = PatronData(
+            permanent_id=patron.external_identifier,
+            block_reason=PatronData.EXCESSIVE_FINES,
+        )
+        provider = self._caching_provider(patrondata=patrondata)
+
+        # A blocked patron is never cached, so they're checked with
+        # the source of truth every time.
+        provider.authenticate(self._db, self.credentials)
+        provider.authenticate(self._db, self.credentials)
+        eq_(2, provider.calls)
+
+        # If a patron with a cached verdict turns out to be blocked,
+        # the cached verdict is thrown away.
+        patrondata.block_reason = None
+        provider.authenticate(self._db, self.credentials)
+        eq_(3, provider.calls)
+        key = provider.credential_cache_key(
+            self.credentials['username'], self.credentials['password']
+        )
+        assert provider.credential_cache.get(key) is not None
+
+        patron.block_reason = PatronData.EXCESSIVE_FINES
+        provider.forget_credentials_if_blocked(key, patron)
+        eq_(None, provider.credential_cache.get(key))
+
 class TestOAuthAuthenticationProvider(AuthenticatorTest):
 
     def test_from_config(self):
@@ -687,6 +687,63 @@ class TestCirculationMonitor(Axis360Test):
         # Now we have information based on the CirculationData.
         eq_(9, licensepool.licenses_owned)
 
+    def test_process_batch(self):
+        monitor = Axis360CirculationMonitor(
+            self._db, self.collection, api_class=MockAxis360API,
+        )
+        book = (self.BIBLIOGRAPHIC_DATA, self.AVAILABILITY_DATA)
+        key = (Identifier.AXIS_360_ID, u'0003642860')
+
+        # Nothing exists for this book yet.
+        eq_({}, monitor.find_existing([book]))
+        eq_({}, monitor.find_existing([]))
+
+        [(edition, license_pool)] = monitor.process_batch([book])
+        eq_(True, license_pool.work.presentation_ready)
+
+        # Now the LicensePool and Edition can be found.
+        eq_({key: (license_pool, edition)}, monitor.find_existing([book]))
+
+        # When they already exist, process_batch uses them instead of
+        # looking them up one at a time.
+        def explode(*args, **kwargs):
+            raise Exception("Shouldn't be called.")
+
+        bibliographic = Metadata(
+            DataSource.AXIS_360,
+            primary_identifier=self.BIBLIOGRAPHIC_DATA.primary_identifier
+        )
+        bibliographic.edition = explode
+        availability = CirculationData(
+            data_source=DataSource.AXIS_360,
+            primary_identifier=self.BIBLIOGRAPHIC_DATA.primary_identifier,
+            licenses_owned=10,
+        )
+        availability.license_pool = explode
+        eq_([(edition, license_pool)],
+            monitor.process_batch([(bibliographic, availability)]))
+        eq_(10, license_pool.licenses_owned)
+
+    def test_run_once(self):
+        class Mock(Axis360CirculationMonitor):
+            def process_batch(self, books, analytics=None, policy=None):
+                self.batches.append((books, analytics, policy))
+
+        monitor = Mock(self._db, self.collection, api_class=MockAxis360API)
+        monitor.batches = []
+        monitor.batch_size = 2
+        monitor.api.recent_activity = lambda since: ["a", "b", "c"]
+        monitor.run_once(datetime.datetime.utcnow(), None)
+
+        # The books were processed in batches, all of them with the
+        # same Analytics and ReplacementPolicy.
+        eq_([["a", "b"], ["c"]], [x[0] for x in monitor.batches])
+        eq_(1, len(set(x[1] for x in monitor.batches)))
+        eq_(1, len(set(x[2] for x in monitor.batches)))
+        analytics, policy = monitor.batches[0][1:]
+        assert isinstance(analytics, Analytics)
+        eq_(analytics, policy.analytics)
+
 
 class TestReaper(Axis360Test):
 
@@ -1020,6 +1020,79 @@ class TestBibliothecaEventMonitor(BibliothecaAPITest):
         new_timestamp = monitor.run_once(yesterday, yesterday)
         eq_(new_timestamp, yesterday)
 
+    def test_parse_command_line(self):
+        m = BibliothecaEventMonitor.parse_command_line
+        eq_(dict(cli_date=None, concurrency=1, slice_size=24), m([]))
+        eq_(dict(cli_date="2011-01-01", concurrency=8, slice_size=6),
+            m(["2011-01-01", "--concurrency=8", "--slice-size=6"]))
+
+        monitor = BibliothecaEventMonitor(
+            self._db, self.collection, api_class=MockBibliothecaAPI,
+            **m(["--concurrency=8", "--slice-size=6"])
+        )
+        eq_(8, monitor.concurrency)
+        eq_(timedelta(hours=6), monitor.slice_size)
+
+    def test_run_once_concurrently(self):
+        start = datetime(2011, 1, 1)
+        cutoff = start + timedelta(days=5, hours=12)
+
+        class MockAPI(MockBibliothecaAPI):
+            def get_events_between(self, start, cutoff, cache_result=False):
+                self.requested.append((start, cutoff, cache_result))
+                if start in self.fail_at:
+                    raise Exception("Doom!")
+                # One event for each slice of time.
+                return [("id", "isbn", None, start, None, "event")]
+
+        class Mock(BibliothecaEventMonitor):
+            def handle_event(self, *event):
+                self.handled.append(event[3])
+                return event[3]
+
+        api = MockAPI(self._db, self.collection)
+        api.requested = []
+        api.fail_at = []
+        monitor = Mock(
+            self._db, self.collection, api_class=api, concurrency=3
+        )
+        monitor.handled = []
+        monitor.run_once(start, cutoff)
+
+        # Every day's events were requested, without caching the
+        # responses as Representations.
+        days = [start + timedelta(days=x) for x in range(6)]
+        eq_(days, sorted(x[0] for x in api.requested))
+        eq_(set([False]), set(x[2] for x in api.requested))
+
+        # Although events were retrieved concurrently, they were
+        # handled in order.
+        eq_(days, monitor.handled)
+
+        # Progress was recorded after each full day. The last slice of
+        # time was only half a day, so the timestamp stops before it.
+        eq_(days[-1], monitor.timestamp().finish)
+
+        # If something goes wrong, the monitor's progress up to that
+        # point is kept.
+        api.requested = []
+        api.fail_at = [days[3]]
+        monitor.handled = []
+        monitor.timestamp().finish = None
+        assert_raises_regexp(
+            Exception, "Doom!", monitor.run_once, start, cutoff
+        )
+        eq_(days[:3], monitor.handled)
+        eq_(days[3], monitor.timestamp().finish)
+
+        # The monitor can also be told to use a different slice size.
+        api.requested = []
+        api.fail_at = []
+        monitor.slice_size = timedelta(hours=12)
+        monitor.run_once(start, start + timedelta(days=1))
+        eq_([start, start + timedelta(hours=12)],
+            sorted(x[0] for x in api.requested))
+
 
     def test_handle_event(self):
         api = MockBibliothecaAPI(self._db, self.collection)
@@ -0,0 +1,49 @@
+from nose.tools import (
+    set_trace,
+    eq_,
+)
+
+from api.util.cache import LRUCache
+
+
+class TestLRUCache(object):
+
+    def test_get_and_set(self):
+        cache = LRUCache()
+        eq_(None, cache.get("key"))
+        eq_("default", cache.get("key", "default"))
+
+        cache.set("key", "value")
+        eq_("value", cache.get("key"))
+
+        cache.delete("key")
+        eq_(None, cache.get("key"))
+
+        # Deleting a nonexistent key is not an error.
+        cache.delete("key")
+
+    def test_expiration(self):
+        cache = LRUCache()
+        cache.set("key", "value", ttl=-1)
+        eq_(None, cache.get("key"))
+
+        # An expired item is cleared out when someone tries to get it.
+        eq_(0, len(cache))
+
+        cache.set("key", "value", ttl=60)
+        eq_("value", cache.get("key"))
+
+    def test_capacity(self):
+        cache = LRUCache(capacity=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        # Looking up 'a' makes it the most recently used item.
+        eq_(1, cache.get("a"))
+
+        # So when there's no more room, 'b' is the one discarded.
+        cache.set("c", 3)
+        eq_(2, len(cache))
+        eq_(1, cache.get("a"))
+        eq_(None, cache.get("b"))
+        eq_(3, cache.get("c"))
@@ -11,10 +11,15 @@ from api.config import (
     temp_config,
 )
 
+from multiprocessing import TimeoutError
 from datetime import (
     datetime,
     timedelta,
 )
+import logging
+import time
+from threading import Event
+from sqlalchemy import event
 
 from api.circulation_exceptions import *
 from api.circulation import (
@@ -26,6 +31,10 @@ from api.circulation import (
     FulfillmentInfo,
     LoanInfo,
     HoldInfo,
+    PatronActivityCache,
+    PatronActivityDeadline,
+    PatronActivityPool,
+    PatronActivityTask,
 )
 
 from core.config import CannotLoadConfiguration
@@ -833,6 +842,197 @@ class TestCirculationAPI(DatabaseTest):
         eq_(self.IN_TWO_WEEKS, hold.end)
         eq_(0, hold.position)
 
+    def test_sync_bookshelf_creates_many_loans_and_holds(self):
+        # The remote knows about a number of loans and holds that we
+        # don't know about.
+        loan_pools = [self._licensepool(None, collection=self.collection)
+                      for i in range(3)]
+        hold_pools = [self._licensepool(None, collection=self.collection)
+                      for i in range(3)]
+        for pool in loan_pools:
+            self.circulation.add_remote_loan(
+                pool.collection, pool.data_source.name, pool.identifier.type,
+                pool.identifier.identifier, self.TODAY, self.IN_TWO_WEEKS
+            )
+        for i, pool in enumerate(hold_pools):
+            self.circulation.add_remote_hold(
+                pool.collection, pool.data_source.name, pool.identifier.type,
+                pool.identifier.identifier, self.TODAY, self.IN_TWO_WEEKS, i
+            )
+
+        # We also have a local hold that the remote doesn't know about.
+        stale_hold, ignore = self.pool.on_hold_to(self.patron)
+
+        loans, holds = self.sync_bookshelf()
+
+        # Local loans and holds were created, in the order the remote
+        # API reported them.
+        eq_(loan_pools, [x.license_pool for x in loans])
+        eq_(hold_pools, [x.license_pool for x in holds])
+        for loan in loans:
+            eq_(self.patron, loan.patron)
+            eq_(self.TODAY, loan.start)
+            eq_(self.IN_TWO_WEEKS, loan.end)
+        eq_([0, 1, 2], [x.position for x in holds])
+
+        # The stale hold is gone.
+        eq_(set(loans), set(self.patron.loans))
+        eq_(set(holds), set(self.patron.holds))
+        eq_(set(holds), set(self._db.query(Hold)))
+
+        # Syncing again doesn't change anything.
+        loans2, holds2 = self.sync_bookshelf()
+        eq_(loans, loans2)
+        eq_(holds, holds2)
+
+    def test_sync_bookshelf_creates_same_rows_as_loan_to_and_on_hold_to(self):
+        # sync_bookshelf creates Loans and Holds with bulk INSERTs
+        # instead of calling LicensePool.loan_to and
+        # LicensePool.on_hold_to, but the rows should be the same.
+        pools = [self._licensepool(None, collection=self.collection)
+                 for i in range(4)]
+        loan_infos = [
+            (pools[0], self.TODAY, self.IN_TWO_WEEKS),
+            (pools[1], None, None),
+        ]
+        hold_infos = [
+            (pools[2], self.TODAY, self.IN_TWO_WEEKS, 3),
+            (pools[3], None, None, None),
+        ]
+        for pool, start, end in loan_infos:
+            self.circulation.add_remote_loan(
+                pool.collection, pool.data_source.name, pool.identifier.type,
+                pool.identifier.identifier, start, end
+            )
+        for pool, start, end, position in hold_infos:
+            self.circulation.add_remote_hold(
+                pool.collection, pool.data_source.name, pool.identifier.type,
+                pool.identifier.identifier, start, end, position
+            )
+        loans, holds = self.sync_bookshelf()
+
+        other_patron = self._patron()
+        expect_loans = [
+            pool.loan_to(other_patron, start, end)[0]
+            for pool, start, end in loan_infos
+        ]
+        expect_holds = [
+            pool.on_hold_to(other_patron, start, end, position)[0]
+            for pool, start, end, position in hold_infos
+        ]
+
+        # Reload everything from the database.
+        self._db.flush()
+        self._db.expire_all()
+
+        def columns(obj):
+            values = dict(
+                (c.name, getattr(obj, c.name))
+                for c in obj.__table__.columns
+                if c.name not in ('id', 'patron_id')
+            )
+            # When the remote doesn't say when a loan or hold
+            # started, it started when the row was created.
+            start = values.pop('start')
+            return values, start
+
+        for actual, expect in zip(loans + holds, expect_loans + expect_holds):
+            actual_values, actual_start = columns(actual)
+            expect_values, expect_start = columns(expect)
+            eq_(expect_values, actual_values)
+            assert abs(actual_start - expect_start) < timedelta(minutes=1)
+        eq_(self.TODAY, loans[0].start)
+        eq_(self.TODAY, holds[0].start)
+
+    def test_sync_bookshelf_query_count_does_not_depend_on_bookshelf_size(self):
+        class Circulation(MockCirculationAPI):
+            # Use the real queries for the patron's local loans and
+            # holds, rather than the mock's simpler ones.
+            def local_loans(self, patron):
+                return CirculationAPI.local_loans(self, patron)
+
+            def local_holds(self, patron):
+                return CirculationAPI.local_holds(self, patron)
+
+        def statements_for_sync(size):
+            # The remote knows about `size` loans and holds we don't,
+            # and we have `size` loans and holds it doesn't know about.
+            patron = self._patron()
+            circulation = Circulation(
+                self._db, self._default_library,
+                api_map={ExternalIntegration.BIBLIOTHECA : MockBibliothecaAPI}
+            )
+            for i in range(size):
+                pool = self._licensepool(None, collection=self.collection)
+                circulation.add_remote_loan(
+                    pool.collection, pool.data_source.name,
+                    pool.identifier.type, pool.identifier.identifier,
+                    self.TODAY, self.IN_TWO_WEEKS
+                )
+                pool = self._licensepool(None, collection=self.collection)
+                circulation.add_remote_hold(
+                    pool.collection, pool.data_source.name,
+                    pool.identifier.type, pool.identifier.identifier,
+                    self.TODAY, self.IN_TWO_WEEKS, i
+                )
+                pool = self._licensepool(None, collection=self.collection)
+                pool.loan_to(patron, start=self.YESTERDAY)
+                pool = self._licensepool(None, collection=self.collection)
+                pool.on_hold_to(patron)
+
+            # Start the sync with nothing loaded, as a new request
+            # would.
+            self._db.flush()
+            self._db.expire_all()
+
+            statements = []
+            def record(conn, cursor, statement, parameters, context,
+                       executemany):
+                statements.append(statement)
+            connection = self._db.connection()
+            event.listen(connection, 'before_cursor_execute', record)
+            try:
+                loans, holds = circulation.sync_bookshelf(patron, '1234')
+            finally:
+                event.remove(connection, 'before_cursor_execute', record)
+
+            # The new loans and holds were created and the stale ones
+            # were deleted.
+            eq_(size, len(loans))
+            eq_(size, len(holds))
+            eq_(set(loans), set(patron.loans))
+            eq_(set(holds), set(patron.holds))
+            return statements
+
+        small = statements_for_sync(1)
+        large = statements_for_sync(5)
+        eq_(len(small), len(large))
+
+    def test_license_pools_for(self):
+        pool2 = self._licensepool(None, collection=self.collection)
+        infos = [
+            LoanInfo(pool.collection, pool.data_source.name,
+                     pool.identifier.type, pool.identifier.identifier,
+                     None, None)
+            for pool in (self.pool, pool2)
+        ]
+
+        # This LoanInfo is for a book we've never heard of.
+        infos.append(
+            LoanInfo(self.collection, DataSource.BIBLIOTHECA,
+                     Identifier.BIBLIOTHECA_ID, "new book", None, None)
+        )
+        pools = self.circulation.license_pools_for(infos)
+        eq_(3, len(pools))
+        key = lambda x: (x.collection_id, x.identifier_type, x.identifier)
+        eq_(self.pool, pools[key(infos[0])])
+        eq_(pool2, pools[key(infos[1])])
+
+        # A LicensePool was created for the new book.
+        new_pool = pools[key(infos[2])]
+        eq_("new book", new_pool.identifier.identifier)
+        eq_(self.collection, new_pool.collection)
+
     def test_sync_bookshelf_applies_locked_delivery_mechanism_to_loan(self):
 
         # By the time we hear about the patron's loan, they've already
@@ -884,6 +1084,286 @@ class TestCirculationAPI(DatabaseTest):
         eq_(0, len(holds))
         eq_(False, complete)
 
+    def test_patron_activity_deadline(self):
+        # A remote API that takes too long to answer is abandoned,
+        # and the result is marked incomplete.
+        release = Event()
+        class Slow(BaseCirculationAPI):
+            def patron_activity(self, patron, pin):
+                release.wait()
+                return []
+
+        class Fast(BaseCirculationAPI):
+            def patron_activity(self, patron, pin):
+                return [HoldInfo(collection, None, "type", "id", None, None, 1)]
+
+        collection = self.collection
+        pool = PatronActivityPool(size=2)
+        try:
+            circulation = CirculationAPI(
+                self._db, self._default_library, patron_activity_pool=pool
+            )
+            circulation.api_for_collection = {1: Slow(), 2: Fast()}
+            circulation.patron_activity_timeouts = {1: 0.1}
+
+            loans, holds, complete = circulation.patron_activity(
+                self.patron, "1234"
+            )
+
+            # We got the results from the API that answered in time.
+            eq_([], loans)
+            eq_(1, len(holds))
+            eq_(False, complete)
+        finally:
+            release.set()
+            pool.close()
+
+    def test_patron_activity_hung_api_does_not_starve_others(self):
+        # Each remote API gets its own worker threads, so one that
+        # never answers can't keep us from hearing from the others.
+        release = Event()
+        class Hung(BaseCirculationAPI):
+            calls = 0
+            def patron_activity(self, patron, pin):
+                self.calls += 1
+                release.wait()
+                return []
+
+        class Fast(BaseCirculationAPI):
+            def patron_activity(self, patron, pin):
+                return [HoldInfo(collection, None, "type", "id", None, None, 1)]
+
+        collection = self.collection
+        pool = PatronActivityPool(size=1)
+        try:
+            circulation = CirculationAPI(
+                self._db, self._default_library, patron_activity_pool=pool
+            )
+            hung = Hung()
+            circulation.api_for_collection = {1: hung, 2: Fast()}
+            circulation.patron_activity_timeouts = {1: 0.1, 2: 5}
+
+            for i in range(2):
+                loans, holds, complete = circulation.patron_activity(
+                    self.patron, "1234"
+                )
+                eq_(1, len(holds))
+                eq_(False, complete)
+
+            # Once the hung API starts answering, its only worker
+            # thread gets to the task from the second time around --
+            # which was called off, so the API isn't asked again --
+            # and then to the task from the third time around.
+            release.set()
+            circulation.patron_activity_timeouts = {1: 5, 2: 5}
+            loans, holds, complete = circulation.patron_activity(
+                self.patron, "1234"
+            )
+            eq_(1, len(holds))
+            eq_(True, complete)
+            eq_(2, hung.calls)
+        finally:
+            release.set()
+            pool.close()
+
+    def test_patron_activity_without_shared_pool(self):
+        # A CirculationAPI that isn't given a pool to share starts
+        # worker threads for each check, rather than keeping a pool
+        # of its own around.
+        class Fast(BaseCirculationAPI):
+            def patron_activity(self, patron, pin):
+                return [HoldInfo(collection, None, "type", "id", None, None, 1)]
+
+        collection = self.collection
+        circulation = CirculationAPI(self._db, self._default_library)
+        eq_(None, circulation.patron_activity_pool)
+        circulation.api_for_collection = {1: Fast()}
+
+        for i in range(2):
+            loans, holds, complete = circulation.patron_activity(
+                self.patron, "1234"
+            )
+            eq_(1, len(holds))
+            eq_(True, complete)
+        eq_(None, circulation.patron_activity_pool)
+
+    def test_patron_activity_task(self):
+        class Mock(BaseCirculationAPI):
+            deadline = None
+            def patron_activity(self, patron, pin):
+                self.deadline = PatronActivityDeadline.get()
+                return iter(["activity"])
+
+        api = Mock()
+        task = PatronActivityTask(api, self.patron, "1234", 10, logging.getLogger("test"))
+
+        # The task's deadline is set when it starts running, and the
+        # remote API can see it while it runs.
+        before = time.time()
+        eq_(["activity"], task())
+        assert task.started.is_set()
+        assert task.deadline >= before + 10
+        eq_(task.deadline, api.deadline)
+        eq_(None, PatronActivityDeadline.get())
+
+        # A task that never gets to start is called off, rather than
+        # having its remote API asked a question nobody will wait
+        # for.
+        api = Mock()
+        task = PatronActivityTask(api, self.patron, "1234", 0.01, logging.getLogger("test"))
+        assert_raises(TimeoutError, task.wait, None)
+        eq_(True, task.cancelled)
+        eq_(None, task())
+        eq_(None, api.deadline)
+
+    def test_patron_activity_deadline_applies_to_http_requests(self):
+        # Outside of a PatronActivityTask, request timeouts are left
+        # alone.
+        eq_({}, PatronActivityDeadline.apply({}))
+        eq_(dict(timeout=None), PatronActivityDeadline.apply(dict(timeout=None)))
+
+        PatronActivityDeadline.set(time.time() + 10)
+        try:
+            # Inside one, a request gets no more time than is left
+            # before the deadline.
+            for kwargs in ({}, dict(timeout=None), dict(timeout=60)):
+                timeout = PatronActivityDeadline.apply(kwargs)['timeout']
+                assert 9 < timeout <= 10
+
+            # A shorter timeout is kept.
+            eq_(dict(timeout=5), PatronActivityDeadline.apply(dict(timeout=5)))
+
+            # Even after the deadline passes, the timeout is positive.
+            PatronActivityDeadline.set(time.time() - 10)
+            eq_(PatronActivityDeadline.MINIMUM_TIMEOUT,
+                PatronActivityDeadline.apply({})['timeout'])
+        finally:
+            PatronActivityDeadline.set(None)
+
+    def test_patron_activity_timeout(self):
+        circulation = CirculationAPI(
+            self._db, self._default_library, api_map={
+            ExternalIntegration.BIBLIOTHECA : MockBibliothecaAPI
+        })
+        api = circulation.api_for_collection[self.collection.id]
+
+        # By default, the deadline comes from the API class.
+        eq_(BaseCirculationAPI.PATRON_ACTIVITY_TIMEOUT,
+            circulation.patron_activity_timeout(self.collection, api))
+
+        # But it can be configured for a specific collection.
+        self.collection.external_integration.setting(
+            BaseCirculationAPI.PATRON_ACTIVITY_TIMEOUT_KEY
+        ).value = "5"
+        eq_(5, circulation.patron_activity_timeout(self.collection, api))
+
+    def test_patron_activity_cache(self):
+        cache = PatronActivityCache(ttl=60)
+        circulation = CirculationAPI(
+            self._db, self._default_library, api_map={
+                ExternalIntegration.BIBLIOTHECA : MockBibliothecaAPI
+            }, patron_activity_cache=cache
+        )
+        mock_bibliotheca = circulation.api_for_collection[self.collection.id]
+
+        data = sample_data("checkouts.xml", "bibliotheca")
+        mock_bibliotheca.queue_response(200, content=data)
+        loans, holds, complete = circulation.patron_activity(self.patron, "1234")
+        eq_(2, len(loans))
+        eq_(2, len(holds))
+        eq_(True, complete)
+
+        # The second time, the remote API isn't called -- if it were,
+        # we'd get an error. But the cached answer might be out of
+        # date, so it's not considered complete.
+        mock_bibliotheca.queue_response(500, content="Error")
+        loans, holds, complete = circulation.patron_activity(self.patron, "1234")
+        eq_(2, len(loans))
+        eq_(2, len(holds))
+        eq_(False, complete)
+
+        # Changing the patron's state in the collection clears the
+        # cache, so now the remote API is called.
+        circulation.forget_patron_activity(self.patron, self.pool)
+        eq_(None, cache.get(self.patron, self.collection.id))
+        loans, holds, complete = circulation.patron_activity(self.patron, "1234")
+        eq_(0, len(loans))
+        eq_(False, complete)
+
+        # Errors aren't cached.
+        eq_(None, cache.get(self.patron, self.collection.id))
+
+    def test_patron_activity_cache_invalidated_by_state_changes(self):
+        cache = PatronActivityCache(ttl=60)
+        self.circulation.patron_activity_cache = cache
+
+        def cache_something():
+            cache.set(self.patron, self.pool.collection_id, ["activity"])
+
+        cache_something()
+        self.remote.queue_release_hold(True)
+        self.circulation.release_hold(self.patron, "1234", self.pool)
+        eq_(None, cache.get(self.patron, self.pool.collection_id))
+
+        cache_something()
+        self.circulation.revoke_loan(self.patron, "1234", self.pool)
+        eq_(None, cache.get(self.patron, self.pool.collection_id))
+
+        cache_something()
+        self.remote.queue_checkout(NoAvailableCopies())
+        self.remote.queue_hold(HoldInfo(
+            self.pool.collection, self.pool.data_source.name,
+            self.identifier.type, self.identifier.identifier,
+            None, None, 1
+        ))
+        # While the hold is being placed, a bookshelf sync that
+        # started earlier tries to cache what it found.
+        place_hold = self.remote.place_hold
+        def place_hold_during_sync(*args, **kwargs):
+            cache_something()
+            return place_hold(*args, **kwargs)
+        self.remote.place_hold = place_hold_during_sync
+        self.borrow()
+        eq_(None, cache.get(self.patron, self.pool.collection_id))
+
+        # A cache with no TTL doesn't store anything.
+        cache.ttl = 0
+        cache_something()
+        eq_(None, cache.get(self.patron, self.pool.collection_id))
+
+    def test_patron_activity_cache_ignores_answers_from_before_a_change(self):
+        cache = PatronActivityCache(ttl=60)
+        collection_id = self.pool.collection_id
+        cache.invalidate(self.patron, collection_id)
+        invalidated_at = cache.store.get(
+            cache.invalidation_key(self.patron, collection_id)
+        )
+
+        # An answer to a question asked before the patron's state
+        # changed isn't stored.
+        cache.set(self.patron, collection_id, ["old"],
+                  asked_at=invalidated_at - 1)
+        eq_(None, cache.get(self.patron, collection_id))
+
+        # An answer to a question asked afterwards is.
+        cache.set(self.patron, collection_id, ["new"],
+                  asked_at=invalidated_at + 1)
+        eq_(["new"], cache.get(self.patron, collection_id))
+
+    def test_shared_patron_activity_pool(self):
+        pool = PatronActivityPool()
+        circulation = CirculationAPI(
+            self._db, self._default_library, patron_activity_pool=pool
+        )
+        eq_(pool, circulation.patron_activity_pool)
+
+        # If no pool is passed in, the CirculationAPI makes its own.
+        circulation = CirculationAPI(self._db, self._default_library)
+        assert isinstance(
+            circulation.patron_activity_pool, PatronActivityPool
+        )
+        assert circulation.patron_activity_pool != pool
+
     def test_can_fulfill_without_loan(self):
         """Can a title can be fulfilled without an active loan?  It depends on
         the BaseCirculationAPI implementation for that title's colelction.
@@ -1,6 +1,7 @@
 # encoding=utf8
 from nose.tools import (
     assert_raises,
+    assert_raises_regexp,
     eq_,
     set_trace,
 )
@@ -115,7 +116,10 @@ from api.circulation import (
     FulfillmentInfo,
 )
 from api.custom_index import CustomIndexView
-from api.novelist import MockNoveListAPI
+from api.novelist import (
+    MockNoveListAPI,
+    NoveListRecommendationCache,
+)
 from api.adobe_vendor_id import (
     AuthdataUtility,
     DeviceManagementProtocolController,
@@ -1227,6 +1231,17 @@ class TestLoanController(CirculationControllerTest):
             assert isinstance(response, ProblemDetail)
             eq_(502, response.status_code)
 
+            # If the remote file is too large to proxy, the problem
+            # detail is passed on.
+            def too_large_get(url, headers, **kwargs):
+                return PROXIED_CONTENT_TOO_LARGE
+            self.manager.d_circulation.queue_fulfill(self.pool, fulfillment)
+
+            response = self.manager.loans.fulfill(
+                self.pool.id, do_get=too_large_get
+            )
+            eq_(PROXIED_CONTENT_TOO_LARGE, response)
+
     def test_borrow_and_fulfill_with_streaming_delivery_mechanism(self):
         # Create a pool with a streaming delivery mechanism
         work = self._work(with_license_pool=True, with_open_access_download=False)
@@ -1545,6 +1560,153 @@ class TestLoanController(CirculationControllerTest):
             )
             eq_(expect, fulfill_part_url(part))
 
+    def test_fulfill_proxies_remote_content(self):
+        # When a non-open-access book has to be fetched from a remote
+        # server, some of the patron's request headers are passed on
+        # to the remote server.
+        fulfillment = FulfillmentInfo(
+            self.pool.collection, self.pool.data_source.name,
+            self.pool.identifier.type, self.pool.identifier.identifier,
+            content_link="http://remote/book.epub",
+            content_type="application/epub+zip",
+            content=None, content_expires=None
+        )
+
+        class MockCirculationAPI(object):
+            def fulfill(self, *args, **kwargs):
+                return fulfillment
+
+        controller = self.manager.loans
+        controller.manager.circulation_apis[self._default_library.id] = MockCirculationAPI()
+        self.pool.open_access = False
+
+        requests = []
+        def do_get(url, headers):
+            requests.append((url, headers))
+            def content():
+                yield "part of "
+                yield "a book"
+            return 206, {"Content-Range": "bytes 0-13/1000"}, content()
+
+        with self.request_context_with_library(
+            "/", headers={"Authorization": self.valid_auth,
+                          "Range": "bytes=0-13",
+                          "If-None-Match": '"etag"',
+                          "X-Other-Header": "value"}
+        ):
+            authenticated = controller.authenticated_patron_from_request()
+            self.pool.loan_to(authenticated)
+            response = controller.fulfill(
+                self.pool.id, self.mech2.delivery_mechanism.id,
+                do_get=do_get
+            )
+
+        [(url, headers)] = requests
+        eq_("http://remote/book.epub", url)
+        eq_({"Range": "bytes=0-13", "If-None-Match": '"etag"'}, headers)
+
+        # The remote server's response is passed on to the patron.
+        eq_(206, response.status_code)
+        eq_("bytes 0-13/1000", response.headers['Content-Range'])
+        eq_("application/epub+zip", response.headers['Content-Type'])
+        eq_("part of a book", response.get_data())
+
+    def test_proxy_remote_content(self):
+        class MockStreamingResponse(object):
+            def __init__(self, status_code, headers, chunks):
+                self.status_code = status_code
+                self.headers = headers
+                self.chunks = chunks
+                self.closed = False
+
+            def iter_content(self, chunk_size):
+                self.chunk_size = chunk_size
+                for chunk in self.chunks:
+                    yield chunk
+
+            def close(self):
+                self.closed = True
+
+        requests = []
+        def do_get(url, **kwargs):
+            requests.append((url, kwargs))
+            return response
+
+        controller = self.manager.loans
+        response = MockStreamingResponse(
+            200, {"Content-Length": "10", "ETag": '"etag"',
+                  "Set-Cookie": "cookie",
+                  "Content-Type": "application/epub+zip"},
+            ["12345", "67890"]
+        )
+        status, headers, content = controller.proxy_remote_content(
+            "http://remote/", {"Range": "bytes=0-"}, do_get=do_get
+        )
+
+        # The request was made in streaming mode, asking for the
+        # file to be sent without any encoding.
+        [(url, kwargs)] = requests
+        eq_("http://remote/", url)
+        eq_(True, kwargs['stream'])
+        eq_({"Range": "bytes=0-", "Accept-Encoding": "identity"},
+            kwargs['headers'])
+
+        # Only some of the response headers are passed on.
+        eq_(200, status)
+        eq_({"Content-Length": "10", "ETag": '"etag"',
+             "Content-Type": "application/epub+zip"}, headers)
+
+        # Nothing is read from the remote server until the content is
+        # consumed, and then it's read in chunks.
+        eq_(False, response.closed)
+        eq_(["12345", "67890"], list(content))
+        eq_(controller.PROXY_CHUNK_SIZE, response.chunk_size)
+        eq_(True, response.closed)
+
+        # If the remote server says the file is too large, we don't
+        # even start proxying it.
+        controller.MAX_PROXIED_CONTENT_SIZE = 9
+        response = MockStreamingResponse(
+            200, {"Content-Length": "10"}, ["12345", "67890"]
+        )
+        problem = controller.proxy_remote_content(
+            "http://remote/", do_get=do_get
+        )
+        eq_(PROXIED_CONTENT_TOO_LARGE.uri, problem.uri)
+        assert "10 bytes" in problem.detail
+        eq_(True, response.closed)
+
+        # If the remote server doesn't say how large the file is, we
+        # stop sending it once it goes over the limit. Rather than
+        # ending the response as though the whole file had been sent,
+        # we raise an exception, which breaks off the connection.
+        response = MockStreamingResponse(200, {}, ["12345", "67890"])
+        status, headers, content = controller.proxy_remote_content(
+            "http://remote/", do_get=do_get
+        )
+        sent = []
+        def consume():
+            for chunk in content:
+                sent.append(chunk)
+        assert_raises_regexp(
+            RemoteIntegrationException, "too large to proxy", consume
+        )
+        eq_(["12345"], sent)
+        eq_(True, response.closed)
+
+        # If the file was encoded, it will be decoded as it's
+        # streamed, so the remote Content-Length isn't passed on.
+        controller.MAX_PROXIED_CONTENT_SIZE = 100
+        response = MockStreamingResponse(
+            200, {"Content-Length": "5", "Content-Encoding": "gzip"},
+            ["decoded content"]
+        )
+        status, headers, content = controller.proxy_remote_content(
+            "http://remote/", {"Accept-Encoding": "gzip"}, do_get=do_get
+        )
+        eq_({}, headers)
+        eq_("gzip", requests[-1][1]['headers']['Accept-Encoding'])
+
     def test_fulfill_without_active_loan(self):
 
         controller = self.manager.loans
@@ -2182,15 +2344,14 @@ class TestWorkController(CirculationControllerTest):
             eq_(400, response.status_code)
 
         # Or if the facet data is bad.
-        mock_api.setup(metadata)
         with self.request_context_with_library('/?order=nosuchorder'):
             response = self.manager.work_controller.recommendations(
                 *args, **kwargs
             )
             eq_(400, response.status_code)
 
-        # Show it working.
-        mock_api.setup(metadata)
+        # The recommendations haven't been looked up yet, so the
+        # feed is empty, and NoveList isn't asked while we wait.
         with self.request_context_with_library('/'):
             response = self.manager.work_controller.recommendations(
                 *args, **kwargs
@@ -2199,13 +2360,14 @@ class TestWorkController(CirculationControllerTest):
         feed = feedparser.parse(response.data)
         eq_('Recommended Books', feed['feed']['title'])
         eq_(0, len(feed['entries']))
+        eq_([metadata], mock_api.responses)
 
-
-        # Delete the cache and prep a recommendation result.
+        # Delete the cache, and store a recommendation the way
+        # NoveListRecommendationsScript would.
         [cached_empty_feed] = self._db.query(CachedFeed).all()
         self._db.delete(cached_empty_feed)
-        metadata.recommendations = [self.work.license_pools[0].identifier]
-        mock_api.setup(metadata)
+        cache = NoveListRecommendationCache(self._default_library)
+        cache.store(self.identifier, [self.work.license_pools[0].identifier])
 
         SessionManager.refresh_materialized_views(self._db)
         with self.request_context_with_library('/'):
@@ -2239,15 +2401,13 @@ class TestWorkController(CirculationControllerTest):
 
         another_work = self._work("Before Quite British", "Not Before John Bull", with_open_access_download=True, data_source_name=DataSource.OVERDRIVE)
 
-        # Delete the cache again and prep a recommendation result.
+        # Delete the cache again and store two recommendations.
         [cached_feed] = self._db.query(CachedFeed).all()
         self._db.delete(cached_feed)
-
-        metadata.recommendations = [
+        cache.store(self.identifier, [
             self.work.license_pools[0].identifier,
             another_work.license_pools[0].identifier,
-        ]
-        mock_api.setup(metadata)
+        ])
 
         # Facets work.
         SessionManager.refresh_materialized_views(self._db)
@@ -2264,12 +2424,6 @@ class TestWorkController(CirculationControllerTest):
         eq_(another_work.title, entry1['title'])
         eq_(self.work.title, entry2['title'])
 
-        metadata.recommendations = [
-            self.work.license_pools[0].identifier,
-            another_work.license_pools[0].identifier,
-        ]
-        mock_api.setup(metadata)
-
         with self.request_context_with_library("/?order=author"):
             response = self.manager.work_controller.recommendations(
                 self.identifier.type, self.identifier.identifier,
@@ -2283,12 +2437,6 @@ class TestWorkController(CirculationControllerTest):
         eq_(self.work.title, entry1['title'])
         eq_(another_work.title, entry2['title'])
 
-        metadata.recommendations = [
-            self.work.license_pools[0].identifier,
-            another_work.license_pools[0].identifier,
-        ]
-        mock_api.setup(metadata)
-
         # Pagination works.
         with self.request_context_with_library("/?size=1&order=title"):
             response = self.manager.work_controller.recommendations(
@@ -2302,12 +2450,6 @@ class TestWorkController(CirculationControllerTest):
         [entry] = feed['entries']
         eq_(another_work.title, entry['title'])
 
-        metadata.recommendations = [
-            self.work.license_pools[0].identifier,
-            another_work.license_pools[0].identifier,
-        ]
-        mock_api.setup(metadata)
-
         with self.request_context_with_library("/?after=1&order=title"):
             response = self.manager.work_controller.recommendations(
                 self.identifier.type, self.identifier.identifier,
@@ -2384,6 +2526,23 @@ class TestWorkController(CirculationControllerTest):
         metadata.recommendations = [same_author.license_pools[0].identifier]
         mock_api.setup(metadata)
 
+        # The recommendations haven't been looked up yet, so the feed
+        # is served without them rather than waiting for NoveList.
+        with self.request_context_with_library('/'):
+            response = self.manager.work_controller.related(
+                self.identifier.type, self.identifier.identifier,
+                novelist_api=mock_api
+            )
+        eq_(200, response.status_code)
+        feed = feedparser.parse(response.data)
+        eq_(4, len(feed['entries']))
+        eq_([metadata], mock_api.responses)
+
+        # Once they've been looked up in the background, they're included.
+        NoveListRecommendationCache(self._default_library).resolve(
+            mock_api, self.identifier
+        )
+
         # A grouped feed is returned with all of the related books
         with self.request_context_with_library('/'):
             response = self.manager.work_controller.related(
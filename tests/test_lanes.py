@@ -49,7 +49,10 @@ from api.lanes import (
     SeriesLane,
     WorkBasedLane,
 )
-from api.novelist import MockNoveListAPI
+from api.novelist import (
+    MockNoveListAPI,
+    NoveListRecommendationCache,
+)
 
 
 class TestLaneCreation(DatabaseTest):
@@ -361,8 +364,9 @@ class TestRelatedBooksLane(DatabaseTest):
         [contributor, series] = result.children
         eq_(True, isinstance(series, SeriesLane))
 
-        # When NoveList is configured and recommendations are available,
-        # a RecommendationLane will be included.
+        # When NoveList is configured, recommendations that haven't
+        # been looked up yet don't hold up the lane. NoveList isn't
+        # asked for them.
         self._external_integration(
             ExternalIntegration.NOVELIST,
             goal=ExternalIntegration.METADATA_GOAL, username=u'library',
@@ -374,6 +378,15 @@ class TestRelatedBooksLane(DatabaseTest):
         )
         mock_api.setup(response)
         result = RelatedBooksLane(self._default_library, self.work, "", novelist_api=mock_api)
+        eq_(2, len(result.children))
+        eq_([response], mock_api.responses)
+
+        # Once the recommendations have been looked up, a
+        # RecommendationLane is included.
+        cache = NoveListRecommendationCache(self._default_library)
+        assert self.edition.primary_identifier in cache.pending()
+        cache.resolve(mock_api, self.edition.primary_identifier)
+        result = RelatedBooksLane(self._default_library, self.work, "", novelist_api=mock_api)
         eq_(3, len(result.children))
 
         # The book's language and audience list is passed down to all sublanes.
@@ -495,6 +508,39 @@ class TestRecommendationLane(LaneTest):
         SessionManager.refresh_materialized_views(self._db)
         self.assert_works_queries(lane, [result])
 
+    def test_fetch_recommendations(self):
+        identifier = self.work.presentation_edition.primary_identifier
+        recommendation = self._identifier()
+        source = DataSource.lookup(self._db, DataSource.OVERDRIVE)
+        mock_api = MockNoveListAPI(self._db)
+        mock_api.setup(Metadata(source, recommendations=[recommendation]))
+
+        # A lane that can only use stored recommendations is empty
+        # until they've been looked up.
+        lane = RecommendationLane(
+            self._default_library, self.work, '', novelist_api=mock_api,
+            cached_only=True
+        )
+        eq_([], lane.recommendations)
+        eq_(1, len(mock_api.responses))
+
+        # Otherwise, NoveList is asked for them, and they're stored.
+        lane = RecommendationLane(
+            self._default_library, self.work, '', novelist_api=mock_api
+        )
+        eq_([recommendation], lane.recommendations)
+        eq_([], mock_api.responses)
+        cache = NoveListRecommendationCache(self._default_library)
+        eq_([recommendation], cache.get(identifier))
+
+        # Now every lane can use them without asking NoveList again.
+        for cached_only in (True, False):
+            lane = RecommendationLane(
+                self._default_library, self.work, '', novelist_api=mock_api,
+                cached_only=cached_only
+            )
+            eq_([recommendation], lane.recommendations)
+
     def test_works_query_with_source_audience(self):
 
         # If the lane is created with a source audience, it filters the
@@ -125,6 +125,9 @@ class TestLibraryAnnotator(DatabaseTest):
             self._db, Registration.LIBRARY_REGISTRATION_WEB_CLIENT,
             self._default_library, registry).value = "http://web_catalog"
 
+        # The settings are looked up when an annotator is first used,
+        # so a new annotator is needed to see the change.
+        annotator = LibraryAnnotator(self._default_library)
         record = Record()
         annotator.add_web_client_urls(record, self._default_library, identifier)
         [field] = record.get_fields("856")
@@ -141,6 +144,7 @@ class TestLibraryAnnotator(DatabaseTest):
             self._db, MARCExporter.WEB_CLIENT_URL,
             self._default_library, integration).value = "http://another_web_catalog"
 
+        annotator = LibraryAnnotator(self._default_library)
         record = Record()
         annotator.add_web_client_urls(record, self._default_library, identifier, integration)
         [field1, field2] = record.get_fields("856")
@@ -154,3 +158,34 @@ class TestLibraryAnnotator(DatabaseTest):
 
         
 
+    def test_settings(self):
+        integration = self._external_integration(
+            ExternalIntegration.MARC_EXPORT, ExternalIntegration.CATALOG_GOAL,
+            libraries=[self._default_library])
+        def set_value(key, value):
+            ConfigurationSetting.for_library_and_externalintegration(
+                self._db, key, self._default_library, integration
+            ).value = value
+        set_value(MARCExporter.MARC_ORGANIZATION_CODE, "marc org")
+        set_value(MARCExporter.INCLUDE_SUMMARY, "true")
+        set_value(MARCExporter.WEB_CLIENT_URL, "http://web_catalog")
+
+        annotator = LibraryAnnotator(self._default_library)
+        settings = annotator.settings(integration)
+        eq_("marc org", settings.marc_org)
+        eq_(True, settings.include_summary)
+        eq_(False, settings.include_genres)
+        eq_(("http://web_catalog/book/",), settings.book_url_prefixes)
+
+        # The settings are only looked up once per annotator, no
+        # matter how many records are annotated.
+        set_value(MARCExporter.MARC_ORGANIZATION_CODE, "another org")
+        eq_(settings, annotator.settings(integration))
+        eq_("marc org", annotator.settings(integration).marc_org)
+
+        # Without an integration, only the library registry's web
+        # client URLs apply.
+        settings = annotator.settings(None)
+        eq_(None, settings.marc_org)
+        eq_(False, settings.include_summary)
+        eq_((), settings.book_url_prefixes)
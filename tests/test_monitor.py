@@ -18,6 +18,7 @@ from core.model import (
     DataSource,
     ExternalIntegration,
     Identifier,
+    Loan,
 )
 from core.opds_import import MockMetadataWranglerOPDSLookup
 from core.testing import (
@@ -32,6 +33,7 @@ from api.monitor import (
     LoanlikeReaperMonitor,
     LoanReaper,
     MWAuxiliaryMetadataMonitor,
+    delete_in_batches,
     MWCollectionUpdateMonitor,
 )
 
@@ -228,6 +230,72 @@ class TestMWCollectionUpdateMonitor(DatabaseTest):
 
         eq_(datetime.datetime(2016, 9, 20, 19, 37, 2), new_timestamp)
 
+    def test_parse_feed(self):
+        data = sample_data('metadata_updates_response.opds', 'opds')
+        tree, entries = self.monitor.parse_feed(data)
+        eq_(1, len(entries))
+        eq_([u'http://next-link/'], self.monitor.extract_next_links(tree))
+        eq_([(u'urn:isbn:9781594632556',
+              datetime.datetime(2016, 9, 20, 19, 37, 2))],
+            self.monitor.extract_last_update_dates(entries))
+
+        # Update times in other time zones are converted to UTC.
+        data = data.replace("2016-09-20T19:37:02Z", "2016-09-20T14:37:02-05:00")
+        tree, entries = self.monitor.parse_feed(data)
+        [(identifier, updated)] = self.monitor.extract_last_update_dates(
+            entries
+        )
+        eq_(datetime.datetime(2016, 9, 20, 19, 37, 2), updated)
+
+    def test_importer_reuses_parsed_feed(self):
+        data = sample_data('metadata_updates_response.opds', 'opds')
+        tree, entries = self.monitor.parse_feed(data)
+        importer = self.monitor.importer
+        data_source = DataSource.lookup(
+            self._db, DataSource.METADATA_WRANGLER
+        )
+
+        # While a feed is being imported from a parsed tree, the
+        # importer gets its metadata from the tree rather than
+        # parsing the feed itself -- which it couldn't do here.
+        not_a_feed = "This is not an OPDS feed."
+        importer._parsed = (not_a_feed, tree)
+        values, failures = importer.extract_metadata_from_elementtree(
+            not_a_feed, data_source
+        )
+        eq_([u'urn:isbn:9781594632556'], values.keys())
+
+        # Once the import is over, the tree is forgotten.
+        self.monitor.importer.import_from_parsed_feed(data, tree)
+        eq_(None, importer._parsed)
+
+    def test_prefetch(self):
+        data = sample_data('metadata_updates_response.opds', 'opds')
+        self.lookup.queue_response(
+            200, {'content-type' : OPDSFeed.ACQUISITION_FEED_TYPE}, data
+        )
+
+        # Outside of run_once, nothing is prefetched.
+        self.monitor.prefetch(["http://next-link/"])
+        eq_({}, self.monitor.prefetched)
+
+        self.monitor.start_prefetching()
+        try:
+            self.monitor.prefetch(["http://next-link/"])
+            eq_(["http://next-link/"], self.monitor.prefetched.keys())
+
+            # When the page is needed, the prefetched response is used.
+            response = self.monitor.get_response(url="http://next-link/")
+            eq_(data, response.content)
+            eq_({}, self.monitor.prefetched)
+            eq_(["http://next-link/"], [x[0] for x in self.lookup.requests])
+
+            # A page that's already been requested isn't requested again.
+            self.monitor.prefetch(["http://next-link/"])
+            eq_({}, self.monitor.prefetched)
+        finally:
+            self.monitor.stop_prefetching()
+
     def test_get_response(self):
 
         class Mock(MockMetadataWranglerOPDSLookup):
@@ -547,6 +615,24 @@ class TestLoanlikeReaperMonitor(DatabaseTest):
         eq_([sot_hold], inactive_patron.holds)
         eq_(2, len(current_patron.holds))
 
+    def test_delete_in_batches(self):
+        patron = self._patron()
+        expired = []
+        for i in range(3):
+            pool = self._licensepool(None)
+            loan, ignore = pool.loan_to(patron)
+            expired.append(loan.id)
+        pool = self._licensepool(None)
+        active, ignore = pool.loan_to(patron)
+
+        qu = self._db.query(Loan.id).filter(Loan.id.in_(expired))
+        progress = delete_in_batches(self._db, Loan, qu, batch_size=2)
+
+        # The running total is yielded after each batch, and each
+        # batch is committed.
+        eq_([2, 3], list(progress))
+        eq_([active], self._db.query(Loan).all())
+
 
 class TestIdlingAnnotationReaper(DatabaseTest):
 
@@ -1,5 +1,6 @@
 import datetime
 import json
+from collections import OrderedDict
 from nose.tools import (
     set_trace,
     eq_,
@@ -8,7 +9,11 @@ from nose.tools import (
 
 from . import DatabaseTest, sample_data
 
-from core.metadata_layer import Metadata
+from core.coverage import CoverageFailure
+from core.metadata_layer import (
+    IdentifierData,
+    Metadata,
+)
 from core.model import (
     get_one,
     get_one_or_create,
@@ -22,6 +27,7 @@ from api.novelist import (
     MockNoveListAPI,
     NoveListAPI,
     NoveListCoverageProvider,
+    NoveListRecommendationCache,
 )
 from core.util.http import (
     HTTP
@@ -332,6 +338,98 @@ class TestNoveListAPI(DatabaseTest):
         api.choose_best_metadata_return = (metadatas[1], 0.67)
         eq_(metadatas[1], api.lookup_equivalent_isbns(identifier))
 
+    def test_lookup_batch(self):
+        class Mock(NoveListAPI):
+            posted = []
+            broken = set()
+            def post(self, url):
+                self.posted.append(url)
+                for isbn in self.broken:
+                    if isbn in url:
+                        raise Exception("NoveList is down")
+                return 200, {}, self.content
+
+        api = Mock(self._db, u'library', u'yep', concurrency=2)
+        api.content = self.sample_data("a_bad_character.json")
+        isbn1 = self._identifier(identifier_type=Identifier.ISBN)
+        isbn2 = self._identifier(identifier_type=Identifier.ISBN)
+
+        # Both ISBNs are requested from NoveList, and a Metadata
+        # object is returned for each one.
+        first, second = api.lookup_batch([isbn1, isbn2])
+        eq_(2, len(api.posted))
+        eq_('A bad character', first.title)
+        eq_('A bad character', second.title)
+
+        # The responses are stored without the credentials.
+        for isbn in (isbn1, isbn2):
+            params = dict(
+                ClientIdentifier=isbn.urn, ISBN=isbn.identifier,
+                version=api.version, profile=u'library', password=u'yep'
+            )
+            representation = api.cached_representation(
+                unicode(api.scrubbed_url(params))
+            )
+            eq_(api.content, representation.content)
+
+        # The parsed results are remembered, so looking the ISBNs up
+        # again doesn't even use the stored responses.
+        def representations_for(isbn):
+            return self._db.query(Representation).filter(
+                Representation.url.like(u"%" + isbn.identifier + u"%")
+            )
+        for isbn in (isbn1, isbn2):
+            representations_for(isbn).delete(synchronize_session='fetch')
+        again = api.lookup_batch([isbn1, isbn2])
+        eq_(['A bad character'] * 2, [m.title for m in again])
+        eq_(2, len(api.posted))
+
+        # Each caller gets its own copy of the remembered Metadata,
+        # so changing one doesn't change what the next caller gets.
+        first_again = api.lookup(isbn1)
+        assert first_again is not first
+        first_again.title = u"Changed"
+        eq_('A bad character', api.lookup(isbn1).title)
+        eq_(2, len(api.posted))
+
+        # A remembered result is only used for as long as the stored
+        # response would have been.
+        metadata, fetched_at = api._metadata_memo.values()[-1]
+        too_old = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=api.MAX_REPRESENTATION_AGE + 1
+        )
+        api._metadata_memo = OrderedDict(
+            (url, (metadata, too_old)) for url in api._metadata_memo
+        )
+        eq_('A bad character', api.lookup(isbn1).title)
+        eq_(3, len(api.posted))
+
+        # Another API object uses the stored responses.
+        other = Mock(self._db, u'library', u'yep')
+        eq_('A bad character', other.lookup(isbn1).title)
+        eq_(3, len(api.posted))
+
+        # Only the most recently used results are remembered.
+        api.METADATA_MEMO_SIZE = 1
+        api.remember(
+            u"http://another-lookup/", None, datetime.datetime.utcnow()
+        )
+        eq_([u"http://another-lookup/"], api._metadata_memo.keys())
+
+        # If a request fails, there's no result for that ISBN, and it
+        # will be requested again next time.
+        isbn3 = self._identifier(identifier_type=Identifier.ISBN)
+        isbn4 = self._identifier(identifier_type=Identifier.ISBN)
+        Mock.broken.add(isbn3.identifier)
+        third, fourth = api.lookup_batch([isbn3, isbn4])
+        eq_(None, third)
+        eq_('A bad character', fourth.title)
+        eq_(5, len(api.posted))
+
+        Mock.broken.clear()
+        eq_('A bad character', api.lookup(isbn3).title)
+        eq_(6, len(api.posted))
+
     def test_choose_best_metadata(self):
         more_identifier = self._identifier(identifier_type=Identifier.NOVELIST_ID)
         less_identifier = self._identifier(identifier_type=Identifier.NOVELIST_ID)
@@ -447,6 +545,95 @@ class TestNoveListAPI(DatabaseTest):
 
         self.novelist.put = oldPut
 
+    def test_upload_batch(self):
+        identifier_ids = []
+        for i in range(3):
+            edition = self._edition(identifier_type=Identifier.ISBN)
+            self._licensepool(edition, collection=self._default_collection)
+            identifier_ids.append(edition.primary_identifier.id)
+        identifier_ids.sort()
+
+        # A LicensePool in a collection the library doesn't have is
+        # ignored.
+        self._licensepool(None, collection=self._collection())
+
+        library = self._default_library
+        self.novelist.UPLOAD_BATCH_SIZE = 2
+        eq_(identifier_ids[:2], self.novelist.upload_batch(library))
+        eq_(identifier_ids[2:],
+            self.novelist.upload_batch(library, identifier_ids[1]))
+        eq_([], self.novelist.upload_batch(library, identifier_ids[2]))
+
+        # Only the items for the identifiers in the batch are found.
+        items = list(self.novelist.iterate_items_from_query(
+            library, identifier_ids[2:]
+        ))
+        eq_([edition.primary_identifier.identifier],
+            [x['isbn'] for x in items])
+
+    def test_put_items_novelist_in_batches(self):
+        identifier_ids = []
+        for i in range(3):
+            edition = self._edition(identifier_type=Identifier.ISBN)
+            self._licensepool(edition, collection=self._default_collection)
+            identifier_ids.append(edition.primary_identifier.id)
+        identifier_ids.sort()
+
+        self.novelist.UPLOAD_BATCH_SIZE = 2
+        self.novelist.UPLOAD_RETRY_DELAY = 0
+        sent = []
+        responses = []
+        def mockHTTPPut(url, headers, **kwargs):
+            data = json.loads(kwargs['data'])
+            sent.append([x['isbn'] for x in data['records']])
+            return responses.pop(0)
+
+        self.novelist.put = mockHTTPPut
+        success = MockRequestsResponse(
+            200, content=json.dumps(dict(RecordsReceived=2))
+        )
+        failure = MockRequestsResponse(503, content="try again")
+
+        # The first batch goes through, but NoveList can't accept the
+        # second, even after a couple of retries.
+        responses.extend([success, failure, failure, failure])
+        response = self.novelist.put_items_novelist(self._default_library)
+        eq_(dict(RecordsReceived=2), response)
+        eq_([], responses)
+        [first_batch, second_batch, ignore, ignore] = sent
+        eq_(2, len(first_batch))
+        eq_(1, len(second_batch))
+
+        # A checkpoint was left behind.
+        checkpoint = self.novelist.upload_checkpoint(self._default_library)
+        eq_(identifier_ids[1], checkpoint.counter)
+
+        # The next time, the upload picks up where it left off.
+        del sent[:]
+        responses.append(success)
+        response = self.novelist.put_items_novelist(self._default_library)
+        eq_(dict(RecordsReceived=2), response)
+        eq_([second_batch], sent)
+
+        # Now that everything has been sent, the checkpoint is gone.
+        eq_(None, checkpoint.counter)
+        assert checkpoint.finish is not None
+
+        # If NoveList rejects the data outright, it's not sent again.
+        del sent[:]
+        responses.append(MockRequestsResponse(400, content="bad data"))
+        response = self.novelist.put_items_novelist(self._default_library)
+        eq_(None, response)
+        eq_(1, len(sent))
+        eq_(None, checkpoint.counter)
+
+        # If the batch size is None, everything is sent at once.
+        del sent[:]
+        self.novelist.UPLOAD_BATCH_SIZE = None
+        responses.append(success)
+        self.novelist.put_items_novelist(self._default_library)
+        eq_([3], [len(x) for x in sent])
+
     def test_make_novelist_data_object(self):
         bad_data = []
         result = self.novelist.make_novelist_data_object(bad_data)
@@ -488,6 +675,77 @@ class TestNoveListAPI(DatabaseTest):
         HTTP.put_with_timeout = oldPut
 
 
+class TestNoveListRecommendationCache(DatabaseTest):
+
+    def setup(self):
+        super(TestNoveListRecommendationCache, self).setup()
+        self.cache = NoveListRecommendationCache(self._default_library)
+        work = self._work(with_license_pool=True)
+        self.identifier = work.presentation_edition.primary_identifier
+        self.recommendation = self._identifier()
+
+    def test_get_and_store(self):
+        # Nothing is known about the book's recommendations yet, so
+        # they're waiting to be looked up.
+        eq_(None, self.cache.get(self.identifier))
+        eq_([self.identifier], self.cache.pending())
+
+        # Checking the cache didn't create an entry.
+        eq_(None, self.cache.entry(self.identifier))
+
+        # Once they're stored, they're found.
+        self.cache.store(self.identifier, [self.recommendation])
+        eq_([self.recommendation], self.cache.get(self.identifier))
+        eq_([], self.cache.pending())
+
+        # Storing them again updates the same entry.
+        entry = self.cache.entry(self.identifier)
+        self.cache.store(self.identifier, [])
+        eq_(entry, self.cache.entry(self.identifier))
+        eq_([], self.cache.get(self.identifier))
+
+        # Knowing there aren't any recommendations is different
+        # from not knowing.
+        other = self._identifier()
+        eq_(None, self.cache.get(other))
+
+        # Another library has its own entries. This one has no books,
+        # so there's nothing for it to look up.
+        other_cache = NoveListRecommendationCache(self._library())
+        eq_(None, other_cache.get(self.identifier))
+        eq_([], other_cache.pending())
+
+        # Only books in the library are looked up.
+        eq_([], self.cache.pending())
+
+        # When stored recommendations get too old, they're ignored and
+        # need to be looked up again. The entry is left alone until
+        # then.
+        entry.fetched_at = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=NoveListRecommendationCache.MAX_AGE + 1
+        )
+        eq_(None, self.cache.get(self.identifier))
+        eq_([self.identifier], self.cache.pending())
+        eq_(entry, self.cache.entry(self.identifier))
+
+    def test_resolve(self):
+        source = DataSource.lookup(self._db, DataSource.NOVELIST)
+        missing = IdentifierData(Identifier.ISBN, u"9780300000000")
+        metadata = Metadata(
+            source, recommendations=[self.recommendation, missing]
+        )
+        api = MockNoveListAPI(self._db)
+        api.setup(metadata, None)
+
+        # Only recommendations that are in the database are kept.
+        eq_([self.recommendation], self.cache.resolve(api, self.identifier))
+        eq_([self.recommendation], self.cache.get(self.identifier))
+
+        # If NoveList doesn't know the book, there are no recommendations.
+        eq_([], self.cache.resolve(api, self.identifier))
+        eq_([], self.cache.get(self.identifier))
+
+
 class TestNoveListCoverageProvider(DatabaseTest):
 
     def setup(self):
@@ -524,6 +782,44 @@ class TestNoveListCoverageProvider(DatabaseTest):
         equivalents = [eq.output for eq in identifier.equivalencies]
         eq_(True, self.metadata.primary_identifier in equivalents)
 
+    def test_process_batch(self):
+        identifier = self._identifier(identifier_type=Identifier.ISBN)
+        unknown = self._identifier(identifier_type=Identifier.ISBN)
+        self.novelist.api.setup(self.metadata, None)
+
+        # Both identifiers are looked up at once, and both are covered.
+        eq_([identifier, unknown],
+            self.novelist.process_batch([identifier, unknown]))
+        eq_([], self.novelist.api.responses)
+        equivalents = [eq.output for eq in identifier.equivalencies]
+        eq_(True, self.metadata.primary_identifier in equivalents)
+        eq_([], unknown.equivalencies)
+
+    def test_process_batch_failure(self):
+        identifier = self._identifier(identifier_type=Identifier.ISBN)
+        broken = self._identifier(identifier_type=Identifier.ISBN)
+
+        class Mock(MockNoveListAPI):
+            def lookup_batch(self, identifiers):
+                raise Exception("Batch lookup failed")
+
+            def lookup(self, identifier):
+                if identifier == broken:
+                    raise Exception("Lookup failed")
+                return super(Mock, self).lookup(identifier)
+
+        self.novelist.api = Mock(self._db)
+        self.novelist.api.setup(self.metadata)
+
+        # When the batch lookup fails, each identifier is looked up
+        # on its own, and only the one that can't be looked up fails.
+        covered, failure = self.novelist.process_batch([identifier, broken])
+        eq_(identifier, covered)
+        assert isinstance(failure, CoverageFailure)
+        eq_(broken, failure.obj)
+        eq_(True, failure.transient)
+        assert "Lookup failed" in failure.exception
+
     def test_process_item_creates_edition_for_series_info(self):
         work = self._work(with_license_pool=True)
         identifier = work.license_pools[0].identifier
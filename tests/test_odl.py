@@ -820,6 +820,63 @@ class TestODLWithConsolidatedCopiesAPI(DatabaseTest, BaseODLTest):
             eq_(0, hold.position)
             assert hold.end - datetime.datetime.utcnow() - datetime.timedelta(days=3) < datetime.timedelta(hours=1)
 
+    def test_update_hold_queues(self):
+        now = datetime.datetime.utcnow()
+        tomorrow = now + datetime.timedelta(days=1)
+        last_week = now - datetime.timedelta(days=7)
+        self.collection.external_integration.set_setting(
+            Collection.DEFAULT_RESERVATION_PERIOD_KEY, 3
+        )
+        self.collection.external_integration.set_setting(
+            Collection.EBOOK_LOAN_DURATION_KEY, 6
+        )
+
+        # This pool has one license, which is on loan, and three holds.
+        self.pool.licenses_owned = 1
+        self.pool.loan_to(self._patron(), end=tomorrow)
+        holds = []
+        for i in range(3):
+            hold, ignore = self.pool.on_hold_to(
+                self._patron(), start=last_week + datetime.timedelta(days=i),
+                position=1
+            )
+            holds.append(hold)
+
+        # This pool has two licenses and one hold.
+        other_pool = self._licensepool(None, collection=self.collection)
+        other_pool.licenses_owned = 2
+        other_hold, ignore = other_pool.on_hold_to(self._patron(), position=1)
+
+        self.api.update_hold_queues([self.pool, other_pool])
+
+        # Every hold in the first pool's queue was given its position
+        # and an estimated end date.
+        eq_(0, self.pool.licenses_available)
+        eq_(0, self.pool.licenses_reserved)
+        eq_(3, self.pool.patrons_in_hold_queue)
+        eq_([1, 2, 3], [hold.position for hold in holds])
+        eq_([tomorrow,
+             tomorrow + datetime.timedelta(days=9),
+             tomorrow + datetime.timedelta(days=18)],
+            [hold.end for hold in holds])
+
+        # The hold on the other pool got a reserved license.
+        eq_(1, other_pool.licenses_available)
+        eq_(1, other_pool.licenses_reserved)
+        eq_(1, other_pool.patrons_in_hold_queue)
+        eq_(0, other_hold.position)
+        assert other_hold.end - now - datetime.timedelta(days=3) < datetime.timedelta(hours=1)
+
+        # Holds placed at the same time share a position.
+        tied_hold, ignore = self.pool.on_hold_to(
+            self._patron(), start=holds[2].start
+        )
+        self.api.update_hold_queues([self.pool])
+        eq_([1, 2, 3, 3], [hold.position for hold in holds + [tied_hold]])
+
+        # Passing in no pools does nothing.
+        self.api.update_hold_queues([])
+
     def test_place_hold_success(self):
         tomorrow = datetime.datetime.utcnow() + datetime.timedelta(days=1)
         self.pool.licenses_owned = 1
@@ -49,3 +49,24 @@ class TestONIXExtractor(object):
 
         eq_(1, len(record.links))
         assert "the essential democratic values of diversity and free expression" in record.links[0].content
+
+    def test_iterparse(self):
+        """Parse an ONIX file one <product> at a time."""
+        file = self.sample_data("onix_example.xml")
+
+        # Make a document with two products.
+        start = file.index("<product>")
+        end = file.index("</product>") + len("</product>")
+        product = file[start:end]
+        second_product = product.replace(
+            "Safe Spaces, Brave Spaces", "Another Title"
+        )
+        file = file[:end] + second_product + file[end:]
+
+        records = ONIXExtractor().iterparse(StringIO(file), "MIT Press")
+        first = next(records)
+        eq_("Safe Spaces, Brave Spaces", first.title)
+        second = next(records)
+        eq_("Another Title", second.title)
+        eq_("9780262343664", second.primary_identifier.identifier)
+        eq_([], list(records))
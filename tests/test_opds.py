@@ -649,7 +649,14 @@ class TestLibraryAnnotator(VendorIDTest):
 
         # If analytics are configured, a link is added to
         # create an 'open_book' analytics event for this title.
+        # Whether analytics are configured is checked when the
+        # annotator is created, so we need a new annotator.
         Analytics.GLOBAL_ENABLED = True
+        annotator = LibraryAnnotator(
+            None, lane, self._default_library, test_mode=True,
+            library_identifies_patrons=True
+        )
+        feed = AcquisitionFeed(self._db, "test", "url", [], annotator)
         entry = feed._make_entry_xml(work, edition)
         annotator.annotate_work_entry(
             work, None, edition, identifier, feed, entry
@@ -668,6 +675,48 @@ class TestLibraryAnnotator(VendorIDTest):
         )
         eq_(expect, analytics_link)
 
+    def test_library_facts_are_looked_up_once(self):
+        # Whether NoveList and analytics are configured is checked
+        # when the annotator is created, not for every entry.
+        old_novelist = NoveListAPI.is_configured
+        old_analytics = Analytics.is_configured
+        calls = []
+        def novelist(library):
+            calls.append(("novelist", library))
+            return True
+        def analytics(library):
+            calls.append(("analytics", library))
+            return False
+        NoveListAPI.is_configured = staticmethod(novelist)
+        Analytics.is_configured = staticmethod(analytics)
+        try:
+            annotator = LibraryAnnotator(
+                None, self._lane(), self._default_library, test_mode=True
+            )
+            eq_(True, annotator.novelist_configured)
+            eq_(False, annotator.analytics_configured)
+            eq_(2, len(calls))
+
+            work = self._work(with_license_pool=True)
+            feed = AcquisitionFeed(self._db, "test", "url", [], annotator)
+            for i in range(3):
+                entry = feed._make_entry_xml(work, work.presentation_edition)
+                annotator.annotate_work_entry(
+                    work, work.license_pools[0], work.presentation_edition,
+                    work.presentation_edition.primary_identifier, feed, entry
+                )
+            eq_(2, len(calls))
+
+            # The NoveList configuration makes a recommendations link
+            # and a related books link available.
+            rels = [x.attrib['rel'] for x in entry.findall(
+                '{%s}link' % OPDSFeed.ATOM_NS)]
+            assert 'recommendations' in rels
+            assert 'related' in rels
+        finally:
+            NoveListAPI.is_configured = old_novelist
+            Analytics.is_configured = old_analytics
+
     def test_annotate_feed(self):
         lane = self._lane()
         linksets = []
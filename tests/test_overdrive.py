@@ -12,6 +12,7 @@ from datetime import (
 from api.overdrive import (
     MockOverdriveAPI,
     OverdriveAPI,
+    OverdriveCirculationMonitor,
     OverdriveCollectionReaper,
     OverdriveFormatSweep,
 )
@@ -1093,6 +1094,66 @@ class TestSyncBookshelf(OverdriveAPITest):
         eq_(5, len(patron.holds))
         assert overdrive_hold in patron.holds
 
+class TestOverdriveCirculationMonitor(OverdriveAPITest):
+
+    def test_parse_command_line(self):
+        eq_(dict(concurrency=5, batch_size=100),
+            OverdriveCirculationMonitor.parse_command_line([]))
+        eq_(dict(concurrency=10, batch_size=20),
+            OverdriveCirculationMonitor.parse_command_line(
+                ["--concurrency=10", "--batch-size=20"]
+            ))
+
+    def test_run_once(self):
+        class MockAPI(MockOverdriveAPI):
+            books = ["a", None, "b", "fail", "c", "d", "e"]
+            unchanged = set()
+            def recently_changed_ids(self, start, cutoff):
+                return self.books
+
+            def circulation_lookup(self, book, exception_on_401=False):
+                if book == "fail":
+                    raise Exception("Doom!")
+                return book, (200, {}, "lookup %s" % book)
+
+            def update_licensepool(self, book, lookup=None):
+                self.updated.append((book, lookup))
+                return None, False, book not in self.unchanged
+
+        for concurrency in (1, 3):
+            monitor = OverdriveCirculationMonitor(
+                self._db, self.collection, api_class=MockAPI,
+                concurrency=concurrency, batch_size=2
+            )
+            monitor.api.updated = []
+            monitor.run_once(None, None)
+
+            # Every book was updated, in order. Empty entries were skipped.
+            eq_(["a", "b", "fail", "c", "d", "e"],
+                [book for book, lookup in monitor.api.updated])
+
+            if concurrency == 1:
+                # update_licensepool looked up each book itself.
+                eq_(set([None]),
+                    set(lookup for book, lookup in monitor.api.updated))
+            else:
+                # The books were looked up ahead of time, by the
+                # workers. A book whose lookup failed is left for
+                # update_licensepool to try again.
+                eq_([("a", (200, {}, "lookup a")), ("fail", None)],
+                    [(book, lookup and lookup[1])
+                     for book, lookup in monitor.api.updated
+                     if book in ("a", "fail")])
+
+        # The monitor still stops after finding a run of unchanged books.
+        MockAPI.unchanged = set(["b", "fail", "c"])
+        monitor.maximum_consecutive_unchanged_books = 3
+        monitor.api.updated = []
+        monitor.run_once(None, None)
+        eq_(["a", "b", "fail", "c"],
+            [book for book, lookup in monitor.api.updated])
+
+
 class TestOverdriveFormatSweep(OverdriveAPITest):
 
     def test_process_item(self):
@@ -8,7 +8,12 @@ import contextlib
 import datetime
 import flask
 import json
+import os
 from StringIO import StringIO
+from sqlalchemy.sql import (
+    literal,
+    select,
+)
 
 from api.adobe_vendor_id import (
     AdobeVendorIDModel,
@@ -22,7 +27,9 @@ from api.config import (
 )
 
 from api.novelist import (
-    NoveListAPI
+    MockNoveListAPI,
+    NoveListAPI,
+    NoveListRecommendationCache,
 )
 
 from core.entrypoint import (
@@ -59,8 +66,10 @@ from core.model import (
     Hyperlink,
     Identifier,
     get_one,
+    get_one_or_create,
     Representation,
     RightsStatus,
+    SessionManager,
     Timestamp,
 )
 
@@ -71,7 +80,10 @@ from core.s3 import MockS3Uploader
 from core.mirror import MirrorUploader
 
 from core.marc import MARCExporter
-from api.marc import LibraryAnnotator as  MARCLibraryAnnotator
+from api.marc import (
+    LibraryAnnotator as  MARCLibraryAnnotator,
+    MARCExportSettings,
+)
 
 from . import (
     DatabaseTest,
@@ -87,6 +99,7 @@ from scripts import (
     InstanceInitializationScript,
     LanguageListScript,
     NovelistSnapshotScript,
+    NoveListRecommendationsScript,
 )
 
 class TestAdobeAccountIDResetScript(DatabaseTest):
@@ -239,6 +252,108 @@ class TestCacheRepresentationPerLane(TestLaneScript):
         eq_((lane, facets2, page1), c3)
         eq_((lane, facets2, page2), c4)
 
+    def test_worker_arguments(self):
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(), cmd_args=[]
+        )
+        eq_(1, script.workers)
+        eq_(True, script.force_refresh)
+
+        script = CacheRepresentationPerLane(
+            self._db, manager=object(),
+            cmd_args=["--workers=4", "--skip-fresh"]
+        )
+        eq_(4, script.workers)
+        eq_(False, script.force_refresh)
+
+    def test_process_library_with_workers(self):
+        class MockFacets(object):
+            def __init__(self, query):
+                self.query_string = query
+
+        class Mock(CacheRepresentationPerLane):
+            SAVE_LANE_TIMINGS = True
+
+            def facets(self, lane):
+                yield MockFacets("facets1")
+                yield MockFacets("facets2")
+
+            def do_generate(self, lane, facets, pagination):
+                self.generated.append((lane, facets.query_string))
+                return "a feed"
+
+            def run_tasks(self, tasks):
+                # Run the tasks in this process instead of in a pool.
+                self.tasks = tasks
+                for task in tasks:
+                    yield self.process_task(*task)
+
+        library = self._default_library
+        fast = self._lane(display_name="Fast")
+        slow = self._lane(display_name="Slow")
+        new = self._lane(display_name="New")
+
+        script = Mock(
+            self._db, manager=object(),
+            cmd_args=["--workers=2", "--min-depth=0"]
+        )
+        script.generated = []
+
+        # The last run found that one lane was much slower than the
+        # other, and didn't see the third lane at all.
+        timestamp, ignore = get_one_or_create(
+            self._db, Timestamp, **script.lane_timings_timestamp_args(library)
+        )
+        timestamp.achievements = json.dumps(
+            {str(fast.id): 1, str(slow.id): 100}
+        )
+        script.process_library(library)
+
+        # There's one task for each combination of lane and facets,
+        # and the lanes most likely to be slow come first.
+        eq_([(library.id, new.id, 0), (library.id, new.id, 1),
+             (library.id, slow.id, 0), (library.id, slow.id, 1),
+             (library.id, fast.id, 0), (library.id, fast.id, 1)],
+            script.tasks)
+        eq_([(new, "facets1"), (new, "facets2"),
+             (slow, "facets1"), (slow, "facets2"),
+             (fast, "facets1"), (fast, "facets2")],
+            script.generated)
+
+        # The time taken by each lane was recorded for next time.
+        timings = script.load_lane_timings(library)
+        eq_(set([str(fast.id), str(slow.id), str(new.id)]),
+            set(timings.keys()))
+        assert timings[str(slow.id)] < 100
+        eq_(timings, json.loads(timestamp.achievements))
+
+    def test_run_tasks_in_worker_processes(self):
+        class Mock(CacheRepresentationPerLane):
+            def __init__(self, _db=None, cmd_args=None, testing=False):
+                super(Mock, self).__init__(
+                    _db, cmd_args=cmd_args, testing=testing,
+                    manager=object()
+                )
+
+            def process_task(self, value):
+                # The worker has a database session of its own.
+                result = self._db.execute(
+                    select([literal(value)])
+                ).scalar()
+                return os.getpid(), result
+
+        script = Mock(self._db, cmd_args=["--workers=1"], testing=True)
+        results = sorted(script.run_tasks([(1,), (2,)]))
+        eq_([1, 2], [value for pid, value in results])
+
+        # The tasks ran in a single worker process, not this one.
+        pids = set([pid for pid, value in results])
+        eq_(1, len(pids))
+        assert os.getpid() not in pids
+
+        # This process's database session still works.
+        eq_(3, self._db.execute(select([literal(3)])).scalar())
+
     def test_default_facets(self):
         # By default, do_generate will only be called once, with facets=None.
         script = CacheRepresentationPerLane(
@@ -582,8 +697,17 @@ class TestCacheMARCFiles(TestLaneScript):
             def records(self, lane, annotator, start_time=None):
                 self.called_with += [(lane, annotator, start_time)]
 
+        class MockCacheMARCFiles(CacheMARCFiles):
+            # Pretend the lane's contents are summarized by this
+            # fingerprint.
+            fingerprint = u"contents"
+
+            def lane_fingerprint(self, lane, settings=None):
+                self.settings = settings
+                return self.fingerprint
+
         exporter = MockMARCExporter(None, None, integration)
-        script = CacheMARCFiles(self._db, cmd_args=[])
+        script = MockCacheMARCFiles(self._db, cmd_args=[])
         script.process_lane(lane, exporter)
 
         # If the script has never been run before, it runs the exporter once
@@ -594,6 +718,9 @@ class TestCacheMARCFiles(TestLaneScript):
         assert isinstance(exporter.called_with[0][1], MARCLibraryAnnotator)
         eq_(None, exporter.called_with[0][2])
 
+        # The export settings went into the fingerprint.
+        assert isinstance(script.settings, MARCExportSettings)
+
         # If we have a cached file already, and it's old enough, the script will
         # run the exporter twice, first to update that file and second to create
         # a file with changes since that first file was originally created.
@@ -609,6 +736,9 @@ class TestCacheMARCFiles(TestLaneScript):
             self._db, CachedMARCFile, library=self._default_library,
             lane=lane, representation=representation, end_time=last_week)
 
+        # The lane's contents have changed since then.
+        MockCacheMARCFiles.fingerprint = u"new contents"
+
         script.process_lane(lane, exporter)
 
         eq_(2, len(exporter.called_with))
@@ -628,7 +758,7 @@ class TestCacheMARCFiles(TestLaneScript):
         eq_([], exporter.called_with)
 
         # But we can force it to run anyway.
-        script = CacheMARCFiles(self._db, cmd_args=["--force"])
+        script = MockCacheMARCFiles(self._db, cmd_args=["--force"])
         script.process_lane(lane, exporter)
 
         eq_(2, len(exporter.called_with))
@@ -642,12 +772,14 @@ class TestCacheMARCFiles(TestLaneScript):
         assert exporter.called_with[1][2] < yesterday
         assert exporter.called_with[1][2] > last_week
 
-        # The update frequency can also be 0, in which case it will always run.
+        # The update frequency can also be 0, in which case it will always
+        # run, so long as the lane's contents have changed.
         ConfigurationSetting.for_library_and_externalintegration(
             self._db, MARCExporter.UPDATE_FREQUENCY, self._default_library,
             integration).value = 0
         exporter.called_with = []
-        script = CacheMARCFiles(self._db, cmd_args=[])
+        MockCacheMARCFiles.fingerprint = u"newer contents"
+        script = MockCacheMARCFiles(self._db, cmd_args=[])
         script.process_lane(lane, exporter)
 
         eq_(2, len(exporter.called_with))
@@ -661,6 +793,88 @@ class TestCacheMARCFiles(TestLaneScript):
         assert exporter.called_with[1][2] < yesterday
         assert exporter.called_with[1][2] > last_week
 
+        # If the lane's contents haven't changed since the last file
+        # was made, there's no need for new files.
+        exporter.called_with = []
+        script.process_lane(lane, exporter)
+        eq_([], exporter.called_with)
+
+        # The fingerprint of what went into the last file is kept in
+        # a Timestamp for the lane.
+        timestamp = script.fingerprint_timestamp(self._default_library, lane)
+        eq_(u"newer contents", timestamp.achievements)
+
+        # Any change to the lane's contents means new files.
+        MockCacheMARCFiles.fingerprint = u"different contents"
+        script.process_lane(lane, exporter)
+        eq_(2, len(exporter.called_with))
+
+        # And the files can always be regenerated by force.
+        exporter.called_with = []
+        script = MockCacheMARCFiles(self._db, cmd_args=["--force"])
+        script.process_lane(lane, exporter)
+        eq_(2, len(exporter.called_with))
+
+        # If the lane's contents can't be found, the files are always
+        # regenerated.
+        MockCacheMARCFiles.fingerprint = None
+        exporter.called_with = []
+        script = MockCacheMARCFiles(self._db, cmd_args=[])
+        script.process_lane(lane, exporter)
+        script.process_lane(lane, exporter)
+        eq_(4, len(exporter.called_with))
+
+    def test_lane_fingerprint(self):
+        script = CacheMARCFiles(self._db, cmd_args=[])
+        lane = self._lane(genres=["Science Fiction"])
+        work = self._work(with_license_pool=True, genre="Science Fiction")
+        SessionManager.refresh_materialized_views(self._db)
+        original = script.lane_fingerprint(lane)
+        eq_(original, script.lane_fingerprint(lane))
+
+        # A work that's not in the lane doesn't change the fingerprint.
+        self._work(with_license_pool=True, genre="Romance")
+        SessionManager.refresh_materialized_views(self._db)
+        eq_(original, script.lane_fingerprint(lane))
+
+        # A change to a work in the lane does.
+        work.last_update_time = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        SessionManager.refresh_materialized_views(self._db)
+        updated = script.lane_fingerprint(lane)
+        assert updated != original
+
+        # So does a work joining the lane.
+        self._work(with_license_pool=True, genre="Science Fiction")
+        SessionManager.refresh_materialized_views(self._db)
+        newest = script.lane_fingerprint(lane)
+        assert newest not in (original, updated)
+
+        # The export settings are part of the fingerprint, so
+        # changing them means the files are made again.
+        library = self._default_library
+        integration = self._external_integration(
+            ExternalIntegration.MARC_EXPORT, ExternalIntegration.CATALOG_GOAL,
+            libraries=[library]
+        )
+        def fingerprint():
+            settings = MARCExportSettings(library, integration)
+            return script.lane_fingerprint(lane, settings)
+        with_settings = fingerprint()
+        assert with_settings != newest
+        eq_(with_settings, fingerprint())
+
+        for key, value in (
+            (MARCExporter.MARC_ORGANIZATION_CODE, "org"),
+            (MARCExporter.INCLUDE_SUMMARY, "true"),
+            (MARCExporter.INCLUDE_SIMPLIFIED_GENRES, "true"),
+            (MARCExporter.WEB_CLIENT_URL, "http://web-client/"),
+        ):
+            ConfigurationSetting.for_library_and_externalintegration(
+                self._db, key, library, integration
+            ).value = value
+            changed = fingerprint()
+            assert changed != with_settings
+            with_settings = changed
 
 
 class TestInstanceInitializationScript(DatabaseTest):
@@ -947,6 +1161,19 @@ class TestDirectoryImportScript(DatabaseTest):
         )
         eq_(collection2, collection)
 
+    def test_load_metadata(self):
+        # An ONIX file is parsed lazily, as the Metadata objects
+        # are needed.
+        path = os.path.join(
+            os.path.split(__file__)[0], "files", "onix", "onix_example.xml"
+        )
+        script = DirectoryImportScript(self._db)
+        records = script.load_metadata(path, "onix", "A data source")
+        eq_(None, getattr(records, '__len__', None))
+
+        [metadata] = list(records)
+        eq_("Safe Spaces, Brave Spaces", metadata.title)
+
     def test_work_from_metadata(self):
         """Validate the ability to create a new Work from appropriate metadata.
         """
@@ -1290,3 +1517,33 @@ class TestNovelistSnapshotScript(DatabaseTest):
         eq_(params[0], l1)
 
         NoveListAPI.from_config = oldNovelistConfig
+
+
+class TestNoveListRecommendationsScript(DatabaseTest):
+
+    def test_process_library(self):
+        library = self._default_library
+        cache = NoveListRecommendationCache(library)
+        work = self._work(with_license_pool=True)
+        identifier = work.presentation_edition.primary_identifier
+        recommendation = self._identifier()
+        eq_(None, cache.get(identifier))
+
+        # If NoveList isn't configured, nothing is looked up.
+        script = NoveListRecommendationsScript(self._db)
+        script.process_library(library)
+        eq_([identifier], cache.pending())
+
+        source = DataSource.lookup(self._db, DataSource.NOVELIST)
+        api = MockNoveListAPI(self._db)
+        api.setup(Metadata(source, recommendations=[recommendation]))
+
+        class Mock(NoveListRecommendationsScript):
+            def novelist_api(self, library):
+                return api
+
+        # Otherwise, the recommendations that are waiting to be looked
+        # up are found and stored.
+        Mock(self._db).process_library(library)
+        eq_([], cache.pending())
+        eq_([recommendation], cache.get(identifier))
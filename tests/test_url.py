@@ -0,0 +1,170 @@
+# encoding=utf8
+from nose.tools import (
+    assert_raises,
+    eq_,
+    set_trace,
+)
+import flask
+from werkzeug.routing import BuildError
+
+from api.app import app
+from api import routes
+from api.util import url as url_module
+from api.util.url import (
+    URLTemplate,
+    URLTemplateCache,
+)
+
+
+class TestURLTemplateCache(object):
+
+    def setup(self):
+        self.cache = URLTemplateCache()
+
+    def test_output_matches_url_for(self):
+        # These URLs are built from library_route() and
+        # library_dir_route() routes, with a variety of values.
+        values = [
+            "simple", u"ünicode", "a/path/with:colons", "spaces and+plus",
+            "percent%25", "?query&chars=#", 12345, "..", "",
+        ]
+        calls = [
+            ("permalink", dict(identifier_type="URI")),
+            ("borrow", dict(identifier_type="ISBN")),
+            ("borrow", dict(identifier_type="ISBN", mechanism_id=4)),
+            ("related_books", dict(identifier_type="Overdrive ID")),
+            ("track_analytics_event", dict(
+                identifier_type="URI", event_type="open_book"
+            )),
+        ]
+        with app.test_request_context(
+            "/", base_url="https://circulation.example.org/prefix/"
+        ):
+            for endpoint, kwargs in calls:
+                for value in values:
+                    kwargs = dict(kwargs)
+                    kwargs['identifier'] = value
+                    for library in ("default", u"lïbrary", None):
+                        kwargs['library_short_name'] = library
+                        expect = flask.url_for(
+                            endpoint, _external=True, **kwargs
+                        )
+                        actual = self.cache.url_for(
+                            endpoint, _external=True, **kwargs
+                        )
+                        eq_(expect, actual)
+                        eq_(type(expect), type(actual))
+
+            # Contributor and series routes have optional arguments,
+            # and different rules are used depending on which
+            # arguments are present.
+            for endpoint, name in (("contributor", "contributor_name"),
+                                   ("series", "series_name")):
+                for languages in (None, "eng", "eng,spa"):
+                    for audiences in (None, "Adult", "Young Adult"):
+                        kwargs = {
+                            name: u"Ḟ/ïrst, Last",
+                            "languages": languages,
+                            "audiences": audiences,
+                            "library_short_name": "default",
+                        }
+                        eq_(flask.url_for(endpoint, _external=True, **kwargs),
+                            self.cache.url_for(
+                                endpoint, _external=True, **kwargs
+                            ))
+
+            # A single extra argument goes into the query string.
+            for value in values:
+                kwargs = dict(
+                    lane_identifier=5, library_short_name="default",
+                    entrypoint=value
+                )
+                eq_(flask.url_for("feed", _external=True, **kwargs),
+                    self.cache.url_for("feed", _external=True, **kwargs))
+
+    def test_template_is_reused(self):
+        calls = []
+        old_url_for = url_module.url_for
+        def mock_url_for(*args, **kwargs):
+            calls.append((args, kwargs))
+            return old_url_for(*args, **kwargs)
+        url_module.url_for = mock_url_for
+        try:
+            with app.test_request_context(
+                "/", base_url="http://first.example.org/"
+            ):
+                for identifier in ("1", "2", "3"):
+                    self.cache.url_for(
+                        "permalink", identifier_type="ISBN",
+                        identifier=identifier, library_short_name="default",
+                        _external=True
+                    )
+                # url_for was only called once, to build the template.
+                eq_(1, len(calls))
+
+                # Different arguments mean a different template.
+                self.cache.url_for(
+                    "permalink", identifier_type="ISBN",
+                    identifier="1", _external=True
+                )
+                eq_(2, len(calls))
+
+            # So does a different host.
+            with app.test_request_context(
+                "/", base_url="http://second.example.org/"
+            ):
+                url = self.cache.url_for(
+                    "permalink", identifier_type="ISBN",
+                    identifier="1", _external=True
+                )
+                eq_(3, len(calls))
+                assert url.startswith("http://second.example.org/")
+        finally:
+            url_module.url_for = old_url_for
+
+    def test_fallback_to_url_for(self):
+        with app.test_request_context("/"):
+            def untemplated(endpoint, **kwargs):
+                eq_(None, self.cache.template_for(endpoint, kwargs))
+                eq_(flask.url_for(endpoint, **kwargs),
+                    self.cache.url_for(endpoint, **kwargs))
+
+            # Relative URLs aren't built from templates.
+            untemplated(
+                "permalink", identifier_type="ISBN", identifier="1",
+                library_short_name="default"
+            )
+
+            # Neither are URLs with anchors.
+            untemplated(
+                "permalink", identifier_type="ISBN", identifier="1",
+                library_short_name="default", _external=True, _anchor="a"
+            )
+
+            # Or URLs with more than one argument in the query string,
+            # since their order isn't predictable.
+            untemplated(
+                "feed", lane_identifier=5, library_short_name="default",
+                order="title", available="all", _external=True
+            )
+
+            # An unknown endpoint raises the same error as url_for.
+            assert_raises(
+                BuildError, self.cache.url_for, "no_such_endpoint",
+                _external=True
+            )
+
+        # Outside of a request, url_for is used.
+        eq_(None, self.cache.template_for(
+            "permalink", dict(identifier_type="ISBN", identifier="1",
+                              _external=True)
+        ))
+
+
+class TestURLTemplate(object):
+
+    def test_fill(self):
+        template = URLTemplate(
+            ["http://host/", ("a", lambda x: x.upper()), "/", ("b", str)]
+        )
+        eq_("http://host/VALUE/1", template.fill(dict(a="value", b=1)))